@@ -1,10 +1,16 @@
-from fastapi import FastAPI                                # импортируем FastAPI
+from fastapi import FastAPI, HTTPException, Request, Response  # импортируем FastAPI
+from fastapi.responses import JSONResponse, StreamingResponse  # потоковые ответы (SSE)
 from pydantic import BaseModel                             # валидация входа/выхода
 from app.backend.services.vector_store import store        # доступ к FAISS
 from app.backend.core.config import get_settings           # настройки
-from app.backend.core.rag_graph import run_rag
+from app.backend.core.rag_graph import abatch_rag, arun_rag, astream_rag
+from app.backend.core.retriever import find_quote
+from app.backend.core.metrics import render_latest, track_request
+from app.backend.services.llm_gateway import LLMUnavailableError
+from app.data_processing.ingestion.book_parser import book_title, list_book_files
+import json
 import os
-from typing import List
+from typing import Any, Dict, List, Optional
 
 
 
@@ -26,21 +32,56 @@ class PassageWithMetadata(BaseModel):
 class AskRequest(BaseModel):                               # схема входа POST /ask
     question: str                                          # поле вопроса
     top_k: int = 4                                         # число пассажей
+    books: Optional[List[str]] = None                      # имена файлов книг (None — все книги)
 
 
 class AskResponse(BaseModel):                              # схема ответа
     answer: str                                            # финальный текст
     passages: List[PassageWithMetadata]                    # список пассажей с метаданными
 
+
+class AskBatchRequest(BaseModel):                          # схема входа POST /ask/batch
+    questions: List[str]                                   # вопросы
+    top_k: int = 4                                         # число пассажей на вопрос
+    books: Optional[List[str]] = None                      # фильтр по книгам для всех вопросов
+    stream: bool = False                                   # NDJSON по мере готовности вместо списка
+
+
+class AskBatchItem(BaseModel):
+    index: int                                             # номер вопроса в запросе
+    question: str
+    answer: str = ""
+    passages: List[PassageWithMetadata] = []
+    error: Optional[str] = None
+
+
+class AskBatchResponse(BaseModel):
+    results: List[AskBatchItem]                            # в порядке вопросов запроса
+
 @app.on_event("startup")                                   # хук на старт приложения
 def _load_index():                                         # функция загрузки индекса
     store.load()                                           # загружаем FAISS + метаданные
 
+@app.exception_handler(LLMUnavailableError)
+async def _llm_unavailable(request: Request, exc: LLMUnavailableError) -> JSONResponse:
+    # Шлюз LLM перегружен или предохранитель разомкнут — клиенту стоит повторить позже
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, round(exc.retry_after)))},
+    )
+
 @app.get("/health")                                        # эндпоинт проверки
 def health():                                              # функция обработчик
     return {"status": "ok"}                                # простой JSON
 
 
+@app.get("/metrics")                                       # метрики для Prometheus
+def metrics() -> Response:
+    body, content_type = render_latest()
+    return Response(content=body, media_type=content_type)
+
+
 class BookInfo(BaseModel):
     filename: str
     title: str
@@ -53,27 +94,147 @@ def get_books() -> List[BookInfo]:
     books = []
     raw_dir = settings.RAW_DIR
 
-    if os.path.exists(raw_dir):
-        for filename in sorted(os.listdir(raw_dir)):
-            if filename.lower().endswith('.pdf'):
-                # Извлекаем читаемое название из имени файла
-                title = filename.replace('.pdf', '').replace('_', ' ')
-                books.append(BookInfo(
-                    filename=filename,
-                    title=title,
-                    path=os.path.join(raw_dir, filename)
-                ))
+    for filename in list_book_files(raw_dir):
+        books.append(BookInfo(
+            filename=filename,
+            title=book_title(filename),
+            path=os.path.join(raw_dir, filename)
+        ))
 
     return books
 
 
+class QuoteRequest(BaseModel):                             # схема входа POST /quote
+    phrase: str                                            # искомая фраза (без кавычек)
+    limit: int = 20                                        # максимум вхождений
+    books: Optional[List[str]] = None                      # имена файлов книг (None — все книги)
+
+
+class QuoteMatch(BaseModel):
+    chunk_id: int
+    text: str
+    occurrences: int
+    metadata: PassageMetadata
+
+
+class QuoteResponse(BaseModel):
+    matches: List[QuoteMatch]
+
+
+@app.post("/quote", response_model=QuoteResponse)
+def quote(req: QuoteRequest, response: Response) -> QuoteResponse:
+    """Дословный поиск фразы по индексу цитат — без эмбеддинга и LLM, за миллисекунды."""
+    with track_request() as timings:
+        matches = find_quote(req.phrase, limit=req.limit, books=req.books)
+    response.headers["Server-Timing"] = timings.server_timing()
+    if matches is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Quote index is not built: run python -m app.backend.services.quote_index",
+        )
+
+    return QuoteResponse(matches=[
+        QuoteMatch(
+            chunk_id=m["chunk_id"],
+            text=m["text"],
+            occurrences=m["occurrences"],
+            metadata=PassageMetadata(
+                page_number=m["metadata"].get("page_number", 0),
+                book_name=m["metadata"].get("book_name", ""),
+                filename=m["metadata"].get("filename", ""),
+            ),
+        )
+        for m in matches
+    ])
+
+
 @app.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest) -> AskResponse:
-    final_state = run_rag(req.question, top_k=req.top_k)
+async def ask(req: AskRequest, response: Response) -> AskResponse:
+    # async-эндпоинт: пока ждём LLM, запрос не держит поток из пула Starlette
+    with track_request() as timings:
+        final_state = await arun_rag(req.question, top_k=req.top_k, books=req.books)
+    # разбивка времени по стадиям видна прямо в DevTools браузера
+    response.headers["Server-Timing"] = timings.server_timing()
+    response.headers["X-Context-Tokens-Saved"] = str(timings.tokens["context_saved"])
+
+    return AskResponse(
+        answer=final_state["answer"],
+        passages=_to_passages_with_metadata(final_state.get("passages", [])),
+    )
+
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest) -> StreamingResponse:
+    """
+    Тот же /ask, но через Server-Sent Events:
+      event: passages — найденные фрагменты, сразу после retrieve;
+      event: token    — очередной кусок ответа LLM;
+      event: done     — финальный ответ целиком;
+      event: error    — если граф упал посреди генерации.
+    """
+    async def events():
+        try:
+            async for event, data in astream_rag(req.question, top_k=req.top_k, books=req.books):
+                if event == "passages":
+                    payload: Any = [p.model_dump() for p in _to_passages_with_metadata(data)]
+                    yield _sse("passages", payload)
+                elif event == "token":
+                    yield _sse("token", data)
+                elif event == "answer":
+                    yield _sse("done", {"answer": data})
+        except Exception as exc:
+            yield _sse("error", {"detail": str(exc)})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/ask/batch", response_model=AskBatchResponse)
+async def ask_batch(req: AskBatchRequest, response: Response):
+    """
+    Много вопросов за один вызов: один проход эмбеддинга и один поиск FAISS
+    на всю пачку, LLM-стадии — конкурентно (BATCH_CONCURRENCY).
+    stream=true — NDJSON, по строке на вопрос в порядке готовности (с полем index).
+    """
+    if len(req.questions) > settings.BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many questions: {len(req.questions)} > BATCH_MAX_QUESTIONS={settings.BATCH_MAX_QUESTIONS}",
+        )
 
+    def to_item(index: int, state: Dict[str, Any]) -> AskBatchItem:
+        return AskBatchItem(
+            index=index,
+            question=req.questions[index],
+            answer=state.get("answer", ""),
+            passages=_to_passages_with_metadata(state.get("passages", [])),
+            error=state.get("error"),
+        )
+
+    if req.stream:
+        async def lines():
+            async for index, state in abatch_rag(req.questions, top_k=req.top_k, books=req.books):
+                yield to_item(index, state).model_dump_json() + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    with track_request() as timings:
+        results = [to_item(i, state) async for i, state in abatch_rag(req.questions, top_k=req.top_k, books=req.books)]
+    response.headers["Server-Timing"] = timings.server_timing()
+    return AskBatchResponse(results=sorted(results, key=lambda item: item.index))
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _to_passages_with_metadata(passages) -> List[PassageWithMetadata]:
     # Преобразуем passages в новый формат с метаданными
     passages_with_metadata = []
-    for passage_data in final_state.get("passages", []):
+    for passage_data in passages:
         if len(passage_data) == 3:
             # Новый формат: (text, score, metadata)
             text, score, metadata = passage_data
@@ -99,7 +260,4 @@ def ask(req: AskRequest) -> AskResponse:
                 )
             )
 
-    return AskResponse(
-        answer=final_state["answer"],
-        passages=passages_with_metadata,
-    )
\ No newline at end of file
+    return passages_with_metadata
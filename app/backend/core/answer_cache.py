@@ -0,0 +1,209 @@
+# app/backend/core/answer_cache.py
+
+"""
+Семантический кэш ответов перед run_rag.
+
+Перефразированные вопросы о тех же книгах не должны заново проходить
+планировщик, retrieve и генерацию. Поэтому храним готовые ответы вместе
+с эмбеддингом вопроса. На новый вопрос ищем ближайший сохранённый (FAISS,
+cosine через inner product) и, если сходство выше порога, отдаём его ответ
+и фрагменты.
+
+Записи разделены по пространствам: top_k, фильтр по книгам, LLM (провайдер,
+адрес сервера и модель) и метка сборки индекса.
+Поэтому после переиндексации или смены модели старые ответы не используются.
+Данные лежат в SQLite (WAL), так что кэш общий для всех воркеров uvicorn.
+В памяти каждого процесса — FAISS-индекс по эмбеддингам; новые записи других
+процессов дочитываются инкрементально по id.
+
+Записи старше ANSWER_CACHE_TTL не отдаются: среди всех вопросов выше порога
+сходства берётся ближайший живой. Просроченные строки удаляются из SQLite при
+записи (не чаще раза в _PURGE_INTERVAL_S), а индекс пространства в памяти
+пересобирается, когда просроченных в нём больше половины.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from app.backend.core.config import get_settings
+from app.backend.core.metrics import ANSWER_CACHE_LOOKUPS
+from app.backend.services.embeddings import embed_query
+from app.backend.services.llm import llm_identity
+from app.backend.services.vector_store import store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    namespace TEXT NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    answer TEXT NOT NULL,
+    passages TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS answers_namespace_id ON answers(namespace, id);
+CREATE INDEX IF NOT EXISTS answers_created_at ON answers(created_at);
+"""
+
+_PURGE_INTERVAL_S = 60.0
+
+
+class _NamespaceIndex:
+    """FAISS-индекс эмбеддингов вопросов одного пространства + соответствие позиций id строк."""
+
+    def __init__(self) -> None:
+        self.index: Optional[faiss.IndexFlatIP] = None
+        self.row_ids: List[int] = []
+        self.created_at = np.empty(0, dtype=np.float64)
+        self.last_id = 0
+
+
+class SemanticAnswerCache:
+    def __init__(self, path: str, threshold: float, ttl_seconds: float = 0.0) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._namespaces: Dict[str, _NamespaceIndex] = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _expires_before(self) -> float:
+        """Записи, созданные раньше этого момента, просрочены (при TTL 0 — никакие)."""
+        return time.time() - self.ttl_seconds if self.ttl_seconds > 0 else float("-inf")
+
+    def _sync(self, namespace: str) -> _NamespaceIndex:
+        """Дочитывает в память живые записи пространства, добавленные после последней синхронизации."""
+        ns = self._namespaces.get(namespace)
+        expires_before = self._expires_before()
+        if ns is None or np.count_nonzero(ns.created_at < expires_before) * 2 > len(ns.row_ids):
+            # Больше половины индекса — просроченные записи: пересобираем с нуля
+            ns = self._namespaces[namespace] = _NamespaceIndex()
+        rows = self._conn.execute(
+            "SELECT id, embedding, created_at FROM answers "
+            "WHERE namespace = ? AND id > ? AND created_at >= ? ORDER BY id",
+            (namespace, ns.last_id, expires_before),
+        ).fetchall()
+        if rows:
+            vecs = np.stack([np.frombuffer(blob, dtype="float32") for _, blob, _ in rows])
+            if ns.index is None:
+                ns.index = faiss.IndexFlatIP(vecs.shape[1])
+            ns.index.add(vecs)
+            ns.row_ids.extend(row_id for row_id, _, _ in rows)
+            ns.created_at = np.concatenate((ns.created_at, [created for _, _, created in rows]))
+            ns.last_id = rows[-1][0]
+        return ns
+
+    def lookup(self, question_vec: np.ndarray, namespace: str) -> Optional[Dict[str, Any]]:
+        """Ближайший сохранённый ответ со сходством не ниже порога или None."""
+        with self._lock:
+            ns = self._sync(namespace)
+            if ns.index is None or ns.index.ntotal == 0:
+                return None
+
+            # Все вопросы выше порога, а не один ближайший: просроченный сосед
+            # не должен заслонять живую запись чуть дальше
+            _, scores, idx = ns.index.range_search(question_vec.reshape(1, -1).astype("float32"), self.threshold)
+            expires_before = self._expires_before()
+            for pos in np.argsort(-scores):
+                if ns.created_at[idx[pos]] < expires_before:
+                    continue
+                row = self._conn.execute(
+                    "SELECT question, answer, passages FROM answers WHERE id = ? AND created_at >= ?",
+                    (ns.row_ids[idx[pos]], expires_before),
+                ).fetchone()
+                if row is not None:
+                    question, answer, passages = row
+                    return {
+                        "question": question,
+                        "answer": answer,
+                        "passages": [tuple(p) for p in json.loads(passages)],
+                        "similarity": float(scores[pos]),
+                    }
+        return None
+
+    def purge_expired(self) -> int:
+        """Удаляет просроченные записи из SQLite. Возвращает число удалённых строк."""
+        if self.ttl_seconds <= 0:
+            return 0
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM answers WHERE created_at < ?", (self._expires_before(),)
+            ).rowcount
+            self._conn.commit()
+            self._last_purge = time.time()
+        return deleted
+
+    def store(
+        self,
+        namespace: str,
+        question: str,
+        question_vec: np.ndarray,
+        answer: str,
+        passages: List[Any],
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO answers (namespace, question, embedding, answer, passages, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    namespace,
+                    question,
+                    np.asarray(question_vec, dtype="float32").reshape(-1).tobytes(),
+                    answer,
+                    json.dumps([list(p) for p in passages], ensure_ascii=False),
+                    time.time(),
+                ),
+            )
+            self._conn.commit()
+        if time.time() - self._last_purge >= _PURGE_INTERVAL_S:
+            self.purge_expired()
+
+
+@lru_cache(maxsize=1)
+def get_answer_cache() -> SemanticAnswerCache:
+    settings = get_settings()
+    return SemanticAnswerCache(
+        path=settings.ANSWER_CACHE_PATH,
+        threshold=settings.ANSWER_CACHE_THRESHOLD,
+        ttl_seconds=settings.ANSWER_CACHE_TTL,
+    )
+
+
+def _namespace(top_k: int, books: Optional[List[str]] = None) -> str:
+    namespace = f"top_k={top_k}|llm={llm_identity()}|index={store.version}"
+    if books:
+        namespace += "|books=" + ",".join(sorted(books))
+    return namespace
+
+
+def lookup_answer(question: str, top_k: int, books: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Готовый ответ на этот или очень похожий вопрос, если он есть в кэше."""
+    if not get_settings().ANSWER_CACHE_ENABLED:
+        return None
+    hit = get_answer_cache().lookup(embed_query(question), _namespace(top_k, books))
+    ANSWER_CACHE_LOOKUPS.labels("hit" if hit else "miss").inc()
+    return hit
+
+
+def store_answer(
+    question: str,
+    top_k: int,
+    answer: str,
+    passages: List[Any],
+    books: Optional[List[str]] = None,
+) -> None:
+    # Пустые результаты не кэшируем: их дешевле пересчитать, чем держать в кэше
+    if not get_settings().ANSWER_CACHE_ENABLED or not answer or not passages:
+        return
+    get_answer_cache().store(_namespace(top_k, books), question, embed_query(question), answer, passages)
@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Optional
 from pathlib import Path
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -13,10 +14,120 @@ class Settings(BaseSettings):
 
     # --- embeddings / data paths ---
     EMBEDDING_MODEL: str = "intfloat/multilingual-e5-base"
+    # torch — SentenceTransformer; onnx / onnx-int8 — onnxruntime без torch (модель из EMBEDDING_MODEL_PATH)
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_MODEL_PATH: str = ""          # локальная директория с моделью ("" — скачать EMBEDDING_MODEL)
+    EMBEDDING_MAX_LENGTH: int = 512         # максимум токенов на текст для ONNX-бэкенда
     INDEX_DIR: str = str(DATA_DIR / "indexes")      # можно переопределить через .env
     PROCESSED_DIR: str = str(DATA_DIR / "processed")
     RAW_DIR: str = str(DATA_DIR / "raw")
 
+    # --- FAISS-индекс ---
+    FAISS_INDEX_TYPE: str = "flat"          # flat (точный перебор) | hnsw | ivf
+    HNSW_M: int = 32                        # связность графа HNSW
+    HNSW_EF_CONSTRUCTION: int = 200
+    HNSW_EF_SEARCH: int = 64                # ширина поиска HNSW (точность/скорость)
+    IVF_NLIST: int = 0                      # число кластеров IVF (0 — ~4*sqrt(N))
+    IVF_NPROBE: int = 8                     # сколько кластеров IVF просматривать при поиске
+
+    # --- разбор книг при индексации ---
+    PARSE_WORKERS: int = 0                  # процессов в пуле парсинга (0 — по числу ядер)
+    PARSE_PAGES_PER_TASK: int = 32          # страниц PDF в одной задаче пула
+    PARSE_PAGE_TIMEOUT: float = 30.0        # секунд на страницу, дольше — страница пропускается (0 — без лимита)
+
+    # --- кэш эмбеддингов фрагментов при индексации ---
+    EMBED_CACHE_ENABLED: bool = True
+    EMBED_CACHE_PATH: str = str(DATA_DIR / "cache" / "embeddings.sqlite")
+
+    # --- микробатчинг эмбеддингов запросов ---
+    EMBED_BATCHING: bool = True
+    EMBED_BATCH_MAX_SIZE: int = 32          # максимум текстов в одном forward-проходе
+    EMBED_BATCH_MAX_WAIT_MS: float = 5.0    # сколько ждать попутчиков после первого запроса
+    EMBED_NUM_THREADS: int = 0              # потоков torch на воркере батчера (0 — по умолчанию)
+
+    # --- кэш эмбеддингов запросов ---
+    QUERY_CACHE_SIZE: int = 2048            # записей в памяти (0 — кэш в памяти выключен)
+    QUERY_CACHE_TTL: float = 3600.0         # секунд жизни записи в памяти (0 — без TTL)
+    QUERY_CACHE_DIR: str = ""               # дисковый уровень, общий для воркеров ("" — выключен)
+    QUERY_CACHE_DISK_MAX_ROWS: int = 100_000  # при заполнении вытесняется старейшая половина записей
+
+    # --- retrieval ---
+    # dense — только FAISS; hybrid — FAISS + BM25 со слиянием RRF; lexical — только BM25
+    RETRIEVAL_MODE: str = "dense"
+    RRF_K: int = 60                         # сглаживание reciprocal rank fusion
+    HYBRID_CANDIDATES: int = 50             # кандидатов из каждого ранжирования перед слиянием
+    # вопрос с цитатой в кавычках («...», "...") ищется только по BM25, без эмбеддинга
+    QUOTE_FAST_PATH: bool = True
+    # потоки, в которых async-эндпоинты выполняют эмбеддинг запроса и поиск FAISS
+    RETRIEVAL_WORKERS: int = 4
+    # запускать retrieve(question) параллельно с первым вызовом планировщика
+    SPECULATIVE_RETRIEVAL: bool = True
+
+    # --- LLM ---
+    # mistral — API Mistral; openai — OpenAI-совместимый сервер по LLM_BASE_URL; fake — локальная модель без сети
+    LLM_PROVIDER: str = "mistral"
+    LLM_MODEL: str = "mistral-small-latest"
+    LLM_BASE_URL: str = ""                  # для openai, например http://localhost:8000/v1
+    LLM_API_KEY: str = ""                   # ключ OpenAI-совместимого сервера ("" — без ключа)
+    # fake: время до первого токена и скорость выдачи — логнормальные (медиана и sigma, 0 — без разброса)
+    FAKE_LLM_LATENCY_MS: float = 300.0
+    FAKE_LLM_LATENCY_SIGMA: float = 0.0
+    FAKE_LLM_TOKENS_PER_S: float = 50.0     # 0 — ответ целиком сразу после задержки
+    FAKE_LLM_TOKENS_PER_S_SIGMA: float = 0.0
+    FAKE_LLM_ANSWER_TOKENS: int = 60        # длина ответа генератора в словах
+    FAKE_LLM_SEED: Optional[int] = None
+    # Шлюз LLM (на процесс): конкурентность, лимиты провайдера, повторы и предохранитель
+    LLM_GATEWAY: bool = True
+    LLM_MAX_CONCURRENCY: int = 16
+    LLM_RPS: float = 0.0                    # запросов в секунду (0 — без лимита)
+    LLM_TPM: float = 0.0                    # токенов в минуту (0 — без лимита)
+    LLM_MAX_RETRIES: int = 4                # повторы на 429 / 5xx / сетевые ошибки
+    LLM_RETRY_BASE_S: float = 0.5
+    LLM_RETRY_MAX_S: float = 20.0
+    LLM_QUEUE_TIMEOUT_S: float = 60.0       # сколько вызов может ждать очереди, лимитов и повторов
+    LLM_BREAKER_THRESHOLD: int = 5          # неудачных попыток подряд до размыкания (0 — выключен)
+    LLM_BREAKER_COOLDOWN_S: float = 30.0
+    # HTTP-клиент mistral / openai: таймаут запроса и пул keep-alive соединений
+    LLM_TIMEOUT_S: float = 120.0
+    LLM_MAX_CONNECTIONS: int = 32
+    LLM_KEEPALIVE_S: float = 60.0
+
+    # --- семантический кэш ответов ---
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_PATH: str = str(DATA_DIR / "cache" / "answers.sqlite")
+    ANSWER_CACHE_THRESHOLD: float = 0.95    # минимальное cosine-сходство вопросов для попадания
+    ANSWER_CACHE_TTL: float = 7 * 24 * 3600  # секунд жизни записи (0 — бессрочно)
+
+    # --- RAG-граф ---
+    MAX_TOOL_CALLS: int = 2
+    # POST /ask/batch: сколько вопросов одновременно проходят LLM-стадии и сколько можно прислать за раз
+    BATCH_CONCURRENCY: int = 8
+    BATCH_MAX_QUESTIONS: int = 1000
+    # Склейка одинаковых одновременных запросов (вопрос, top_k, книги): считает один, остальные ждут;
+    # между воркерами — через файловую блокировку и кэш ответов (нужен ANSWER_CACHE_ENABLED)
+    COALESCE_ENABLED: bool = True
+    COALESCE_CROSS_WORKER: bool = True
+    COALESCE_LOCK_DIR: str = str(DATA_DIR / "cache" / "inflight")
+    COALESCE_WAIT_S: float = 60.0           # сколько ждать чужой воркер, прежде чем считать самим
+    # planner    — после каждого вызова инструмента следующий шаг решает LLM-планировщик;
+    # confidence — уверенный результат retrieve сразу идёт в generate без планировщика
+    RAG_ROUTING: str = "planner"
+    CONFIDENCE_MIN_TOP_SCORE: float = 0.82   # минимальный скор лучшего фрагмента
+    CONFIDENCE_MIN_SCORE_GAP: float = 0.0    # минимальный отрыв лучшего фрагмента от второго
+    CONFIDENCE_MIN_PASSAGES: int = 1         # сколько фрагментов должно найтись
+    # Сборка контекста: склейка перекрывающихся чанков страницы, порог скора и бюджет токенов.
+    # Выключена по умолчанию: /ask отдаёт собранные фрагменты, и их бывает меньше top_k
+    CONTEXT_PACKING: bool = False
+    CONTEXT_MIN_RELATIVE_SCORE: float = 0.85  # доля от скора лучшего фрагмента (0 — без порога)
+    CONTEXT_TOKEN_BUDGET: int = 1000          # оценка токенов на все фрагменты (0 — без лимита)
+    # Планировщик видит фрагменты как [N] + скор + начало текста; полные тексты — только генератор
+    PLANNER_SNIPPET_CHARS: int = 160          # длина сниппета (0 — только номер и скор)
+    PLANNER_HISTORY_MESSAGES: int = 6         # последних сообщений истории после вопроса (0 — все)
+
+    # --- наблюдаемость ---
+    # доля запросов, для которых шаги графа пишутся в лог JSON-сводкой (0 — выключено)
+    STATE_LOG_SAMPLE_RATE: float = 0.05
+
     # --- frontend (чтобы .env не ругался) ---
     FRONTEND_HOST: str = "0.0.0.0"
     FRONTEND_PORT: int = 8501
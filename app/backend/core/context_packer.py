@@ -0,0 +1,160 @@
+# app/backend/core/context_packer.py
+
+"""
+Сборка контекста генератора из найденных фрагментов.
+
+Соседние чанки одной страницы перекрываются на chunk_overlap символов, поэтому
+при большом top_k в промпт попадает один и тот же текст по нескольку раз.
+pack_context:
+
+1. отбрасывает фрагменты с косинусным скором ниже CONTEXT_MIN_RELATIVE_SCORE
+   от лучшего косинусного; дословные цитаты и кандидаты BM25 (metadata["match"],
+   скор 0 у кандидатов только BM25 в hybrid) порогом не отсекаются — их скоры
+   в другой шкале;
+2. склеивает перекрывающиеся и соседние чанки одной страницы по смещению
+   char_start из хранилища; у индексов без смещений убирает точные дубли;
+3. укладывает результат в CONTEXT_TOKEN_BUDGET по порядку релевантности;
+   дословные цитаты остаются всегда.
+
+Склеенный фрагмент стоит на месте лучшего из своих чанков, поэтому нумерация
+цитат [1], [2]... одна у планировщика, генератора, в SSE и в ответе API.
+Токены оцениваются по длине текста, без токенизатора.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.backend.core.config import get_settings
+from app.backend.core.metrics import CONTEXT_TOKENS_SAVED, current_timings
+
+CHARS_PER_TOKEN = 4   # та же грубая оценка, что у лимита токенов в шлюзе LLM
+
+Passage = Tuple[str, float, Dict[str, Any]]
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+class _Span:
+    """Фрагмент в работе: rank — позиция лучшего из склеенных чанков в выдаче."""
+
+    __slots__ = ("text", "score", "metadata", "rank", "start")
+
+    def __init__(self, text: str, score: float, metadata: Dict[str, Any], rank: int) -> None:
+        self.text = text
+        self.score = score
+        self.metadata = metadata
+        self.rank = rank
+        self.start: Optional[int] = metadata.get("char_start")
+
+    @property
+    def end(self) -> int:
+        return self.start + len(self.text)
+
+    def absorb(self, other: "_Span") -> None:
+        """Склейка с чанком той же страницы, начинающимся не дальше нашего конца."""
+        if other.end > self.end:
+            self.text += other.text[self.end - other.start:]
+        if other.rank < self.rank:
+            self.rank = other.rank
+            self.metadata = {**other.metadata, "char_start": self.start}
+        self.score = max(self.score, other.score)
+
+
+def _spans(passages: List[Any]) -> List[_Span]:
+    spans = []
+    for rank, passage in enumerate(passages):
+        text, score, metadata = passage if len(passage) == 3 else (passage[0], passage[1], {})
+        spans.append(_Span(text, float(score), metadata, rank))
+    return spans
+
+
+def _is_cosine(span: _Span) -> bool:
+    return "match" not in span.metadata and span.score > 0
+
+
+def _cut_by_score(spans: List[_Span], min_relative_score: float) -> List[_Span]:
+    top = max((span.score for span in spans if _is_cosine(span)), default=0.0)
+    if min_relative_score <= 0 or top <= 0:
+        return spans
+    threshold = top * min_relative_score
+    return [span for span in spans if span.score >= threshold or not _is_cosine(span)]
+
+
+def _merge(spans: List[_Span]) -> List[_Span]:
+    pages: Dict[Tuple[str, int], List[_Span]] = {}
+    merged: List[_Span] = []
+    seen: Dict[str, _Span] = {}
+    for span in spans:
+        if span.start is not None:
+            key = (span.metadata.get("filename", ""), span.metadata.get("page_number", 0))
+            pages.setdefault(key, []).append(span)
+        elif span.text in seen:   # индекс без смещений: убираем хотя бы точные дубли
+            seen[span.text].score = max(seen[span.text].score, span.score)
+        else:
+            seen[span.text] = span
+            merged.append(span)
+
+    for page_spans in pages.values():
+        page_spans.sort(key=lambda s: s.start)
+        current = page_spans[0]
+        for span in page_spans[1:]:
+            if span.start <= current.end:
+                current.absorb(span)
+            else:
+                merged.append(current)
+                current = span
+        merged.append(current)
+    return sorted(merged, key=lambda s: s.rank)
+
+
+def _fit_budget(spans: List[_Span], budget: int) -> List[_Span]:
+    """
+    Жадно по рангу; не влезающие пропускаются, первый фрагмент при нужде обрезается.
+    Дословные цитаты не выбрасываются и не обрезаются даже сверх бюджета.
+    """
+    if budget <= 0:
+        return spans
+    packed: List[_Span] = []
+    left = budget
+    for span in spans:
+        tokens = estimate_tokens(span.text)
+        if tokens <= left or span.metadata.get("match") == "exact":
+            packed.append(span)
+            left -= tokens
+        elif not packed:
+            span.text = span.text[:budget * CHARS_PER_TOKEN]
+            packed.append(span)
+            left = 0
+    return packed
+
+
+def pack_context(passages: List[Any]) -> Tuple[List[Passage], Dict[str, int]]:
+    """
+    (text, score, metadata) для промпта и статистика: tokens_before, tokens_after,
+    tokens_saved, passages_before, passages_after.
+    """
+    settings = get_settings()
+    tokens_before = sum(estimate_tokens(p[0]) for p in passages)
+    spans = _spans(passages)
+    if spans and settings.CONTEXT_PACKING:
+        spans = _cut_by_score(spans, settings.CONTEXT_MIN_RELATIVE_SCORE)
+        spans = _merge(spans)
+        spans = _fit_budget(spans, settings.CONTEXT_TOKEN_BUDGET)
+    packed = [(s.text, s.score, s.metadata) for s in spans]
+    tokens_after = sum(estimate_tokens(p[0]) for p in packed)
+    return packed, {
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "tokens_saved": tokens_before - tokens_after,
+        "passages_before": len(passages),
+        "passages_after": len(packed),
+    }
+
+
+def record_context_stats(stats: Dict[str, int]) -> None:
+    """Сэкономленные токены — в гистограмму и в RequestTimings текущего запроса."""
+    CONTEXT_TOKENS_SAVED.observe(stats["tokens_saved"])
+    timings = current_timings()
+    if timings is not None:
+        timings.add_context_saved(stats["tokens_saved"])
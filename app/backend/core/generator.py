@@ -8,9 +8,11 @@
 - возвращает финальный ответ как строку.
 """
 
-from typing import List, Tuple, Dict, Any, Union
+from typing import List, Tuple, Dict, Any, Union, Callable, Optional
 from langchain_core.language_models.chat_models import BaseChatModel
 
+from app.backend.core.metrics import STAGE_SECONDS, observe, record_llm_usage
+
 
 def build_rag_prompt(question: str, passages: Union[List[Tuple[str, float]], List[Tuple[str, float, Dict[str, Any]]]]) -> str:
     """
@@ -80,8 +82,56 @@ def generate_answer_from_passages(
     prompt = build_rag_prompt(question, passages)
 
     # Простейший однократный вызов LLM без цепочек
-    response = llm.invoke(prompt)
+    with observe(STAGE_SECONDS, "llm_generate"):
+        response = llm.invoke(prompt)
+    record_llm_usage("generate", response)
+
+    return _response_text(response)
+
+
+async def agenerate_answer_from_passages(
+    llm: BaseChatModel,
+    question: str,
+    passages: Union[List[Tuple[str, float]], List[Tuple[str, float, Dict[str, Any]]]],
+    on_token: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    Асинхронный вариант generate_answer_from_passages: LLM вызывается через
+    ainvoke, поэтому ожидание ответа провайдера не занимает поток.
+
+    Если передан on_token, ответ запрашивается потоково (astream) и каждый
+    кусок текста сразу отдаётся в on_token — так работает SSE-эндпоинт.
+    """
+    if not passages:
+        answer_text = "Я не нашёл подходящих фрагментов в книге, поэтому не могу ответить уверенно."
+        if on_token is not None:
+            on_token(answer_text)
+        return answer_text
+
+    prompt = build_rag_prompt(question, passages)
+
+    if on_token is None:
+        with observe(STAGE_SECONDS, "llm_generate"):
+            response = await llm.ainvoke(prompt)
+        record_llm_usage("generate", response)
+        return _response_text(response)
+
+    parts: List[str] = []
+    usage_chunk = None
+    with observe(STAGE_SECONDS, "llm_generate"):
+        async for chunk in llm.astream(prompt):
+            if getattr(chunk, "usage_metadata", None):
+                usage_chunk = chunk   # провайдер присылает usage в последнем куске
+            token = chunk.content if isinstance(chunk.content, str) else ""
+            if token:
+                parts.append(token)
+                on_token(token)
+    record_llm_usage("generate", usage_chunk)
+
+    return "".join(parts).strip()
+
 
+def _response_text(response: Any) -> str:
     # У разных моделей может быть .content или .text – берём content по умолчанию
     answer_text = getattr(response, "content", None) or str(response)
 
@@ -1,5 +1,6 @@
-from typing import Dict, Any, List, Callable
-from app.backend.core.retriever import retrieve
+import asyncio
+from typing import Dict, Any, List, Callable, Optional, Awaitable
+from app.backend.core.retriever import extract_quote, find_quote, retrieve, aretrieve
 
 
 class MCPServer:
@@ -12,11 +13,13 @@ class MCPServer:
         description: str,
         parameters: Dict[str, Any],  
         func: Callable,
+        afunc: Optional[Callable[..., Awaitable[Dict[str, Any]]]] = None,
     ) -> None:
         self.tools[name] = {
             "description": description,
             "parameters": parameters,  
             "func": func,
+            "afunc": afunc,
         }
 
     def list_tools(self) -> Dict[str, Any]:
@@ -35,6 +38,13 @@ class MCPServer:
         func = self.tools[name]["func"]
         return func(**args)
 
+    async def arun_tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        tool = self.tools[name]
+        if tool["afunc"] is not None:
+            return await tool["afunc"](**args)
+        # У инструмента нет async-версии — не блокируем event loop
+        return await asyncio.to_thread(tool["func"], **args)
+
 
 class MCPClient:
     def __init__(self, server: MCPServer) -> None:
@@ -47,17 +57,48 @@ class MCPClient:
     def run_tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
         return self.server.run_tool(name, args)
 
+    async def arun_tool(self, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.server.arun_tool(name, args)
+
 
 
-def retrieve_tool(query: str = "", top_k: int = 4) -> Dict[str, Any]:
+def retrieve_tool(query: str = "", top_k: int = 4, books: Optional[List[str]] = None) -> Dict[str, Any]:
     # Иногда LLM вызывает tool без обязательных аргументов — не падаем.
     if not isinstance(query, str) or not query.strip():
         return {"passages": []}
 
-    passages = retrieve(query, top_k=top_k)
+    passages = retrieve(query, top_k=top_k, books=books)
     return {"passages": passages}
 
 
+async def aretrieve_tool(query: str = "", top_k: int = 4, books: Optional[List[str]] = None) -> Dict[str, Any]:
+    if not isinstance(query, str) or not query.strip():
+        return {"passages": []}
+
+    passages = await aretrieve(query, top_k=top_k, books=books)
+    return {"passages": passages}
+
+
+def find_quote_tool(query: str = "", top_k: int = 4, books: Optional[List[str]] = None) -> Dict[str, Any]:
+    # Планировщик передаёт вопрос целиком: ищем только цитату в кавычках — весь вопрос
+    # дословно в книге почти никогда не встречается
+    if not isinstance(query, str) or not query.strip():
+        return {"passages": []}
+
+    phrase = extract_quote(query)
+    if phrase is None:
+        return {"passages": [], "error": "В вопросе нет цитаты в кавычках — используйте retrieve."}
+    matches = find_quote(phrase, limit=top_k, books=books)
+    if matches is None:
+        return {"passages": [], "error": "Индекс цитат не построен — используйте retrieve."}
+    return {"passages": [(m["text"], 1.0, {**m["metadata"], "match": "exact"}) for m in matches]}
+
+
+async def afind_quote_tool(query: str = "", top_k: int = 4, books: Optional[List[str]] = None) -> Dict[str, Any]:
+    # Поиск по индексу цитат синхронный (mmap и numpy) — выполняем вне event loop
+    return await asyncio.to_thread(find_quote_tool, query, top_k, books)
+
+
 mcp_server = MCPServer()
 
 mcp_server.register_tool(
@@ -81,6 +122,34 @@ mcp_server.register_tool(
         "required": ["query"],
     },
     func=retrieve_tool,
+    afunc=aretrieve_tool,
+)
+
+mcp_server.register_tool(
+    name="find_quote",
+    description=(
+        "Находит фрагменты, где дословно встречается фраза или цитата "
+        "(с книгой и страницей). Используй, когда в вопросе есть цитата в кавычках."
+    ),
+    parameters={
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "Цитата или вопрос с цитатой в кавычках.",
+            },
+            "top_k": {
+                "type": "integer",
+                "description": "Сколько вхождений вернуть.",
+                "minimum": 1,
+                "maximum": 10,
+                "default": 4,
+            },
+        },
+        "required": ["query"],
+    },
+    func=find_quote_tool,
+    afunc=afind_quote_tool,
 )
 
 mcp_client = MCPClient(mcp_server)
@@ -100,4 +169,9 @@ def call_tool_from_llm(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
     Удобная обёртка: вызвать инструмент по имени с аргументами.
     Тоже легко заменить на реальный протокол в будущем.
     """
-    return mcp_client.run_tool(name, args) 
\ No newline at end of file
+    return mcp_client.run_tool(name, args) 
+
+
+async def acall_tool_from_llm(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    """Асинхронный вариант call_tool_from_llm для async-графа."""
+    return await mcp_client.arun_tool(name, args)
@@ -0,0 +1,187 @@
+# app/backend/core/metrics.py
+
+"""
+Метрики Prometheus и разбивка времени по стадиям одного запроса.
+
+- observe(metric, name) — контекстный менеджер: пишет длительность в гистограмму
+  и, если запрос отслеживается через track_request(), в его RequestTimings;
+- RequestTimings — суммарное время по стадиям, токены LLM и токены контекста,
+  сэкономленные сборкой контекста, в рамках запроса; из него собирается
+  заголовок Server-Timing;
+- render_latest() — текст для эндпоинта /metrics (с поддержкой
+  PROMETHEUS_MULTIPROC_DIR, если uvicorn запущен с несколькими воркерами).
+"""
+
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.multiprocess import MultiProcessCollector
+
+
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+NODE_SECONDS = Histogram(
+    "rag_node_seconds",
+    "Время выполнения узла RAG-графа",
+    ["node"],
+    buckets=_LATENCY_BUCKETS,
+)
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds",
+    "Время подэтапов пайплайна: embed, faiss_search, lexical_search, quote_search, llm_plan, llm_generate",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total",
+    "Токены LLM по стадиям",
+    ["stage", "kind"],
+)
+TOOL_CALLS_PER_REQUEST = Histogram(
+    "rag_tool_calls_per_request",
+    "Число вызовов инструментов на один запрос",
+    buckets=(0, 1, 2, 3, 4, 5, 8),
+)
+QUERY_CACHE_LOOKUPS = Counter(
+    "query_embedding_cache_lookups_total",
+    "Обращения к кэшу эмбеддингов запросов: memory_hit, disk_hit, miss",
+    ["result"],
+)
+EMBED_BATCH_SIZE = Histogram(
+    "embedding_batch_size",
+    "Размер батча, собранного батчером эмбеддингов",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBED_QUEUE_WAIT_SECONDS = Histogram(
+    "embedding_queue_wait_seconds",
+    "Время ожидания текста в очереди батчера до forward-прохода",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "answer_cache_lookups_total",
+    "Обращения к семантическому кэшу ответов: hit, miss",
+    ["result"],
+)
+COALESCED_REQUESTS = Counter(
+    "rag_coalesced_requests_total",
+    "Одинаковые одновременные запросы, получившие чужой результат: process — в этом воркере, worker — из другого",
+    ["scope"],
+)
+CONTEXT_TOKENS_SAVED = Histogram(
+    "rag_context_tokens_saved",
+    "Токены контекста, сэкономленные сборкой контекста (склейка, порог скора, бюджет) на один вызов инструмента",
+    buckets=(0, 50, 100, 250, 500, 1000, 2000, 4000, 8000),
+)
+LLM_QUEUE_SECONDS = Histogram(
+    "llm_gateway_queue_seconds",
+    "Ожидание вызова LLM в шлюзе: лимиты запросов/токенов и слот конкурентности",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+LLM_IN_FLIGHT = Gauge(
+    "llm_gateway_in_flight",
+    "Вызовы LLM, выполняющиеся прямо сейчас",
+    multiprocess_mode="livesum",
+)
+LLM_RETRIES = Counter(
+    "llm_gateway_retries_total",
+    "Повторы вызовов LLM по причине: 429, 5xx, transport",
+    ["reason"],
+)
+LLM_REJECTED = Counter(
+    "llm_gateway_rejected_total",
+    "Вызовы LLM, отклонённые шлюзом: circuit_open, queue_timeout",
+    ["reason"],
+)
+
+
+class RequestTimings:
+    """Суммарное время по стадиям и расход токенов в рамках одного запроса."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {"input": 0, "output": 0, "context_saved": 0}
+
+    def add(self, name: str, seconds: float) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def add_tokens(self, input_tokens: int, output_tokens: int) -> None:
+        self.tokens["input"] += input_tokens
+        self.tokens["output"] += output_tokens
+
+    def add_context_saved(self, tokens: int) -> None:
+        self.tokens["context_saved"] += tokens
+
+    def server_timing(self) -> str:
+        """Значение заголовка Server-Timing: стадии + общее время, в миллисекундах."""
+        parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.durations.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("rag_request_timings", default=None)
+
+
+@contextmanager
+def track_request() -> Iterator[RequestTimings]:
+    """Включает сбор RequestTimings для всего, что выполняется внутри блока."""
+    timings = RequestTimings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+
+@contextmanager
+def observe(metric: Histogram, name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metric.labels(name).observe(elapsed)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(name, elapsed)
+
+
+def record_llm_usage(stage: str, message: Any) -> None:
+    """Учитывает токены из usage_metadata ответа LangChain (если модель их вернула)."""
+    usage = getattr(message, "usage_metadata", None) or {}
+    input_tokens = int(usage.get("input_tokens", 0) or 0)
+    output_tokens = int(usage.get("output_tokens", 0) or 0)
+    if not input_tokens and not output_tokens:
+        return
+
+    LLM_TOKENS.labels(stage, "input").inc(input_tokens)
+    LLM_TOKENS.labels(stage, "output").inc(output_tokens)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add_tokens(input_tokens, output_tokens)
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """Снимок всех метрик в текстовом формате Prometheus."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,24 +1,36 @@
 # app/backend/core/query_processor.py
 
-from app.backend.core.rag_graph import run_rag
+from typing import List, Optional
 
+from app.backend.core.rag_graph import run_rag, arun_rag
 
-def answer_question(query: str, top_k: int = 4) -> dict:
+
+def answer_question(query: str, top_k: int = 4, books: Optional[List[str]] = None) -> dict:
     """
     Обёртка над графом RAG, которую вызывает FastAPI.
 
     На вход:
       - query: вопрос пользователя
       - top_k: сколько чанков вытаскивать из индекса
+      - books: имена файлов книг, по которым искать (None — по всем)
 
     На выход:
       - dict с полями:
          - "answer": финальный ответ LLM
          - "passages": список (текст, скор)
     """
-    state = run_rag(question=query, top_k=top_k)
+    state = run_rag(question=query, top_k=top_k, books=books)
+
+    return {
+        "answer": state["answer"],
+        "passages": state["passages"],
+    }
+
+async def aanswer_question(query: str, top_k: int = 4, books: Optional[List[str]] = None) -> dict:
+    """Асинхронный вариант answer_question поверх arun_rag."""
+    state = await arun_rag(question=query, top_k=top_k, books=books)
 
     return {
         "answer": state["answer"],
         "passages": state["passages"],
-    }
\ No newline at end of file
+    }
@@ -1,73 +1,84 @@
-from typing import TypedDict, List, Tuple, Literal, Dict, Any, Optional
+from typing import TypedDict, List, Tuple, Literal, Dict, Any, Optional, AsyncIterator, Awaitable, Callable
 
-import os
 import json
-from pprint import pprint
+import asyncio
+import functools
+import inspect
+from concurrent.futures import Future
 
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
-from langchain_mistralai import ChatMistralAI
 
-from app.backend.core.generator import generate_answer_from_passages
+from app.backend.core.config import get_settings
+from app.backend.core.context_packer import pack_context, record_context_stats
+from app.backend.core.generator import (
+    generate_answer_from_passages,
+    agenerate_answer_from_passages,
+)
 from app.backend.core.mcp_tools import (
     list_tools_for_llm,
     call_tool_from_llm,
+    acall_tool_from_llm,
+)
+from app.backend.core.retriever import aretrieve_batch, is_confident_retrieval, submit_retrieve
+from app.backend.core.metrics import (
+    COALESCED_REQUESTS,
+    NODE_SECONDS,
+    STAGE_SECONDS,
+    TOOL_CALLS_PER_REQUEST,
+    observe,
+    record_llm_usage,
 )
+from app.backend.core import state_log
+from app.backend.core.answer_cache import lookup_answer, store_answer
+from app.backend.core.single_flight import aworker_lock, coalesce_key, single_flight, worker_lock
+from app.backend.services.embeddings import embed_queries
+from app.backend.services.llm import create_llm
 
 
 class RAGState(TypedDict, total=False):
     question: str
     top_k: int
+    books: Optional[List[str]]                # фильтр по файлам книг (None — вся библиотека)
     passages: List[Tuple[str, float]]
     answer: str
     decision: Literal["tool", "answer"]
     tool_name: str
     tool_args: Dict[str, Any]
     tool_calls: int
+    tool_results: Dict[str, Dict[str, Any]]   # результаты уже сделанных вызовов в рамках запроса
     messages: List[Dict[str, str]]
+    speculative: Optional[Dict[str, Any]]     # {"key": ключ вызова, "future": Future} спекулятивного retrieve
+    cached: bool                              # ответ взят из семантического кэша
+    error: str                                # ошибка прогона (только в пакетном режиме)
 
 
-LLM = ChatMistralAI(
-    model="mistral-small-latest",
-    api_key=os.environ.get("MISTRAL_API_KEY"),
-)
-
-TOOLS = list_tools_for_llm()
-TOOLS_SCHEMA_STR = json.dumps(TOOLS, ensure_ascii=False, indent=2)
-MAX_TOOL_CALLS = 2
-
-
-def _parse_json_from_model(raw: str) -> Dict[str, Any]:
-    raw = raw.strip()
-    if raw.startswith("```"):
-        parts = raw.split("```")
-        if len(parts) >= 2:
-            middle = parts[1].lstrip()
-            if middle.lower().startswith("json"):
-                middle = middle[4:].lstrip()
-            raw = middle
-    return json.loads(raw)
+_settings = get_settings()
 
+LLM = create_llm()   # провайдер — LLM_PROVIDER (mistral / openai / fake)
 
-def planner_node(state: RAGState) -> Dict[str, Any]:
-    question = state["question"]
-    messages: List[Dict[str, str]] = state.get("messages", [])
+TOOLS = list_tools_for_llm()
+TOOLS_SCHEMA_STR = json.dumps(TOOLS, ensure_ascii=False, separators=(",", ":"))
+MAX_TOOL_CALLS = _settings.MAX_TOOL_CALLS
 
-    if not messages:
-        system_prompt = """Ты ассистент, который профессионально отвечает на вопросы по книге.
+# Системный промпт планировщика не меняется между запросами и шагами: схема инструментов
+# уходит одним и тем же префиксом, который провайдеры с кэшем префиксов не пересчитывают.
+# Вопрос и история идут после него.
+PLANNER_SYSTEM_PROMPT = """Ты ассистент, который профессионально отвечает на вопросы по книге.
 У тебя есть инструменты, описанные JSON-схемой ниже.
 Ты ДОЛЖЕН использовать эту схему, когда формируешь tool_args.
 
-ОБЯЗАТЕЛЬНО: на самом первом шаге ты всегда сначала вызываешь инструмент (например, retrieve),
-чтобы получить фрагменты книги. Никогда не отвечай сразу на первом шаге.
-
 Доступные инструменты (JSON-схема):
 {tools_schema}
 
+ОБЯЗАТЕЛЬНО: на самом первом шаге ты всегда сначала вызываешь инструмент (например, retrieve),
+чтобы получить фрагменты книги. Никогда не отвечай сразу на первом шаге.
 
-Если для корректного ответа нужны данные из книги, обязательно используй инструмент.
-Если данных достаточно, можешь сразу ответить.
+Результаты инструментов приходят кратко: номер фрагмента [N], скор, книга и страница
+и начало текста. Полные фрагменты с этими же номерами получит тот, кто пишет ответ.
+Если найденного недостаточно, вызови инструмент ещё раз; если достаточно — переходи к ответу.
 
-Ответ возвращай строго в формате JSON без лишнего текста.
+Ответ возвращай строго в формате JSON в одном объекте, без ``` и лишнего текста.
 
 1) Если нужно вызвать инструмент:
 {{
@@ -76,41 +87,53 @@ def planner_node(state: RAGState) -> Dict[str, Any]:
   "tool_args": {{ ... }}
 }}
 
-2) Если можешь ответить сразу:
+2) Если можно отвечать:
 {{
-  "decision": "answer",
+  "decision": "answer"
 }}
 """.format(tools_schema=TOOLS_SCHEMA_STR)
 
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": f"Вопрос пользователя: {question!r}"},
-        ]
-    else:
-        followup_user = {
-            "role": "user",
-            "content": """Ты видишь выше историю диалога и результаты вызовов инструментов.
-Теперь реши, нужно ли ещё раз вызвать какой-либо инструмент, 
-или можно дать финальный ответ пользователю.
+PLANNER_FOLLOWUP = "Реши следующий шаг по истории выше. Ответ — JSON-объект в формате из системного сообщения."
 
-Отвечай строго в формате JSON в одном объекте, без ``` и лишнего текста.
 
-1) Вызов инструмента:
-{
-  "decision": "tool",
-  "tool_name": "<имя_инструмента>",
-  "tool_args": { ... }
-}
-
-2) Финальный ответ:
-{
-  "decision": "answer",
-}
-""",
-        }
-        messages = messages + [followup_user]
+def _parse_json_from_model(raw: str) -> Dict[str, Any]:
+    raw = raw.strip()
+    if raw.startswith("```"):
+        parts = raw.split("```")
+        if len(parts) >= 2:
+            middle = parts[1].lstrip()
+            if middle.lower().startswith("json"):
+                middle = middle[4:].lstrip()
+            raw = middle
+    return json.loads(raw)
+
 
-    resp = LLM.invoke(messages)
+def _planner_history(state: RAGState) -> List[Dict[str, str]]:
+    """История планировщика без системного промпта: вопрос, решения, краткие результаты инструментов."""
+    messages: List[Dict[str, str]] = state.get("messages", [])
+    if not messages:
+        return [{"role": "user", "content": f"Вопрос пользователя: {state['question']!r}"}]
+    return messages
+
+
+def _planner_messages(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    Сообщения для очередного шага планировщика: постоянный системный префикс,
+    вопрос и последние PLANNER_HISTORY_MESSAGES сообщений истории.
+    """
+    question, rest = history[0], history[1:]
+    limit = _settings.PLANNER_HISTORY_MESSAGES
+    if limit > 0:
+        rest = rest[-limit:]
+    messages = [{"role": "system", "content": PLANNER_SYSTEM_PROMPT}, question] + rest
+    if rest:
+        messages.append({"role": "user", "content": PLANNER_FOLLOWUP})
+    return messages
+
+
+def _planner_update(state: RAGState, history: List[Dict[str, str]], resp: Any) -> Dict[str, Any]:
+    """Разбирает JSON-решение планировщика в обновление состояния."""
+    question = state["question"]
     content = getattr(resp, "content", resp)
 
     if isinstance(content, str):
@@ -123,7 +146,7 @@ def planner_node(state: RAGState) -> Dict[str, Any]:
 
     data = _parse_json_from_model(raw)
 
-    messages = messages + [{"role": "assistant", "content": raw}]
+    messages = history + [{"role": "assistant", "content": raw}]
 
     decision = data.get("decision", "tool")
 
@@ -137,6 +160,10 @@ def planner_node(state: RAGState) -> Dict[str, Any]:
     tool_args = data.get("tool_args") or {}
     tool_args["query"] = question
     tool_args["top_k"] = state.get("top_k", 4)
+    # Фильтр по книгам задаёт пользователь, а не планировщик
+    tool_args.pop("books", None)
+    if state.get("books"):
+        tool_args["books"] = state["books"]
 
     return {
         "decision": "tool",
@@ -146,52 +173,153 @@ def planner_node(state: RAGState) -> Dict[str, Any]:
     }
 
 
-def tools_node(state: RAGState) -> Dict[str, Any]:
-    tool_name = state.get("tool_name", "retrieve")
-    tool_args = state.get("tool_args", {}) or {}
-    current_calls = state.get("tool_calls", 0)
-    messages = state.get("messages", [])
+def _start_speculative_retrieval(state: RAGState) -> Optional[Dict[str, Any]]:
+    """
+    На первом шаге планировщик всё равно запросит retrieve(question, top_k):
+    запускаем его заранее, чтобы эмбеддинг и поиск шли параллельно с LLM.
+    """
+    if not _settings.SPECULATIVE_RETRIEVAL or state.get("messages"):
+        return None
+
+    question = state["question"]
+    top_k = state.get("top_k", 4)
+    books = state.get("books")
+    tool_key = _retrieve_key(question, top_k, books)
+    if not question.strip() or tool_key in state.get("tool_results", {}):
+        return None
 
+    return {"key": tool_key, "future": submit_retrieve(question, top_k, books)}
+
+
+def _take_speculative(state: RAGState, tool_key: str) -> Optional[Future]:
+    """Отдаёт спекулятивный Future, если он посчитан ровно для этого вызова, иначе отменяет его."""
+    speculative = state.get("speculative")
+    if not speculative:
+        return None
+    if speculative["key"] == tool_key:
+        return speculative["future"]
+    speculative["future"].cancel()
+    return None
+
+
+def _with_speculative(update: Dict[str, Any], speculative: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Спекулятивный retrieve передаём узлу инструментов; если инструмент не вызывается — отменяем."""
+    if speculative:
+        if update["decision"] == "tool":
+            update["speculative"] = speculative
+        else:
+            speculative["future"].cancel()
+    return update
+
+
+def planner_node(state: RAGState) -> Dict[str, Any]:
+    history = _planner_history(state)
+    messages = _planner_messages(history)
+    speculative = _start_speculative_retrieval(state)
+    # Любая ошибка, включая битый JSON планировщика, отменяет спекулятивный retrieve
     try:
-        result = call_tool_from_llm(tool_name, tool_args)
-    except KeyError:
-        new_messages = messages + [
-            {
-                "role": "assistant",
-                "content": f"Инструмент {tool_name!r} не найден. "
-                           f"Пробую продолжить без него.",
-            }
-        ]
-        return {
-            "tool_calls": current_calls + 1,
-            "messages": new_messages,
-            "passages": [],
+        with observe(STAGE_SECONDS, "llm_plan"):
+            resp = LLM.invoke(messages)
+        record_llm_usage("plan", resp)
+        update = _planner_update(state, history, resp)
+    except BaseException:
+        if speculative:
+            speculative["future"].cancel()
+        raise
+    return _with_speculative(update, speculative)
+
+
+async def aplanner_node(state: RAGState) -> Dict[str, Any]:
+    history = _planner_history(state)
+    messages = _planner_messages(history)
+    speculative = _start_speculative_retrieval(state)
+    try:
+        with observe(STAGE_SECONDS, "llm_plan"):
+            resp = await LLM.ainvoke(messages)
+        record_llm_usage("plan", resp)
+        update = _planner_update(state, history, resp)
+    except BaseException:
+        if speculative:
+            speculative["future"].cancel()
+        raise
+    return _with_speculative(update, speculative)
+
+
+def _tool_not_found_update(state: RAGState, tool_name: str) -> Dict[str, Any]:
+    new_messages = state.get("messages", []) + [
+        {
+            "role": "assistant",
+            "content": f"Инструмент {tool_name!r} не найден. "
+                       f"Пробую продолжить без него.",
         }
+    ]
+    return {
+        "tool_calls": state.get("tool_calls", 0) + 1,
+        "messages": new_messages,
+        "passages": [],
+        "speculative": None,
+    }
+
+
+def _tool_key(tool_name: str, tool_args: Dict[str, Any]) -> str:
+    """Ключ вызова инструмента для мемоизации внутри одного запроса."""
+    return json.dumps([tool_name, tool_args], sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _retrieve_key(question: str, top_k: int, books: Optional[List[str]] = None) -> str:
+    """Ключ вызова retrieve(question, top_k), который на первом шаге запросит планировщик."""
+    tool_args: Dict[str, Any] = {"query": question, "top_k": top_k}
+    if books:
+        tool_args["books"] = books
+    return _tool_key("retrieve", tool_args)
+
+
+def _passage_brief(number: int, passage: Any) -> str:
+    """Строка фрагмента для планировщика: [N] — тот же номер, под которым его цитирует генератор."""
+    text, score = passage[0], passage[1]
+    metadata = passage[2] if len(passage) == 3 else {}
+    book_name = metadata.get("book_name", "")
+    page_number = metadata.get("page_number", 0)
+    line = f"[{number}] score={score:.3f}"
+    if book_name and page_number:
+        line += f" ({book_name}, стр. {page_number})"
+    limit = _settings.PLANNER_SNIPPET_CHARS
+    if limit <= 0:
+        return line
+    snippet = " ".join(text.split())
+    if len(snippet) > limit:
+        snippet = snippet[:limit].rstrip() + "…"
+    return f"{line}: {snippet}"
+
+
+def _tools_update(
+    state: RAGState,
+    tool_name: str,
+    tool_args: Dict[str, Any],
+    result: Dict[str, Any],
+) -> Dict[str, Any]:
+    """
+    Добавляет результат инструмента в историю и обновляет состояние.
+    Найденные фрагменты проходят сборку контекста (pack_context): дальше —
+    в историю планировщика, генератору и клиенту — идёт один и тот же список.
+    Планировщику достаются только номера, скоры и короткие сниппеты
+    (_passage_brief), полные тексты — генератору.
+    """
+    current_calls = state.get("tool_calls", 0)
+    messages = state.get("messages", [])
+    tool_results = dict(state.get("tool_results", {}))
+    tool_results[_tool_key(tool_name, tool_args)] = result
+    result = dict(result)
 
     passages = result.get("passages")
 
     if passages:
-        # Поддержка нового формата с метаданными (text, score, metadata)
-        passage_texts = []
-        for passage_data in passages:
-            if len(passage_data) == 3:
-                text, score, metadata = passage_data
-                book_name = metadata.get("book_name", "")
-                page_number = metadata.get("page_number", 0)
-                if book_name and page_number:
-                    passage_texts.append(f"[score={score:.3f}, {book_name}, стр. {page_number}]\n{text}")
-                else:
-                    passage_texts.append(f"[score={score:.3f}]\n{text}")
-            else:
-                # Старый формат (text, score)
-                text, score = passage_data
-                passage_texts.append(f"[score={score:.3f}]\n{text}")
-
-        full_text = "\n\n---\n\n".join(passage_texts)
-        tool_msg = (
-            f"Результат инструмента {tool_name!r} с аргументами {tool_args!r}:\n"
-            f"{full_text}"
-        )
+        passages, context_stats = pack_context(passages)
+        record_context_stats(context_stats)
+        result["passages"] = passages
+
+        briefs = "\n".join(_passage_brief(i, p) for i, p in enumerate(passages, start=1))
+        tool_msg = f"Результат инструмента {tool_name!r}: {len(passages)} фрагм.\n{briefs}"
     else:
         tool_msg = f"Инструмент {tool_name!r} вернул результат: {result!r}"
 
@@ -204,10 +332,48 @@ def tools_node(state: RAGState) -> Dict[str, Any]:
 
     result["tool_calls"] = current_calls + 1
     result["messages"] = new_messages
+    result["tool_results"] = tool_results
+    result["speculative"] = None
 
     return result
 
 
+def tools_node(state: RAGState) -> Dict[str, Any]:
+    tool_name = state.get("tool_name", "retrieve")
+    tool_args = state.get("tool_args", {}) or {}
+
+    tool_key = _tool_key(tool_name, tool_args)
+    result = state.get("tool_results", {}).get(tool_key)
+    speculative = _take_speculative(state, tool_key)
+    if result is None and speculative is not None:
+        result = {"passages": speculative.result()}
+    if result is None:
+        try:
+            result = call_tool_from_llm(tool_name, tool_args)
+        except KeyError:
+            return _tool_not_found_update(state, tool_name)
+
+    return _tools_update(state, tool_name, tool_args, result)
+
+
+async def atools_node(state: RAGState) -> Dict[str, Any]:
+    tool_name = state.get("tool_name", "retrieve")
+    tool_args = state.get("tool_args", {}) or {}
+
+    tool_key = _tool_key(tool_name, tool_args)
+    result = state.get("tool_results", {}).get(tool_key)
+    speculative = _take_speculative(state, tool_key)
+    if result is None and speculative is not None:
+        result = {"passages": await asyncio.wrap_future(speculative)}
+    if result is None:
+        try:
+            result = await acall_tool_from_llm(tool_name, tool_args)
+        except KeyError:
+            return _tool_not_found_update(state, tool_name)
+
+    return _tools_update(state, tool_name, tool_args, result)
+
+
 def generate_node(state: RAGState) -> Dict[str, Any]:
     question = state["question"]
     passages = state.get("passages", [])
@@ -223,6 +389,23 @@ def generate_node(state: RAGState) -> Dict[str, Any]:
     }
 
 
+async def agenerate_node(state: RAGState) -> Dict[str, Any]:
+    # В режиме stream_mode="custom" токены уходят клиенту по мере генерации,
+    # в остальных режимах writer — пустышка.
+    writer = get_stream_writer()
+
+    answer = await agenerate_answer_from_passages(
+        llm=LLM,
+        question=state["question"],
+        passages=state.get("passages", []),
+        on_token=lambda token: writer({"token": token}),
+    )
+
+    return {
+        "answer": answer,
+    }
+
+
 def route_after_plan(state: RAGState) -> str:
     calls = state.get("tool_calls", 0)
     decision = state.get("decision", "tool")
@@ -236,47 +419,332 @@ def route_after_plan(state: RAGState) -> str:
     if calls >= MAX_TOOL_CALLS:
         return "generate"
 
+    # Планировщик просит ровно тот же вызов, что уже был — нового он не даст
+    tool_key = _tool_key(state.get("tool_name", "retrieve"), state.get("tool_args", {}) or {})
+    if tool_key in state.get("tool_results", {}):
+        return "generate"
+
     return "tools"
 
 
-_graph = StateGraph(RAGState)
+def route_after_tools(state: RAGState) -> str:
+    calls = state.get("tool_calls", 0)
+
+    # Лимит вызовов исчерпан — планировщик всё равно отправил бы в generate
+    if calls >= MAX_TOOL_CALLS:
+        return "generate"
 
-_graph.add_node("plan", planner_node)
-_graph.add_node("tools", tools_node)
-_graph.add_node("generate", generate_node)
+    if _settings.RAG_ROUTING == "confidence" and is_confident_retrieval(state.get("passages", [])):
+        return "generate"
 
-_graph.add_edge(START, "plan")
+    return "plan"
 
-_graph.add_conditional_edges(
-    "plan",
-    route_after_plan,
-    {
-        "tools": "tools",
-        "generate": "generate",
-    },
-)
 
-_graph.add_edge("tools", "plan")
-_graph.add_edge("generate", END)
+def _timed_node(name: str, node):
+    """Оборачивает узел графа: время выполнения уходит в NODE_SECONDS{node=name}."""
+    if inspect.iscoroutinefunction(node):
+        @functools.wraps(node)
+        async def wrapper(state: RAGState) -> Dict[str, Any]:
+            with observe(NODE_SECONDS, name):
+                return await node(state)
+    else:
+        @functools.wraps(node)
+        def wrapper(state: RAGState) -> Dict[str, Any]:
+            with observe(NODE_SECONDS, name):
+                return node(state)
+    return wrapper
 
-rag_graph = _graph.compile()
 
+def _build_graph(plan, tools, generate):
+    graph = StateGraph(RAGState)
 
-def run_rag(question: str, top_k: int = 4) -> RAGState:
-    initial_state: RAGState = {
+    graph.add_node("plan", _timed_node("plan", plan))
+    graph.add_node("tools", _timed_node("tools", tools))
+    graph.add_node("generate", _timed_node("generate", generate))
+
+    graph.add_edge(START, "plan")
+
+    graph.add_conditional_edges(
+        "plan",
+        route_after_plan,
+        {
+            "tools": "tools",
+            "generate": "generate",
+        },
+    )
+
+    graph.add_conditional_edges(
+        "tools",
+        route_after_tools,
+        {
+            "plan": "plan",
+            "generate": "generate",
+        },
+    )
+    graph.add_edge("generate", END)
+
+    return graph.compile()
+
+
+# Синхронный граф — для скриптов и оценки, асинхронный — для FastAPI:
+# в нём LLM вызывается через ainvoke, а retrieve уходит в пул потоков.
+rag_graph = _build_graph(planner_node, tools_node, generate_node)
+arag_graph = _build_graph(aplanner_node, atools_node, agenerate_node)
+
+
+def _normalize_books(books: Optional[List[str]]) -> Optional[List[str]]:
+    """Один и тот же набор книг — один ключ вызова и одно пространство кэша."""
+    return sorted(set(books)) if books else None
+
+
+def _initial_state(
+    question: str,
+    top_k: int,
+    books: Optional[List[str]] = None,
+    passages: Optional[List[Any]] = None,
+) -> RAGState:
+    state: RAGState = {
+        "question": question,
+        "top_k": top_k,
+        "books": books,
+        "tool_calls": 0,
+    }
+    if passages is not None:
+        # retrieve(question) уже выполнен заранее (пакетный поиск): tools_node возьмёт результат отсюда
+        state["tool_results"] = {_retrieve_key(question, top_k, books): {"passages": passages}}
+    return state
+
+
+def _cached_state(question: str, top_k: int, hit: Dict[str, Any], books: Optional[List[str]] = None) -> RAGState:
+    return {
         "question": question,
         "top_k": top_k,
+        "books": books,
         "tool_calls": 0,
+        "passages": hit["passages"],
+        "answer": hit["answer"],
+        "cached": True,
     }
 
+
+def _shares_via_cache(use_cache: bool) -> bool:
+    """Воркеры передают друг другу результат только через общий кэш ответов."""
+    return use_cache and _settings.ANSWER_CACHE_ENABLED
+
+
+def _coalesced(
+    question: str,
+    top_k: int,
+    books: Optional[List[str]],
+    use_cache: bool,
+    compute: Callable[[], RAGState],
+) -> RAGState:
+    """
+    compute() для запроса, одинаковые одновременные копии которого (в этом и других
+    воркерах) ждут одно вычисление вместо своего.
+    """
+    if not _settings.COALESCE_ENABLED:
+        return compute()
+    key = coalesce_key(question, top_k, books)
+
+    def lead() -> RAGState:
+        with worker_lock(key, enabled=_shares_via_cache(use_cache)) as waited:
+            if waited:
+                hit = lookup_answer(question, top_k, books)
+                if hit is not None:
+                    COALESCED_REQUESTS.labels("worker").inc()
+                    return _cached_state(question, top_k, hit, books)
+            return compute()
+
+    return single_flight.run(key, lead)
+
+
+async def _acoalesced(
+    question: str,
+    top_k: int,
+    books: Optional[List[str]],
+    use_cache: bool,
+    compute: Callable[[], Awaitable[RAGState]],
+) -> RAGState:
+    """Async-вариант _coalesced."""
+    if not _settings.COALESCE_ENABLED:
+        return await compute()
+    key = coalesce_key(question, top_k, books)
+
+    async def lead() -> RAGState:
+        async with aworker_lock(key, enabled=_shares_via_cache(use_cache)) as waited:
+            if waited:
+                hit = await asyncio.to_thread(lookup_answer, question, top_k, books)
+                if hit is not None:
+                    COALESCED_REQUESTS.labels("worker").inc()
+                    return _cached_state(question, top_k, hit, books)
+            return await compute()
+
+    return await single_flight.arun(key, lead)
+
+
+def run_rag(
+    question: str,
+    top_k: int = 4,
+    use_cache: bool = True,
+    books: Optional[List[str]] = None,
+) -> RAGState:
+    books = _normalize_books(books)
+    if use_cache:
+        hit = lookup_answer(question, top_k, books)
+        if hit is not None:
+            return _cached_state(question, top_k, hit, books)
+
+    return _coalesced(question, top_k, books, use_cache, lambda: _run_graph(_initial_state(question, top_k, books), use_cache))
+
+
+def _run_graph(initial_state: RAGState, use_cache: bool = True) -> RAGState:
+    question, top_k, books = initial_state["question"], initial_state["top_k"], initial_state["books"]
     final_state: Optional[RAGState] = None
+    sampled = state_log.should_sample()
 
-    for state in rag_graph.stream(initial_state, stream_mode="values"):
-        print("=== STATE ===")
-        pprint(state)
+    for step, state in enumerate(rag_graph.stream(initial_state, stream_mode="values")):
+        if sampled:
+            state_log.log_state(step, state)
         final_state = state
 
     if final_state is None:
         raise RuntimeError("Graph did not produce any state")
 
-    return final_state
\ No newline at end of file
+    TOOL_CALLS_PER_REQUEST.observe(final_state.get("tool_calls", 0))
+    if use_cache:
+        store_answer(question, top_k, final_state.get("answer", ""), final_state.get("passages", []), books)
+    return final_state
+
+
+async def arun_rag(
+    question: str,
+    top_k: int = 4,
+    use_cache: bool = True,
+    books: Optional[List[str]] = None,
+) -> RAGState:
+    books = _normalize_books(books)
+    if use_cache:
+        hit = await asyncio.to_thread(lookup_answer, question, top_k, books)
+        if hit is not None:
+            return _cached_state(question, top_k, hit, books)
+
+    return await _acoalesced(
+        question, top_k, books, use_cache, lambda: _arun_graph(_initial_state(question, top_k, books), use_cache)
+    )
+
+
+async def _arun_graph(initial_state: RAGState, use_cache: bool = True) -> RAGState:
+    question, top_k, books = initial_state["question"], initial_state["top_k"], initial_state["books"]
+    final_state: Optional[RAGState] = None
+    sampled = state_log.should_sample()
+
+    step = 0
+    async for state in arag_graph.astream(initial_state, stream_mode="values"):
+        if sampled:
+            state_log.log_state(step, state)
+        final_state = state
+        step += 1
+
+    if final_state is None:
+        raise RuntimeError("Graph did not produce any state")
+
+    TOOL_CALLS_PER_REQUEST.observe(final_state.get("tool_calls", 0))
+    if use_cache:
+        await asyncio.to_thread(
+            store_answer, question, top_k, final_state.get("answer", ""), final_state.get("passages", []), books
+        )
+    return final_state
+
+
+async def abatch_rag(
+    questions: List[str],
+    top_k: int = 4,
+    books: Optional[List[str]] = None,
+    use_cache: bool = True,
+    concurrency: Optional[int] = None,
+) -> AsyncIterator[Tuple[int, RAGState]]:
+    """
+    Пакетный прогон: эмбеддинги всех вопросов — одним вызовом модели, поиск —
+    одним многострочным index.search, затем графы вопросов идут конкурентно,
+    не больше concurrency (BATCH_CONCURRENCY) одновременно. Первый retrieve
+    каждого графа берётся из пакетного поиска. Отдаёт (номер вопроса, состояние)
+    по мере готовности; ошибка одного вопроса попадает в его state["error"].
+    """
+    books = _normalize_books(books)
+    # Один проход модели прогревает кэш эмбеддингов запросов: дальше и кэш ответов,
+    # и retrieve_batch берут векторы оттуда
+    with observe(STAGE_SECONDS, "embed"):
+        await asyncio.to_thread(embed_queries, questions)
+
+    pending: List[int] = []
+    if use_cache:
+        hits = await asyncio.to_thread(lambda: [lookup_answer(q, top_k, books) for q in questions])
+        for i, hit in enumerate(hits):
+            if hit is not None:
+                yield i, _cached_state(questions[i], top_k, hit, books)
+            else:
+                pending.append(i)
+    else:
+        pending = list(range(len(questions)))
+    if not pending:
+        return
+
+    prefetched = await aretrieve_batch([questions[i] for i in pending], top_k, books)
+    semaphore = asyncio.Semaphore(concurrency or _settings.BATCH_CONCURRENCY)
+
+    async def run_one(i: int, passages: List[Any]) -> Tuple[int, RAGState]:
+        async with semaphore:
+            try:
+                return i, await _acoalesced(
+                    questions[i], top_k, books, use_cache,
+                    lambda: _arun_graph(_initial_state(questions[i], top_k, books, passages), use_cache),
+                )
+            except Exception as exc:
+                return i, {**_initial_state(questions[i], top_k, books), "error": str(exc)}
+
+    tasks = [asyncio.create_task(run_one(i, passages)) for i, passages in zip(pending, prefetched)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Клиент отключился посреди потока — не держим LLM-вызовы оставшихся вопросов
+        for task in tasks:
+            task.cancel()
+
+
+async def astream_rag(
+    question: str,
+    top_k: int = 4,
+    books: Optional[List[str]] = None,
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Потоковый прогон графа. Отдаёт события (имя, данные):
+      - ("passages", [...]) — как только отработал tools_node;
+      - ("token", "...")    — очередной кусок ответа из generate_node;
+      - ("answer", "...")   — финальный ответ целиком.
+    """
+    books = _normalize_books(books)
+    hit = await asyncio.to_thread(lookup_answer, question, top_k, books)
+    if hit is not None:
+        yield "passages", hit["passages"]
+        yield "token", hit["answer"]
+        yield "answer", hit["answer"]
+        return
+
+    initial_state = _initial_state(question, top_k, books)
+    tool_calls = 0
+    passages: List[Any] = []
+
+    async for mode, chunk in arag_graph.astream(initial_state, stream_mode=["updates", "custom"]):
+        if mode == "custom":
+            yield "token", chunk["token"]
+        elif "tools" in chunk:
+            tool_calls = chunk["tools"].get("tool_calls", tool_calls)
+            passages = chunk["tools"].get("passages", [])
+            yield "passages", passages
+        elif "generate" in chunk:
+            TOOL_CALLS_PER_REQUEST.observe(tool_calls)
+            answer = chunk["generate"]["answer"]
+            await asyncio.to_thread(store_answer, question, top_k, answer, passages, books)
+            yield "answer", answer
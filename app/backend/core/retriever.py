@@ -1,7 +1,249 @@
-from app.backend.services.embeddings import embed     
-from app.backend.services.vector_store import store  
+import asyncio
+import contextvars
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
 
-def retrieve(query: str, top_k: int = 4):
-    # Для E5 важно различать запрос и документ префиксами
-    qv = embed([f"query: {query}"])
-    return store.search(qv.astype("float32"), k=top_k)
\ No newline at end of file
+import numpy as np
+
+from app.backend.core.config import get_settings
+from app.backend.core.metrics import STAGE_SECONDS, observe
+from app.backend.services.embeddings import aembed_query, embed_queries, embed_query
+from app.backend.services.lexical_index import normalize_text
+from app.backend.services.vector_store import store
+
+# Отдельный пул под CPU-работу поиска: async-эндпоинты не держат event loop
+# и не занимают потоки Starlette, пока считается эмбеддинг и идёт поиск в FAISS.
+_executor = ThreadPoolExecutor(
+    max_workers=get_settings().RETRIEVAL_WORKERS,
+    thread_name_prefix="retrieve",
+)
+
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+
+# Цитата в кавычках: «...», "...", “...”, „...“
+_QUOTE_RE = re.compile(r'«([^«»]+)»|"([^"]+)"|“([^“”]+)”|„([^„“”]+)[“”]')
+_MIN_QUOTE_WORDS = 2
+# Поиск цитат: дословные вхождения получают 1.0, кандидаты BM25 — свой скор,
+# нормированный к лучшему из них и ужатый до этого потолка. Список остаётся
+# убывающим по скору, а порог уверенности CONFIDENCE_MIN_TOP_SCORE проходят
+# только дословные совпадения.
+_FUZZY_QUOTE_MAX_SCORE = 0.5
+
+
+def _tag(hits, match: str):
+    """
+    Помечает в метаданных, откуда скор: "exact" — дословное вхождение цитаты,
+    "lexical" — BM25. Сборка контекста не сравнивает их с косинусными скорами.
+    """
+    return [(text, score, {**meta, "match": match}) for text, score, meta in hits]
+
+
+def _mode() -> str:
+    mode = get_settings().RETRIEVAL_MODE.lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown RETRIEVAL_MODE: {mode!r} (expected {', '.join(RETRIEVAL_MODES)})")
+    return mode
+
+
+def extract_quote(query: str) -> Optional[str]:
+    """Самая длинная цитата в кавычках из вопроса (не короче двух слов) или None."""
+    spans = [next(g for g in m.groups() if g is not None) for m in _QUOTE_RE.finditer(query)]
+    spans = [s.strip() for s in spans if len(normalize_text(s).split()) >= _MIN_QUOTE_WORDS]
+    return max(spans, key=len) if spans else None
+
+
+def rrf_fuse(rankings: Sequence[np.ndarray], k: int, rrf_k: int = 60) -> List[int]:
+    """Reciprocal rank fusion: сумма 1 / (rrf_k + ранг) по всем ранжированиям, top-k id."""
+    fused: Dict[int, float] = {}
+    for ids in rankings:
+        for rank, i in enumerate(ids):
+            fused[int(i)] = fused.get(int(i), 0.0) + 1.0 / (rrf_k + rank + 1)
+    return sorted(fused, key=lambda i: -fused[i])[:k]
+
+
+def find_quote(phrase: str, limit: int = 20, books: Optional[List[str]] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Дословные вхождения фразы по индексу цитат, без эмбеддинга и LLM.
+    None — индекс цитат не построен (старый индекс).
+    """
+    with observe(STAGE_SECONDS, "quote_search"):
+        return store.find_quote(phrase, limit=limit, books=books)
+
+
+def _quote_search(quote: str, top_k: int, books: Optional[List[str]] = None):
+    """
+    Поиск цитаты без эмбеддинга: сначала дословные вхождения из индекса цитат
+    (скор 1.0), затем кандидаты BM25 (скор не выше _FUZZY_QUOTE_MAX_SCORE).
+    Без индекса цитат дословные совпадения ищутся среди кандидатов BM25.
+    """
+    settings = get_settings()
+    matches = find_quote(quote, limit=top_k, books=books) or []
+    exact = _tag([(m["text"], 1.0, m["metadata"]) for m in matches], "exact")
+    seen = {m["chunk_id"] for m in matches}
+    if len(exact) >= top_k:
+        return exact
+
+    with observe(STAGE_SECONDS, "lexical_search"):
+        ids, scores = store.lexical_search(quote, k=max(top_k, settings.HYBRID_CANDIDATES), books=books)
+        keep = [j for j, i in enumerate(ids) if int(i) not in seen]
+        hits = store.hits(ids[keep], scores[keep])
+    needle = normalize_text(quote)
+    exact += _tag([(text, 1.0, meta) for text, _, meta in hits if needle in normalize_text(text)], "exact")
+    rest = [h for h in hits if needle not in normalize_text(h[0])]
+    top = max((score for _, score, _ in rest), default=0.0)
+    rest = [(text, _FUZZY_QUOTE_MAX_SCORE * score / top if top > 0 else 0.0, meta) for text, score, meta in rest]
+    rest = _tag(rest, "lexical")
+    return (exact + rest)[:top_k]
+
+
+def _lexical_retrieve(query: str, quote: Optional[str], top_k: int, books: Optional[List[str]] = None):
+    """Поиск без эмбеддинга: цитата из вопроса или (RETRIEVAL_MODE=lexical) весь вопрос по BM25."""
+    if quote is not None:
+        hits = _quote_search(quote, top_k, books)
+        if hits:
+            return hits
+    if _mode() != "lexical":
+        return []
+    with observe(STAGE_SECONDS, "lexical_search"):
+        ids, scores = store.lexical_search(query, k=top_k, books=books)
+        return _tag(store.hits(ids, scores), "lexical")
+
+
+def _lexical_plan(query: str):
+    """(quote, lexical_first): есть ли цитата и нужно ли сначала пробовать поиск без эмбеддинга."""
+    quote = extract_quote(query) if get_settings().QUOTE_FAST_PATH else None
+    return quote, quote is not None or _mode() == "lexical"
+
+
+def retrieve(query: str, top_k: int = 4, books: Optional[List[str]] = None):
+    quote, lexical_first = _lexical_plan(query)
+    if lexical_first:
+        hits = _lexical_retrieve(query, quote, top_k, books)
+        if hits or _mode() == "lexical":
+            return hits
+
+    # Для E5 важно различать запрос и документ префиксами (префикс добавляет embed_query)
+    with observe(STAGE_SECONDS, "embed"):
+        qv = embed_query(query)
+    return _search(qv, top_k, books, query)
+
+
+def _search(qv, top_k: int, books: Optional[List[str]] = None, query: Optional[str] = None):
+    """
+    books — фильтр по файлам книг, применяется внутри FAISS через IDSelector.
+    В режиме hybrid кандидаты FAISS и BM25 сливаются через RRF; порядок — по RRF,
+    а скор остаётся косинусным (0 для найденных только BM25), чтобы пороги
+    уверенности CONFIDENCE_* работали одинаково в dense и hybrid.
+    """
+    if query is None or _mode() != "hybrid":
+        with observe(STAGE_SECONDS, "faiss_search"):
+            return store.search(qv.astype("float32"), k=top_k, books=books)
+
+    with observe(STAGE_SECONDS, "faiss_search"):
+        dense_ids, dense_scores = store.search_ids(qv.astype("float32"), k=_n_candidates(top_k), books=books)
+    return _fuse_hybrid(query, dense_ids, dense_scores, top_k, books)
+
+
+def _n_candidates(top_k: int) -> int:
+    return max(top_k, get_settings().HYBRID_CANDIDATES)
+
+
+def _fuse_hybrid(query: str, dense_ids: np.ndarray, dense_scores: np.ndarray, top_k: int, books=None):
+    """Слияние кандидатов FAISS с BM25 по запросу через RRF (скор — косинусный)."""
+    with observe(STAGE_SECONDS, "lexical_search"):
+        lexical_ids, _ = store.lexical_search(query, k=_n_candidates(top_k), books=books)
+
+    cosine = {int(i): float(score) for i, score in zip(dense_ids, dense_scores)}
+    ids = rrf_fuse([dense_ids, lexical_ids], k=top_k, rrf_k=get_settings().RRF_K)
+    return store.hits(ids, [cosine.get(i, 0.0) for i in ids])
+
+
+def retrieve_batch(queries: List[str], top_k: int = 4, books: Optional[List[str]] = None):
+    """
+    retrieve для пачки запросов: все эмбеддинги — одним вызовом модели,
+    поиск FAISS — одним многострочным index.search. Цитаты и режим lexical
+    обрабатываются по одному, как в retrieve. Результаты — в порядке queries.
+    """
+    results: List[Optional[list]] = [None] * len(queries)
+    dense_rows: List[int] = []
+    for i, query in enumerate(queries):
+        quote, lexical_first = _lexical_plan(query)
+        if lexical_first:
+            hits = _lexical_retrieve(query, quote, top_k, books)
+            if hits or _mode() == "lexical":
+                results[i] = hits
+                continue
+        dense_rows.append(i)
+
+    if dense_rows:
+        hybrid = _mode() == "hybrid"
+        k = _n_candidates(top_k) if hybrid else top_k
+        with observe(STAGE_SECONDS, "embed"):
+            q_vecs = embed_queries([queries[i] for i in dense_rows]).astype("float32")
+        with observe(STAGE_SECONDS, "faiss_search"):
+            idx, scores = store.search_batch_ids(q_vecs, k=k, books=books)
+
+        for row, i in enumerate(dense_rows):
+            found = idx[row] != -1
+            if hybrid:
+                results[i] = _fuse_hybrid(queries[i], idx[row][found], scores[row][found], top_k, books)
+            else:
+                results[i] = store.hits(idx[row][found], scores[row][found])
+    return results
+
+
+async def aretrieve(query: str, top_k: int = 4, books: Optional[List[str]] = None):
+    """
+    Асинхронный retrieve: эмбеддинг ждём у батчера без блокировки потока,
+    поиск FAISS и BM25 выполняем в пуле потоков вне event loop.
+    """
+    loop = asyncio.get_running_loop()
+    quote, lexical_first = _lexical_plan(query)
+    if lexical_first:
+        ctx = contextvars.copy_context()
+        hits = await loop.run_in_executor(_executor, ctx.run, _lexical_retrieve, query, quote, top_k, books)
+        if hits or _mode() == "lexical":
+            return hits
+
+    with observe(STAGE_SECONDS, "embed"):
+        qv = await aembed_query(query)
+
+    # copy_context — чтобы тайминги стадий попали в RequestTimings текущего запроса
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, ctx.run, _search, qv, top_k, books, query)
+
+
+async def aretrieve_batch(queries: List[str], top_k: int = 4, books: Optional[List[str]] = None):
+    """retrieve_batch в пуле потоков поиска, не блокируя event loop."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, ctx.run, retrieve_batch, queries, top_k, books)
+
+
+def submit_retrieve(query: str, top_k: int = 4, books: Optional[List[str]] = None) -> Future:
+    """Запускает retrieve в фоне и сразу возвращает Future (для спекулятивного поиска)."""
+    ctx = contextvars.copy_context()
+    return _executor.submit(ctx.run, retrieve, query, top_k, books)
+
+
+def retrieval_signals(passages) -> dict:
+    """
+    Сигналы уверенности по результату store.search (скоры отсортированы по убыванию):
+    скор лучшего фрагмента, его отрыв от второго и число найденных фрагментов.
+    """
+    scores = [p[1] for p in passages]
+    top_score = scores[0] if scores else 0.0
+    score_gap = scores[0] - scores[1] if len(scores) > 1 else top_score
+    return {"top_score": top_score, "score_gap": score_gap, "count": len(scores)}
+
+
+def is_confident_retrieval(passages) -> bool:
+    """Достаточно ли найденных фрагментов, чтобы сразу генерировать ответ."""
+    settings = get_settings()
+    signals = retrieval_signals(passages)
+    return (
+        signals["count"] >= settings.CONFIDENCE_MIN_PASSAGES
+        and signals["top_score"] >= settings.CONFIDENCE_MIN_TOP_SCORE
+        and signals["score_gap"] >= settings.CONFIDENCE_MIN_SCORE_GAP
+    )
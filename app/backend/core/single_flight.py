@@ -0,0 +1,177 @@
+# app/backend/core/single_flight.py
+
+"""
+Склейка одинаковых одновременных запросов (single-flight) перед RAG-графом.
+
+Ключ — нормализованный вопрос (регистр, ё -> е, пунктуация), top_k и набор книг.
+Внутри процесса первый запрос с ключом становится ведущим и считает граф,
+остальные ждут его Future и получают тот же результат (или ту же ошибку).
+Sync- и async-вызовы делят одну таблицу ожиданий. Async-вычисление идёт
+отдельной задачей: если клиент ведущего отключился, ведомые всё равно
+получат ответ.
+
+Между воркерами uvicorn ведущий держит flock на файле корзины ключа
+в COALESCE_LOCK_DIR. Воркер, заставший блокировку занятой, ждёт её освобождения
+и перечитывает общий кэш ответов: ведущий к этому моменту уже сохранил ответ.
+Корзин 4096, поэтому файлов блокировок конечное число; редкие коллизии разных
+ключей только ненадолго упорядочивают их вычисление.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: склейка только внутри процесса
+    fcntl = None
+
+from app.backend.core.config import get_settings
+from app.backend.core.metrics import COALESCED_REQUESTS
+from app.backend.services.lexical_index import normalize_text
+
+_LOCK_BUCKETS = 4096
+_LOCK_POLL_S = 0.02
+
+
+def coalesce_key(question: str, top_k: int, books: Optional[List[str]] = None) -> str:
+    """books — уже нормализованный (отсортированный) список или None."""
+    return json.dumps([normalize_text(question), top_k, books or []], ensure_ascii=False)
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """Future вычисления ключа и признак, что вызывающий — ведущий."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                COALESCED_REQUESTS.labels("process").inc()
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _finish(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key: str, fn: Callable[[], Any]) -> Any:
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as exc:
+            self._finish(key, future, error=exc)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def arun(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future, leader = self._join(key)
+        if leader:
+            task = asyncio.ensure_future(fn())
+            self._tasks.add(task)
+
+            def done(t: asyncio.Task) -> None:
+                self._tasks.discard(t)
+                if t.cancelled():
+                    self._finish(key, future, error=asyncio.CancelledError())
+                elif t.exception() is not None:
+                    self._finish(key, future, error=t.exception())
+                else:
+                    self._finish(key, future, t.result())
+
+            task.add_done_callback(done)
+        # shield: отмена одного ожидающего не отменяет общее вычисление
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+
+single_flight = SingleFlight()
+
+
+class _WorkerLock:
+    """Неблокирующий flock на файле корзины ключа."""
+
+    def __init__(self, key: str) -> None:
+        lock_dir = get_settings().COALESCE_LOCK_DIR
+        os.makedirs(lock_dir, exist_ok=True)
+        bucket = int(hashlib.sha1(key.encode("utf-8")).hexdigest()[:8], 16) % _LOCK_BUCKETS
+        self.path = os.path.join(lock_dir, f"{bucket:04d}.lock")
+        self._fd: Optional[int] = None
+
+    def try_acquire(self) -> bool:
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+def _worker_lock(key: str, enabled: bool) -> Optional[_WorkerLock]:
+    if not enabled or fcntl is None or not get_settings().COALESCE_CROSS_WORKER:
+        return None
+    return _WorkerLock(key)
+
+
+@contextmanager
+def worker_lock(key: str, enabled: bool = True) -> Iterator[bool]:
+    """
+    Межпроцессная блокировка ключа на время вычисления. Отдаёт True, если её
+    держал другой воркер и мы дождались освобождения: стоит перечитать кэш ответов.
+    Дольше COALESCE_WAIT_S не ждём — считаем сами.
+    """
+    lock = _worker_lock(key, enabled)
+    if lock is None:
+        yield False
+        return
+    waited = False
+    deadline = time.monotonic() + get_settings().COALESCE_WAIT_S
+    while not lock.try_acquire() and time.monotonic() < deadline:
+        waited = True
+        time.sleep(_LOCK_POLL_S)
+    try:
+        yield waited
+    finally:
+        lock.release()
+
+
+@asynccontextmanager
+async def aworker_lock(key: str, enabled: bool = True) -> AsyncIterator[bool]:
+    """Async-вариант worker_lock: ожидание не занимает поток."""
+    lock = _worker_lock(key, enabled)
+    if lock is None:
+        yield False
+        return
+    waited = False
+    deadline = time.monotonic() + get_settings().COALESCE_WAIT_S
+    while not lock.try_acquire() and time.monotonic() < deadline:
+        waited = True
+        await asyncio.sleep(_LOCK_POLL_S)
+    try:
+        yield waited
+    finally:
+        lock.release()
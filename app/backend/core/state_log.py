@@ -0,0 +1,81 @@
+# app/backend/core/state_log.py
+
+"""
+Сэмплированный структурированный лог состояний RAG-графа.
+
+Вместо pprint всего состояния (с полными текстами фрагментов) на каждом шаге
+пишем короткую JSON-сводку и только для доли запросов STATE_LOG_SAMPLE_RATE
+(0 — выключено). Запись идёт через QueueHandler: сам вывод выполняет фоновый
+поток QueueListener, поэтому обработка запроса на нём не блокируется.
+"""
+
+import atexit
+import json
+import logging
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Any, Dict, Optional
+
+from app.backend.core.config import get_settings
+
+_logger = logging.getLogger("app.rag.state")
+_listener: Optional[QueueListener] = None
+_lock = threading.Lock()
+
+
+def _ensure_listener() -> None:
+    global _listener
+    if _listener is not None:
+        return
+    with _lock:
+        if _listener is not None:
+            return
+        queue: SimpleQueue = SimpleQueue()
+        _listener = QueueListener(queue, logging.StreamHandler())
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        _logger.addHandler(QueueHandler(queue))
+        _logger.setLevel(logging.INFO)
+        _logger.propagate = False
+
+
+def should_sample() -> bool:
+    """Решение на весь запрос: логировать ли его шаги."""
+    rate = get_settings().STATE_LOG_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def summarize_state(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Короткая сводка состояния без текстов фрагментов и истории сообщений."""
+    summary: Dict[str, Any] = {
+        "question": state.get("question", "")[:200],
+        "top_k": state.get("top_k"),
+        "books": state.get("books"),
+        "decision": state.get("decision"),
+        "tool_name": state.get("tool_name"),
+        "tool_calls": state.get("tool_calls", 0),
+        "messages": len(state.get("messages", [])),
+    }
+
+    passages = []
+    for passage_data in state.get("passages", []):
+        metadata = passage_data[2] if len(passage_data) == 3 else {}
+        passages.append({
+            "score": round(float(passage_data[1]), 4),
+            "book_name": metadata.get("book_name", ""),
+            "page_number": metadata.get("page_number", 0),
+        })
+    summary["passages"] = passages
+
+    if "answer" in state:
+        summary["answer_chars"] = len(state["answer"])
+    return summary
+
+
+def log_state(step: int, state: Dict[str, Any]) -> None:
+    _ensure_listener()
+    record = {"step": step, **summarize_state(state)}
+    _logger.info(json.dumps(record, ensure_ascii=False))
@@ -0,0 +1,277 @@
+# app/backend/services/chunk_store.py
+
+"""
+Бинарное хранилище чанков, открываемое через mmap.
+
+Вместо store.pkl (pickle со списком всех строк и списком словарей метаданных,
+который каждый воркер целиком распаковывает в свою память) на диске лежат:
+
+    chunks.bin          — тексты чанков подряд в UTF-8;
+    chunks.offsets.npy  — int64[N+1], байтовые границы текстов в chunks.bin;
+    chunks.page.npy     — int32[N], номер страницы;
+    chunks.book.npy     — int32[N], id книги (индекс в book_names);
+    chunks.file.npy     — int32[N], id файла (индекс в filenames);
+    chunks.start.npy    — int32[N], смещение чанка в тексте страницы, символов (-1 — неизвестно);
+    chunks.dicts.json   — {"book_names": [...], "filenames": [...]}.
+
+Все массивы открываются через mmap: старт не зависит от размера корпуса,
+а воркеры uvicorn делят одни и те же страницы через кэш ОС.
+Старые индексы со store.pkl читаются через LegacyChunkStore.
+"""
+
+import json
+import mmap
+import os
+import pickle
+import sys
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+BLOB_FILE = "chunks.bin"
+OFFSETS_FILE = "chunks.offsets.npy"
+PAGE_FILE = "chunks.page.npy"
+BOOK_FILE = "chunks.book.npy"
+FILE_FILE = "chunks.file.npy"
+START_FILE = "chunks.start.npy"
+DICTS_FILE = "chunks.dicts.json"
+LEGACY_FILE = "store.pkl"
+
+
+def _save_array(path: str, data: np.ndarray) -> None:
+    """np.save через временный файл: при падении на диске остаётся старая или новая версия, но не обрывок."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, data)
+    os.replace(tmp_path, path)
+
+
+def _runs(file_ids: np.ndarray) -> Dict[int, List[Tuple[int, int]]]:
+    """
+    Непрерывные диапазоны id [start, end) для каждого id файла.
+    Индексация идёт книга за книгой, поэтому у книги обычно ровно один диапазон.
+    """
+    if len(file_ids) == 0:
+        return {}
+    bounds = np.flatnonzero(np.diff(file_ids)) + 1
+    starts = np.concatenate(([0], bounds))
+    ends = np.concatenate((bounds, [len(file_ids)]))
+    runs: Dict[int, List[Tuple[int, int]]] = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        runs.setdefault(int(file_ids[start]), []).append((start, end))
+    return runs
+
+
+class ChunkStoreWriter:
+    """
+    Потоковая запись хранилища: тексты сразу уходят в chunks.bin, колонки — в компактные array.
+    resume=True продолжает сохранённое хранилище; limit — сколько чанков из него оставить
+    (столько, сколько записано в контрольной точке сборки).
+    """
+
+    def __init__(self, index_dir: str, resume: bool = False, limit: Optional[int] = None) -> None:
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self._offsets = array("q", [0])
+        self._pages = array("i")
+        self._books = array("i")
+        self._files = array("i")
+        self._starts = array("i")
+        self._book_ids: Dict[str, int] = {}
+        self._file_ids: Dict[str, int] = {}
+        if resume and has_chunk_store(index_dir):
+            self._load_checkpoint()
+            if limit is not None:
+                self._truncate(limit)
+        blob_path = os.path.join(index_dir, BLOB_FILE)
+        self._blob = open(blob_path, "r+b" if resume and os.path.exists(blob_path) else "wb")
+        # После падения в chunks.bin могут остаться тексты после последнего checkpoint — отрезаем их
+        self._blob.truncate(self._offsets[-1])
+        self._blob.seek(self._offsets[-1])
+
+    def _load_checkpoint(self) -> None:
+        self._offsets = array("q", np.load(os.path.join(self.index_dir, OFFSETS_FILE)).tobytes())
+        self._pages = array("i", np.load(os.path.join(self.index_dir, PAGE_FILE)).tobytes())
+        self._books = array("i", np.load(os.path.join(self.index_dir, BOOK_FILE)).tobytes())
+        self._files = array("i", np.load(os.path.join(self.index_dir, FILE_FILE)).tobytes())
+        start_path = os.path.join(self.index_dir, START_FILE)
+        if os.path.exists(start_path):
+            self._starts = array("i", np.load(start_path).tobytes())
+        else:   # контрольная точка без колонки смещений
+            self._starts = array("i", [-1] * len(self._pages))
+        with open(os.path.join(self.index_dir, DICTS_FILE), encoding="utf-8") as f:
+            dicts = json.load(f)
+        self._book_ids = {name: i for i, name in enumerate(dicts["book_names"])}
+        self._file_ids = {name: i for i, name in enumerate(dicts["filenames"])}
+
+    def _truncate(self, n: int) -> None:
+        if len(self._pages) < n:
+            raise ValueError(f"Chunk store in {self.index_dir} has {len(self._pages)} chunks, expected {n}")
+        del self._offsets[n + 1:]
+        del self._pages[n:]
+        del self._books[n:]
+        del self._files[n:]
+        del self._starts[n:]
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def append(
+        self,
+        text: str,
+        page_number: int = 0,
+        book_name: str = "",
+        filename: str = "",
+        char_start: int = -1,
+    ) -> int:
+        data = text.encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        self._pages.append(int(page_number))
+        self._books.append(self._book_ids.setdefault(book_name, len(self._book_ids)))
+        self._files.append(self._file_ids.setdefault(filename, len(self._file_ids)))
+        self._starts.append(int(char_start))
+        return len(self._pages) - 1
+
+    def flush(self) -> None:
+        """Сбрасывает на диск всё записанное: после этого хранилище можно открыть или продолжить (resume)."""
+        self._blob.flush()
+        os.fsync(self._blob.fileno())
+        _save_array(os.path.join(self.index_dir, OFFSETS_FILE), np.frombuffer(self._offsets, dtype=np.int64))
+        _save_array(os.path.join(self.index_dir, PAGE_FILE), np.frombuffer(self._pages, dtype=np.int32))
+        _save_array(os.path.join(self.index_dir, BOOK_FILE), np.frombuffer(self._books, dtype=np.int32))
+        _save_array(os.path.join(self.index_dir, FILE_FILE), np.frombuffer(self._files, dtype=np.int32))
+        _save_array(os.path.join(self.index_dir, START_FILE), np.frombuffer(self._starts, dtype=np.int32))
+        dicts_path = os.path.join(self.index_dir, DICTS_FILE)
+        with open(dicts_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"book_names": list(self._book_ids), "filenames": list(self._file_ids)},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(dicts_path + ".tmp", dicts_path)
+
+    def close(self) -> None:
+        self.flush()
+        self._blob.close()
+
+
+class MmapChunkStore:
+    """Чтение бинарного хранилища через mmap."""
+
+    def __init__(self, index_dir: str) -> None:
+        path = os.path.join(index_dir, BLOB_FILE)
+        self._blob: Any = b""
+        if os.path.getsize(path) > 0:   # пустой файл mmap не открывает
+            with open(path, "rb") as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        self.pages = np.load(os.path.join(index_dir, PAGE_FILE), mmap_mode="r")
+        self.books = np.load(os.path.join(index_dir, BOOK_FILE), mmap_mode="r")
+        self.files = np.load(os.path.join(index_dir, FILE_FILE), mmap_mode="r")
+        start_path = os.path.join(index_dir, START_FILE)
+        # Индексы, собранные до появления колонки, смещений не знают
+        self.starts = np.load(start_path, mmap_mode="r") if os.path.exists(start_path) else None
+        with open(os.path.join(index_dir, DICTS_FILE), encoding="utf-8") as f:
+            dicts = json.load(f)
+        self.book_names: List[str] = dicts["book_names"]
+        self.filenames: List[str] = dicts["filenames"]
+        self._ranges: Optional[Dict[str, List[Tuple[int, int]]]] = None   # файл -> диапазоны id
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+    def text(self, i: int) -> str:
+        return self._blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode("utf-8")
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        meta = {
+            "page_number": int(self.pages[i]),
+            "book_name": self.book_names[self.books[i]],
+            "filename": self.filenames[self.files[i]],
+        }
+        if self.starts is not None and self.starts[i] >= 0:
+            meta["char_start"] = int(self.starts[i])
+        return meta
+
+    def id_ranges(self, filenames: Iterable[str]) -> List[Tuple[int, int]]:
+        """Диапазоны id чанков [start, end) перечисленных файлов (неизвестные файлы пропускаются)."""
+        if self._ranges is None:
+            runs = _runs(np.asarray(self.files))
+            self._ranges = {name: runs.get(i, []) for i, name in enumerate(self.filenames)}
+        return sorted(r for name in filenames for r in self._ranges.get(name, []))
+
+
+class LegacyChunkStore:
+    """Старый формат store.pkl: {"chunks": [...], "metadata": [...]} целиком в памяти."""
+
+    def __init__(self, meta_path: str) -> None:
+        with open(meta_path, "rb") as f:
+            meta = pickle.load(f)
+        self.chunks: List[str] = meta["chunks"]
+        self.metadata_list: List[Dict[str, Any]] = meta.get("metadata", [])
+        self._ranges: Optional[Dict[str, List[Tuple[int, int]]]] = None
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def text(self, i: int) -> str:
+        return self.chunks[i]
+
+    def metadata(self, i: int) -> Dict[str, Any]:
+        if i < len(self.metadata_list):
+            return self.metadata_list[i]
+        return {}
+
+    def id_ranges(self, filenames: Iterable[str]) -> List[Tuple[int, int]]:
+        if self._ranges is None:
+            names = [m.get("filename", "") for m in self.metadata_list]
+            name_ids = {name: i for i, name in enumerate(dict.fromkeys(names))}
+            runs = _runs(np.array([name_ids[n] for n in names], dtype=np.int32))
+            self._ranges = {name: runs.get(i, []) for name, i in name_ids.items()}
+        return sorted(r for name in filenames for r in self._ranges.get(name, []))
+
+
+def has_chunk_store(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, DICTS_FILE))
+
+
+def open_chunk_store(index_dir: str, legacy_path: Optional[str] = None):
+    """Открывает бинарное хранилище, а если его нет — старый store.pkl."""
+    if has_chunk_store(index_dir):
+        return MmapChunkStore(index_dir)
+    legacy_path = legacy_path or os.path.join(index_dir, LEGACY_FILE)
+    if os.path.exists(legacy_path):
+        return LegacyChunkStore(legacy_path)
+    raise FileNotFoundError(
+        f"Chunk store not found in {index_dir} (neither {DICTS_FILE} nor {LEGACY_FILE}). "
+        f"You need to build the index first or set INDEX_DIR correctly."
+    )
+
+
+def convert_legacy_store(index_dir: str) -> int:
+    """Переписывает store.pkl в бинарный формат рядом с ним. Возвращает число чанков."""
+    legacy = LegacyChunkStore(os.path.join(index_dir, LEGACY_FILE))
+    writer = ChunkStoreWriter(index_dir)
+    for i in range(len(legacy)):
+        meta = legacy.metadata(i)
+        writer.append(
+            legacy.text(i),
+            page_number=meta.get("page_number", 0),
+            book_name=meta.get("book_name", ""),
+            filename=meta.get("filename", ""),
+            char_start=meta.get("char_start", -1),
+        )
+    writer.close()
+    return len(writer)
+
+
+if __name__ == "__main__":
+    # python -m app.backend.services.chunk_store [INDEX_DIR] — конвертация старого store.pkl
+    from app.backend.core.config import get_settings
+
+    from app.backend.services.index_layout import resolve_index_dir
+
+    target_dir = resolve_index_dir(sys.argv[1] if len(sys.argv) > 1 else get_settings().INDEX_DIR)
+    print(f"Converted {convert_legacy_store(target_dir)} chunks in {target_dir}")
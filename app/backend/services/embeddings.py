@@ -1,18 +1,59 @@
 # app/backend/services/embeddings.py
 
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from functools import lru_cache
 
 import numpy as np
-from sentence_transformers import SentenceTransformer
 
 from app.backend.core.config import get_settings
+from app.backend.core.metrics import EMBED_BATCH_SIZE, EMBED_QUEUE_WAIT_SECONDS
+from app.backend.services.query_cache import QueryEmbeddingCache
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+_logger = logging.getLogger(__name__)
 
 
 @lru_cache(maxsize=1)
-def _get_model() -> SentenceTransformer:
-    """Ленивая загрузка модели эмбеддингов (кэшируется на процесс)."""
+def _get_model():
+    """
+    Ленивая загрузка модели эмбеддингов (кэшируется на процесс).
+    torch — SentenceTransformer; onnx / onnx-int8 — OnnxEncoder из EMBEDDING_MODEL_PATH,
+    при этом torch не импортируется вовсе (быстрый старт воркера).
+    """
+    settings = get_settings()
+    backend = settings.EMBEDDING_BACKEND.lower()
+    if backend == "torch":
+        from sentence_transformers import SentenceTransformer
+
+        return SentenceTransformer(settings.EMBEDDING_MODEL_PATH or settings.EMBEDDING_MODEL)
+    if backend in ("onnx", "onnx-int8"):
+        from app.backend.services.onnx_encoder import OnnxEncoder
+
+        if not settings.EMBEDDING_MODEL_PATH:
+            raise ValueError(f"EMBEDDING_BACKEND={backend} requires EMBEDDING_MODEL_PATH with an exported model")
+        return OnnxEncoder(
+            settings.EMBEDDING_MODEL_PATH,
+            backend=backend,
+            max_length=settings.EMBEDDING_MAX_LENGTH,
+            num_threads=settings.EMBED_NUM_THREADS,
+        )
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend!r} (expected {', '.join(EMBEDDING_BACKENDS)})")
+
+
+def embedding_model_id() -> str:
+    """
+    Идентификатор векторного пространства для ключей кэшей: имя модели,
+    а для ONNX-бэкендов — ещё и бэкенд (int8-векторы чуть отличаются от fp32).
+    """
     settings = get_settings()
-    return SentenceTransformer(settings.EMBEDDING_MODEL)
+    backend = settings.EMBEDDING_BACKEND.lower()
+    return settings.EMBEDDING_MODEL if backend == "torch" else f"{settings.EMBEDDING_MODEL}@{backend}"
 
 
 def embed(texts: list[str]) -> np.ndarray:
@@ -30,4 +71,153 @@ def embed(texts: list[str]) -> np.ndarray:
         convert_to_numpy=True,
         show_progress_bar=False,
     )
-    return vecs.astype("float32")
\ No newline at end of file
+    return vecs.astype("float32")
+
+
+class EmbeddingBatcher:
+    """
+    Микробатчинг эмбеддингов между конкурентными запросами.
+
+    Вместо того чтобы каждый запрос из своего потока гонял encode() по одной
+    строке (и torch переподписывал ядра), тексты складываются в очередь.
+    Единственный воркер собирает до max_batch_size текстов или ждёт не дольше
+    max_wait_ms после первого, делает один forward-проход и раздаёт каждому
+    вызывающему его строку результата.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0, num_threads: int = 0) -> None:
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.num_threads = num_threads
+        self._queue: "queue.SimpleQueue[tuple[str, Future, float]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """То же, что embed(texts), но через общую очередь батчера."""
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+        futures = [self.submit(t) for t in texts]
+        return np.stack([f.result() for f in futures])
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        # У ONNX-бэкенда число потоков задаётся в сессии onnxruntime
+        if self.num_threads > 0 and get_settings().EMBEDDING_BACKEND.lower() == "torch":
+            import torch
+            torch.set_num_threads(self.num_threads)
+
+        while True:
+            # Поток один на процесс: если он умрёт, все следующие эмбеддинги повиснут
+            try:
+                self._process(self._collect())
+            except Exception:
+                _logger.exception("Embedding batch failed")
+
+    def _process(self, batch: list) -> None:
+        # Отменённые ожидающие (клиент отключился, await отменили через wrap_future)
+        # выбрасываем; остальные переводим в RUNNING — отменить их уже нельзя,
+        # и set_result ниже не упадёт с InvalidStateError.
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
+        EMBED_BATCH_SIZE.observe(len(batch))
+        for _, _, enqueued in batch:
+            EMBED_QUEUE_WAIT_SECONDS.observe(started - enqueued)
+
+        try:
+            vecs = embed([text for text, _, _ in batch])
+        except Exception as exc:
+            for _, future, _ in batch:
+                future.set_exception(exc)
+            return
+
+        for (_, future, _), vec in zip(batch, vecs):
+            future.set_result(vec)
+
+
+@lru_cache(maxsize=1)
+def get_batcher() -> EmbeddingBatcher:
+    settings = get_settings()
+    return EmbeddingBatcher(
+        max_batch_size=settings.EMBED_BATCH_MAX_SIZE,
+        max_wait_ms=settings.EMBED_BATCH_MAX_WAIT_MS,
+        num_threads=settings.EMBED_NUM_THREADS,
+    )
+
+
+@lru_cache(maxsize=1)
+def get_query_cache() -> QueryEmbeddingCache:
+    settings = get_settings()
+    return QueryEmbeddingCache(
+        model_name=embedding_model_id(),
+        max_size=settings.QUERY_CACHE_SIZE,
+        ttl_seconds=settings.QUERY_CACHE_TTL,
+        disk_dir=settings.QUERY_CACHE_DIR,
+        disk_max_rows=settings.QUERY_CACHE_DISK_MAX_ROWS,
+    )
+
+
+def embed_query(query: str) -> np.ndarray:
+    """Эмбеддинг поискового запроса формы (1, D) с префиксом E5 `query:` — через кэш."""
+    cache = get_query_cache()
+    key = cache.key(query)
+    vec = cache.get(key)
+    if vec is None:
+        if get_settings().EMBED_BATCHING:
+            vec = get_batcher().submit(f"query: {query}").result()
+        else:
+            vec = embed([f"query: {query}"])[0]
+        cache.put(key, vec)
+    return vec[None, :]
+
+
+def embed_queries(queries: list[str]) -> np.ndarray:
+    """
+    Эмбеддинги пачки запросов формы (N, D) через кэш: все промахи считаются
+    одним вызовом модели, мимо батчера — пачка и так уже собрана.
+    """
+    cache = get_query_cache()
+    keys = [cache.key(q) for q in queries]
+    vecs = [cache.get(key) for key in keys]
+    missing = [i for i, vec in enumerate(vecs) if vec is None]
+    if missing:
+        fresh = embed([f"query: {queries[i]}" for i in missing])
+        for i, vec in zip(missing, fresh):
+            vecs[i] = vec
+            cache.put(keys[i], vec)
+    return np.stack(vecs)
+
+
+async def aembed_query(query: str) -> np.ndarray:
+    """
+    Асинхронный embed_query: ждём батчер, не занимая поток, поэтому в один
+    батч попадают запросы всех конкурентных корутин, а не только тех,
+    кому досталось место в пуле потоков.
+    """
+    cache = get_query_cache()
+    key = cache.key(query)
+    vec = cache.get(key)
+    if vec is None:
+        if get_settings().EMBED_BATCHING:
+            vec = await asyncio.wrap_future(get_batcher().submit(f"query: {query}"))
+        else:
+            vec = (await asyncio.to_thread(embed, [f"query: {query}"]))[0]
+        cache.put(key, vec)
+    return vec[None, :]
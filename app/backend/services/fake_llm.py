@@ -0,0 +1,138 @@
+# app/backend/services/fake_llm.py
+
+"""
+Локальная фейковая чат-модель (LLM_PROVIDER=fake) для бенчмарков и нагрузочных
+тестов без сети и без ключа API.
+
+Планировщику отвечает валидным JSON: на первом шаге — вызов retrieve,
+после результатов инструмента — {"decision": "answer"}. Генератору — шаблонным
+ответом, собранным из начала первого фрагмента контекста, длиной answer_tokens слов.
+
+Задержка эмулирует провайдера: время до первого токена — логнормальное
+с медианой latency_ms и разбросом latency_sigma, дальше токены идут со скоростью
+tokens_per_s (тоже логнормальной, tokens_per_s_sigma). Токены считаются по словам,
+usage_metadata заполняется, так что метрики токенов работают как с настоящей моделью.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+CANNED_ANSWER = "По приведённым фрагментам книги можно ответить так"
+NO_CONTEXT_ANSWER = "В приведённых фрагментах недостаточно информации, чтобы ответить на вопрос."
+
+_FIRST_PASSAGE_RE = re.compile(r"^\[1\][^:]*:\s*(.+)$", re.MULTILINE)
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    return content if isinstance(content, str) else json.dumps(content, ensure_ascii=False)
+
+
+def _count_tokens(text: str) -> int:
+    # Грубая оценка в духе BPE: ~4 символа на токен
+    return max(1, len(text) // 4)
+
+
+class FakeChatModel(BaseChatModel):
+    latency_ms: float = 300.0          # медиана времени до первого токена
+    latency_sigma: float = 0.0         # sigma логнормального распределения (0 — фиксированная задержка)
+    tokens_per_s: float = 50.0         # медиана скорости выдачи токенов (0 — мгновенно)
+    tokens_per_s_sigma: float = 0.0
+    answer_tokens: int = 60            # длина ответа генератора в словах
+    seed: Optional[int] = None
+
+    _rng: random.Random = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    # --- содержимое ответа ---
+
+    def _reply(self, messages: List[BaseMessage]) -> str:
+        if any('"decision"' in _text(m) for m in messages):
+            if any(m.type == "ai" for m in messages):
+                return json.dumps({"decision": "answer"})
+            return json.dumps({"decision": "tool", "tool_name": "retrieve", "tool_args": {}})
+
+        match = _FIRST_PASSAGE_RE.search(_text(messages[-1]))
+        if not match:
+            return NO_CONTEXT_ANSWER
+        words = (CANNED_ANSWER + " [1]: " + match.group(1)).split()
+        while len(words) < self.answer_tokens:
+            words += words
+        return " ".join(words[:self.answer_tokens])
+
+    def _usage(self, messages: List[BaseMessage], reply: str) -> dict:
+        input_tokens = sum(_count_tokens(_text(m)) for m in messages)
+        output_tokens = len(reply.split())
+        return {"input_tokens": input_tokens, "output_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+
+    # --- задержки ---
+
+    def _sample(self, median: float, sigma: float) -> float:
+        return median * math.exp(self._rng.gauss(0.0, sigma)) if sigma > 0 else median
+
+    def _first_token_delay(self) -> float:
+        return self._sample(self.latency_ms, self.latency_sigma) / 1000
+
+    def _token_delay(self) -> float:
+        """Пауза между токенами одного ответа (скорость выбирается заново для каждого ответа)."""
+        rate = self._sample(self.tokens_per_s, self.tokens_per_s_sigma)
+        return 1.0 / rate if rate > 0 else 0.0
+
+    def _chunks(self, reply: str) -> List[str]:
+        words = reply.split(" ")
+        return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+    # --- интерфейс BaseChatModel ---
+
+    def _result(self, messages: List[BaseMessage], reply: str) -> ChatResult:
+        message = AIMessage(content=reply, usage_metadata=self._usage(messages, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        reply = self._reply(messages)
+        time.sleep(self._first_token_delay() + self._token_delay() * len(reply.split()))
+        return self._result(messages, reply)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        reply = self._reply(messages)
+        await asyncio.sleep(self._first_token_delay() + self._token_delay() * len(reply.split()))
+        return self._result(messages, reply)
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        reply = self._reply(messages)
+        token_delay = self._token_delay()
+        time.sleep(self._first_token_delay())
+        for i, token in enumerate(self._chunks(reply)):
+            if i:
+                time.sleep(token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        # usage — последним куском, как у провайдеров
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, reply)))
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        reply = self._reply(messages)
+        token_delay = self._token_delay()
+        await asyncio.sleep(self._first_token_delay())
+        for i, token in enumerate(self._chunks(reply)):
+            if i:
+                await asyncio.sleep(token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=self._usage(messages, reply)))
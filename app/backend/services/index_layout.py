@@ -0,0 +1,81 @@
+# app/backend/services/index_layout.py
+
+"""
+Версии индекса внутри INDEX_DIR.
+
+Каждая сборка ingest лежит целиком в своей директории INDEX_DIR/versions/<метка>,
+а файл INDEX_DIR/CURRENT хранит метку действующей. Публикация новой сборки —
+переименование готовой директории и атомарная замена CURRENT через os.replace:
+воркер, который стартует в этот момент или после падения ingest, видит либо
+старый индекс целиком, либо новый, но не смесь их файлов.
+
+Рядом остаётся предыдущая версия (её ещё могут держать открытой воркеры,
+стартовавшие до переключения); более старые версии и файлы индекса старого
+плоского формата (прямо в INDEX_DIR) удаляются при публикации. Пока CURRENT
+нет, индекс плоского формата читается как раньше.
+"""
+
+import os
+import shutil
+from typing import List, Optional
+
+VERSIONS_DIR = "versions"
+CURRENT_FILE = "CURRENT"
+
+# Файлы индекса плоского формата: после перехода на версии они устаревают
+_FLAT_FILES = ("index.faiss", "index_version", "store.pkl", "chunk_keys.npy")
+_FLAT_PREFIXES = ("chunks.", "lexical.", "quote.")
+
+
+def current_version(index_dir: str) -> Optional[str]:
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_dir(index_dir: str) -> str:
+    """Директория с файлами действующего индекса: версия из CURRENT или сам index_dir."""
+    version = current_version(index_dir)
+    return os.path.join(index_dir, VERSIONS_DIR, version) if version else index_dir
+
+
+def index_versions(index_dir: str) -> List[str]:
+    """Директории всех хранящихся версий (для плоского формата — сам index_dir)."""
+    versions_dir = os.path.join(index_dir, VERSIONS_DIR)
+    if not os.path.isdir(versions_dir):
+        return [index_dir]
+    return [os.path.join(versions_dir, name) for name in sorted(os.listdir(versions_dir))]
+
+
+def publish_index(index_dir: str, build_dir: str, version: str) -> str:
+    """
+    Делает готовую сборку build_dir действующей версией version и возвращает её путь.
+    build_dir должен лежать на той же файловой системе, что и index_dir.
+    """
+    previous = current_version(index_dir)
+    target = os.path.join(index_dir, VERSIONS_DIR, version)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(build_dir, target)
+
+    tmp_path = os.path.join(index_dir, CURRENT_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(index_dir, CURRENT_FILE))
+
+    _remove_stale(index_dir, keep={version, previous})
+    return target
+
+
+def _remove_stale(index_dir: str, keep: set) -> None:
+    versions_dir = os.path.join(index_dir, VERSIONS_DIR)
+    for name in os.listdir(versions_dir):
+        if name not in keep:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    for name in os.listdir(index_dir):
+        path = os.path.join(index_dir, name)
+        if os.path.isfile(path) and (name in _FLAT_FILES or name.startswith(_FLAT_PREFIXES)):
+            os.remove(path)
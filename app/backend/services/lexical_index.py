@@ -0,0 +1,236 @@
+# app/backend/services/lexical_index.py
+
+"""
+Лексический индекс BM25 по фрагментам книг.
+
+Строится при индексации рядом с index.faiss и читается через mmap:
+
+    lexical.vocab.json   — {"terms": [...], "avgdl": ..., "k1": ..., "b": ...};
+    lexical.indptr.npy   — int64[V+1], границы списков вхождений терминов (CSR);
+    lexical.docs.npy     — int32[nnz], id чанков, отсортированы внутри термина;
+    lexical.tfs.npy      — uint16[nnz], частота термина в чанке;
+    lexical.doclen.npy   — int32[N], длина чанка в терминах.
+
+Термины — слова после нормализации (регистр, ё -> е) и лёгкого
+стемминга русских окончаний, чтобы «кольца», «кольцом» и «кольцо» совпадали.
+Поиск не требует эмбеддинга запроса, поэтому цитаты ищутся без модели.
+"""
+
+import json
+import os
+import re
+import sys
+import unicodedata
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+VOCAB_FILE = "lexical.vocab.json"
+INDPTR_FILE = "lexical.indptr.npy"
+DOCS_FILE = "lexical.docs.npy"
+TFS_FILE = "lexical.tfs.npy"
+DOCLEN_FILE = "lexical.doclen.npy"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_CYRILLIC_RE = re.compile(r"[а-я]")
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+# Частые служебные слова: в BM25 у них почти нулевой idf, а списки вхождений огромные
+STOPWORDS = frozenset(
+    "и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только "
+    "ее мне было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни "
+    "быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где "
+    "есть надо ней для мы тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж "
+    "тогда кто этот того потому этого какой совсем ним здесь этом один почти мой тем чтобы нее "
+    "были куда зачем всех никогда можно при наконец два об другой хоть после над больше тот "
+    "через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед "
+    "иногда лучше чуть том нельзя такой им более всегда конечно всю между".split()
+)
+
+# Окончания русских слов, от длинных к коротким (лёгкий стеммер в духе Snowball)
+_REFLEXIVE = ("ся", "сь")
+_ENDINGS = tuple(sorted(
+    (
+        "ыми ими его ого ему ому ее ие ые ое ей ий ый ой ем им ым ом их ых ую юю ая яя ою ею "
+        "ешь ете ишь ите ать ять ить еть уть ла ло ли ть ет ит ут ют ат ят ал ял ил ел "
+        "ами ями ах ях ов ев ам ям ия ья ье ию ью а я о е и ы у ю ь й"
+    ).split(),
+    key=len,
+    reverse=True,
+))
+_MIN_STEM = 3
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация для сравнения строк: регистр, ё -> е, пунктуация и пробелы -> один пробел."""
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return _NON_WORD_RE.sub(" ", text).strip()
+
+
+@lru_cache(maxsize=200_000)
+def stem(word: str) -> str:
+    if not _CYRILLIC_RE.search(word):
+        return word
+    for suffix in _REFLEXIVE:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            word = word[: -len(suffix)]
+            break
+    for suffix in _ENDINGS:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[: -len(suffix)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Термины текста: нормализованные слова без служебных, со стеммингом."""
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return [stem(w) for w in _WORD_RE.findall(text) if w not in STOPWORDS]
+
+
+class LexicalIndexWriter:
+    """Накопление вхождений по мере индексации; close() сортирует их в CSR и пишет на диск."""
+
+    def __init__(self) -> None:
+        self._term_ids: Dict[str, int] = {}
+        self._terms = array("i")
+        self._docs = array("i")
+        self._tfs = array("H")
+        self._doclen = array("i")
+
+    def __len__(self) -> int:
+        return len(self._doclen)
+
+    def add(self, text: str) -> int:
+        doc_id = len(self._doclen)
+        counts: Dict[int, int] = {}
+        tokens = tokenize(text)
+        for token in tokens:
+            term_id = self._term_ids.setdefault(token, len(self._term_ids))
+            counts[term_id] = counts.get(term_id, 0) + 1
+        for term_id, tf in counts.items():
+            self._terms.append(term_id)
+            self._docs.append(doc_id)
+            self._tfs.append(min(tf, 65535))
+        self._doclen.append(len(tokens))
+        return doc_id
+
+    def close(self, index_dir: str, k1: float = 1.2, b: float = 0.75) -> None:
+        terms = np.frombuffer(self._terms, dtype=np.int32)
+        docs = np.frombuffer(self._docs, dtype=np.int32)
+        tfs = np.frombuffer(self._tfs, dtype=np.uint16)
+        doclen = np.frombuffer(self._doclen, dtype=np.int32)
+
+        # Термины в словаре — по алфавиту, вхождения — по (термин, чанк)
+        vocab = sorted(self._term_ids)
+        remap = np.empty(len(self._term_ids), dtype=np.int32)
+        for new_id, term in enumerate(vocab):
+            remap[self._term_ids[term]] = new_id
+        terms = remap[terms] if len(terms) else terms
+        order = np.lexsort((docs, terms))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocab)), out=indptr[1:])
+
+        np.save(os.path.join(index_dir, INDPTR_FILE), indptr)
+        np.save(os.path.join(index_dir, DOCS_FILE), docs[order])
+        np.save(os.path.join(index_dir, TFS_FILE), tfs[order])
+        np.save(os.path.join(index_dir, DOCLEN_FILE), doclen)
+        with open(os.path.join(index_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(
+                {"terms": vocab, "avgdl": float(doclen.mean()) if len(doclen) else 0.0, "k1": k1, "b": b},
+                f,
+                ensure_ascii=False,
+            )
+
+
+class LexicalIndex:
+    """BM25-поиск по CSR-спискам вхождений, открытым через mmap."""
+
+    def __init__(self, index_dir: str) -> None:
+        with open(os.path.join(index_dir, VOCAB_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.term_ids: Dict[str, int] = {term: i for i, term in enumerate(meta["terms"])}
+        self.avgdl: float = meta["avgdl"] or 1.0
+        self.k1: float = meta["k1"]
+        self.b: float = meta["b"]
+        self.indptr = np.load(os.path.join(index_dir, INDPTR_FILE), mmap_mode="r")
+        self.docs = np.load(os.path.join(index_dir, DOCS_FILE), mmap_mode="r")
+        self.tfs = np.load(os.path.join(index_dir, TFS_FILE), mmap_mode="r")
+        self.doclen = np.load(os.path.join(index_dir, DOCLEN_FILE), mmap_mode="r")
+        self.n_docs = len(self.doclen)
+        # Знаменатель BM25 без tf зависит только от длины чанка — считаем один раз
+        self._norm = (self.k1 * (1 - self.b + self.b * np.asarray(self.doclen, dtype=np.float32) / self.avgdl))
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        ranges: Optional[Sequence[Tuple[int, int]]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        top-k чанков по BM25: (ids, scores) по убыванию скора.
+        ranges — допустимые диапазоны id [start, end) (фильтр по книгам).
+        """
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        touched = False
+        for term in set(tokenize(query)):
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, end = int(self.indptr[term_id]), int(self.indptr[term_id + 1])
+            docs = np.asarray(self.docs[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype=np.float32)
+            df = end - start
+            idf = np.log(1.0 + (self.n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+            touched = True
+
+        if not touched:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if ranges is not None:
+            allowed = np.zeros(self.n_docs, dtype=bool)
+            for start, end in ranges:
+                allowed[start:end] = True
+            scores[~allowed] = 0.0
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return top.astype(np.int64), scores[top]
+
+
+def has_lexical_index(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, VOCAB_FILE))
+
+
+def open_lexical_index(index_dir: str) -> Optional[LexicalIndex]:
+    """Лексический индекс директории или None, если он не построен."""
+    return LexicalIndex(index_dir) if has_lexical_index(index_dir) else None
+
+
+def build_lexical_index(index_dir: str, texts: Iterable[str]) -> int:
+    writer = LexicalIndexWriter()
+    for text in texts:
+        writer.add(text)
+    writer.close(index_dir)
+    return len(writer)
+
+
+if __name__ == "__main__":
+    # python -m app.backend.services.lexical_index [INDEX_DIR] — построить BM25 для готового индекса
+    from app.backend.core.config import get_settings
+    from app.backend.services.chunk_store import open_chunk_store
+
+    from app.backend.services.index_layout import resolve_index_dir
+
+    target_dir = resolve_index_dir(sys.argv[1] if len(sys.argv) > 1 else get_settings().INDEX_DIR)
+    chunk_store = open_chunk_store(target_dir)
+    count = build_lexical_index(target_dir, (chunk_store.text(i) for i in range(len(chunk_store))))
+    print(f"Built lexical index for {count} chunks in {target_dir}")
@@ -0,0 +1,121 @@
+# app/backend/services/llm.py
+
+import os
+
+from langchain_core.language_models.chat_models import BaseChatModel
+
+from app.backend.core.config import get_settings
+
+LLM_PROVIDERS = ("mistral", "openai", "fake")
+MISTRAL_BASE_URL = "https://api.mistral.ai/v1"
+
+
+def _chat_mistral(base_url: str, api_key: str) -> BaseChatModel:
+    """
+    ChatMistralAI с собственными HTTP-клиентами: keep-alive соединения живут
+    LLM_KEEPALIVE_S (у httpx по умолчанию 5 с — при паузах в трафике TLS
+    пересоздаётся), пул ограничен LLM_MAX_CONNECTIONS, таймаут — LLM_TIMEOUT_S.
+    Свои повторы клиента выключены, если повторяет шлюз.
+    """
+    import httpx
+    from langchain_mistralai import ChatMistralAI
+
+    settings = get_settings()
+    client_args = dict(
+        base_url=base_url,
+        headers={
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {api_key}",
+        },
+        timeout=httpx.Timeout(settings.LLM_TIMEOUT_S, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_S,
+        ),
+    )
+    return ChatMistralAI(
+        model=settings.LLM_MODEL,
+        base_url=base_url,
+        api_key=api_key,
+        client=httpx.Client(**client_args),
+        async_client=httpx.AsyncClient(**client_args),
+        max_retries=1 if settings.LLM_GATEWAY else 5,
+    )
+
+
+def _provider_base_url(provider: str) -> str:
+    if provider == "mistral":
+        return os.environ.get("MISTRAL_BASE_URL") or MISTRAL_BASE_URL
+    if provider == "openai":
+        return get_settings().LLM_BASE_URL
+    return ""
+
+
+def llm_identity() -> str:
+    """
+    Какая LLM отвечает: провайдер, адрес сервера и модель. Входит в пространство
+    кэша ответов, чтобы ответы fake-модели или другого сервера с тем же именем
+    модели не отдавались от имени настоящего провайдера.
+    """
+    settings = get_settings()
+    provider = settings.LLM_PROVIDER.lower()
+    if provider == "fake":
+        return "fake"
+    return f"{provider}@{_provider_base_url(provider)}/{settings.LLM_MODEL}"
+
+
+def create_provider_llm() -> BaseChatModel:
+    """
+    Чат-модель по LLM_PROVIDER, без шлюза:
+
+    mistral — API Mistral (ключ MISTRAL_API_KEY);
+    openai  — любой OpenAI-совместимый сервер по LLM_BASE_URL (vLLM, llama.cpp, Ollama, LM Studio):
+              формат /chat/completions у Mistral тот же, поэтому используется тот же клиент;
+    fake    — локальная FakeChatModel с настраиваемой задержкой, без сети.
+    """
+    settings = get_settings()
+    provider = settings.LLM_PROVIDER.lower()
+    if provider == "mistral":
+        return _chat_mistral(_provider_base_url(provider), os.environ.get("MISTRAL_API_KEY", ""))
+    if provider == "openai":
+        if not settings.LLM_BASE_URL:
+            raise ValueError("LLM_PROVIDER=openai requires LLM_BASE_URL, e.g. http://localhost:8000/v1")
+        # Локальным серверам ключ обычно не нужен, но клиент всегда шлёт заголовок Authorization
+        return _chat_mistral(settings.LLM_BASE_URL, settings.LLM_API_KEY or "local")
+    if provider == "fake":
+        from app.backend.services.fake_llm import FakeChatModel
+
+        return FakeChatModel(
+            latency_ms=settings.FAKE_LLM_LATENCY_MS,
+            latency_sigma=settings.FAKE_LLM_LATENCY_SIGMA,
+            tokens_per_s=settings.FAKE_LLM_TOKENS_PER_S,
+            tokens_per_s_sigma=settings.FAKE_LLM_TOKENS_PER_S_SIGMA,
+            answer_tokens=settings.FAKE_LLM_ANSWER_TOKENS,
+            seed=settings.FAKE_LLM_SEED,
+        )
+    raise ValueError(f"Unknown LLM_PROVIDER: {provider!r} (expected {', '.join(LLM_PROVIDERS)})")
+
+
+def create_llm() -> BaseChatModel:
+    """Модель провайдера, обёрнутая в LLMGateway (если LLM_GATEWAY включён)."""
+    settings = get_settings()
+    llm = create_provider_llm()
+    if not settings.LLM_GATEWAY:
+        return llm
+
+    from app.backend.services.llm_gateway import LLMGateway
+
+    return LLMGateway(
+        llm=llm,
+        max_concurrency=settings.LLM_MAX_CONCURRENCY,
+        requests_per_s=settings.LLM_RPS,
+        tokens_per_min=settings.LLM_TPM,
+        max_retries=settings.LLM_MAX_RETRIES,
+        retry_base_s=settings.LLM_RETRY_BASE_S,
+        retry_max_s=settings.LLM_RETRY_MAX_S,
+        queue_timeout_s=settings.LLM_QUEUE_TIMEOUT_S,
+        breaker_threshold=settings.LLM_BREAKER_THRESHOLD,
+        breaker_cooldown_s=settings.LLM_BREAKER_COOLDOWN_S,
+    )
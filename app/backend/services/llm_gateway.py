@@ -0,0 +1,396 @@
+# app/backend/services/llm_gateway.py
+
+"""
+Шлюз вызовов LLM: обёртка над любой чат-моделью, общая для планировщика и генератора.
+
+- ограничение конкурентности — не больше max_concurrency вызовов одновременно,
+  остальные ждут в очереди FIFO (и sync-, и async-вызовы в одной очереди);
+- token bucket на запросы в секунду и на токены в минуту: токены оцениваются
+  по длине промпта заранее и уточняются по usage_metadata после ответа;
+- повторы на 429, 5xx и сетевые ошибки с экспоненциальной задержкой и полным
+  джиттером, Retry-After от провайдера соблюдается;
+- предохранитель: после breaker_threshold неудачных попыток подряд вызовы
+  breaker_cooldown_s секунд сразу получают LLMUnavailableError, затем один
+  пробный вызов решает, закрыть его или открыть снова.
+
+Ожидание очереди, лимитов и пауз между повторами ограничено queue_timeout_s:
+если провайдер не успевает, запрос получает LLMUnavailableError, а не висит.
+Потоковый ответ повторяется только до первого куска. Лимиты действуют в пределах
+процесса: при нескольких воркерах uvicorn их нужно делить на число воркеров.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from app.backend.core.metrics import LLM_IN_FLIGHT, LLM_QUEUE_SECONDS, LLM_REJECTED, LLM_RETRIES
+
+
+class LLMUnavailableError(RuntimeError):
+    """LLM недоступна: открыт предохранитель или вызов не дождался очереди."""
+
+    def __init__(self, message: str, retry_after: float = 0.0) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Slots:
+    """Семафор с очередью FIFO, которую делят потоки и корутины."""
+
+    def __init__(self, limit: int) -> None:
+        self._free = limit
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()
+
+    def _enqueue(self) -> Optional[Future]:
+        with self._lock:
+            if self._free > 0 and not self._waiters:
+                self._free -= 1
+                return None
+            waiter: Future = Future()
+            self._waiters.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: Future) -> None:
+        # Слот мог быть передан нам, пока мы сдавались, — тогда возвращаем его
+        if not waiter.cancel():
+            self.release()
+
+    def acquire(self, timeout: float) -> None:
+        waiter = self._enqueue()
+        if waiter is None:
+            return
+        try:
+            waiter.result(timeout=max(timeout, 0.0))
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    async def aacquire(self, timeout: float) -> None:
+        waiter = self._enqueue()
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(waiter)), max(timeout, 0.0))
+        except BaseException:
+            self._abandon(waiter)
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.set_running_or_notify_cancel():
+                    waiter.set_result(None)
+                    return
+            self._free += 1
+
+
+class _TokenBucket:
+    """Token bucket с резервированием: reserve() списывает сразу и говорит, сколько ждать."""
+
+    def __init__(self, rate_per_s: float, capacity: float) -> None:
+        self.rate = rate_per_s
+        self.capacity = capacity
+        self._level = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._level = min(self.capacity, self._level + (now - self._updated) * self.rate)
+            self._updated = now
+            self._level -= amount
+            return max(0.0, -self._level / self.rate)
+
+    def refund(self, amount: float) -> None:
+        """Вернуть (или при amount < 0 доплатить) токены после уточнения расхода."""
+        with self._lock:
+            self._level = min(self.capacity, self._level + amount)
+
+
+class _CircuitBreaker:
+    def __init__(self, threshold: int, cooldown_s: float) -> None:
+        self.threshold = threshold
+        self.cooldown_s = cooldown_s
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_at: Optional[float] = None   # когда пропущен пробный вызов полуоткрытого состояния
+        self._lock = threading.Lock()
+
+    def check(self) -> None:
+        """Пропускает вызов или бросает LLMUnavailableError, пока предохранитель открыт."""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            now = time.monotonic()
+            remaining = self._opened_at + self.cooldown_s - now
+            # Полуоткрыт: пропускаем один пробный вызов (ещё один — если тот пропал без результата)
+            if remaining <= 0 and (self._trial_at is None or now - self._trial_at > self.cooldown_s):
+                self._trial_at = now
+                return
+        LLM_REJECTED.labels("circuit_open").inc()
+        raise LLMUnavailableError("LLM circuit breaker is open", retry_after=max(remaining, 1.0))
+
+    def success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_at = None
+
+    def failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_at is not None or (self.threshold > 0 and self._failures >= self.threshold):
+                self._opened_at = time.monotonic()
+                self._trial_at = None
+
+
+def _retry_reason(exc: BaseException) -> Optional[str]:
+    """Причина для повтора (метка метрики) или None, если ошибку повторять бессмысленно."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        if status == 429:
+            return "429"
+        if status >= 500:
+            return "5xx"
+        return None
+    if isinstance(exc, httpx.TransportError):
+        return "transport"
+    return None
+
+
+def _retry_after(exc: BaseException) -> float:
+    if isinstance(exc, httpx.HTTPStatusError):
+        try:
+            return float(exc.response.headers.get("retry-after", 0))
+        except ValueError:
+            return 0.0
+    return 0.0
+
+
+def _estimate_tokens(messages: List[BaseMessage]) -> int:
+    return sum(len(str(m.content)) // 4 + 1 for m in messages)
+
+
+def _used_tokens(message: Any) -> int:
+    usage = getattr(message, "usage_metadata", None) or {}
+    return int(usage.get("input_tokens", 0) or 0) + int(usage.get("output_tokens", 0) or 0)
+
+
+class LLMGateway(BaseChatModel):
+    llm: BaseChatModel
+    max_concurrency: int = 16
+    requests_per_s: float = 0.0        # 0 — без лимита
+    tokens_per_min: float = 0.0        # 0 — без лимита
+    max_retries: int = 4
+    retry_base_s: float = 0.5
+    retry_max_s: float = 20.0
+    queue_timeout_s: float = 60.0
+    breaker_threshold: int = 5         # 0 — предохранитель выключен
+    breaker_cooldown_s: float = 30.0
+
+    _slots: _Slots = PrivateAttr()
+    _rps: Optional[_TokenBucket] = PrivateAttr(default=None)
+    _tpm: Optional[_TokenBucket] = PrivateAttr(default=None)
+    _breaker: _CircuitBreaker = PrivateAttr()
+
+    def model_post_init(self, __context: Any) -> None:
+        self._slots = _Slots(self.max_concurrency)
+        if self.requests_per_s > 0:
+            self._rps = _TokenBucket(self.requests_per_s, capacity=max(1.0, self.requests_per_s))
+        if self.tokens_per_min > 0:
+            self._tpm = _TokenBucket(self.tokens_per_min / 60, capacity=self.tokens_per_min)
+        self._breaker = _CircuitBreaker(self.breaker_threshold, self.breaker_cooldown_s)
+
+    @property
+    def _llm_type(self) -> str:
+        return f"gateway-{self.llm._llm_type}"
+
+    # --- допуск вызова: лимиты и очередь ---
+
+    def _reserve(self, estimate: int, deadline: float) -> float:
+        """Резервирует запрос и токены в bucket'ах; возвращает, сколько ждать."""
+        wait = 0.0
+        if self._rps is not None:
+            wait = max(wait, self._rps.reserve(1))
+        if self._tpm is not None:
+            wait = max(wait, self._tpm.reserve(estimate))
+        if time.monotonic() + wait > deadline:
+            if self._rps is not None:
+                self._rps.refund(1)
+            if self._tpm is not None:
+                self._tpm.refund(estimate)
+            self._reject_queue_timeout()
+        return wait
+
+    def _reject_queue_timeout(self) -> None:
+        LLM_REJECTED.labels("queue_timeout").inc()
+        raise LLMUnavailableError(
+            f"LLM call did not get through the gateway queue in {self.queue_timeout_s:.0f} s",
+            retry_after=1.0,
+        )
+
+    def _admit(self, estimate: int, deadline: float) -> None:
+        start = time.perf_counter()
+        self._breaker.check()
+        time.sleep(self._reserve(estimate, deadline))
+        try:
+            self._slots.acquire(deadline - time.monotonic())
+        except TimeoutError:
+            self._reject_queue_timeout()
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - start)
+
+    async def _aadmit(self, estimate: int, deadline: float) -> None:
+        start = time.perf_counter()
+        self._breaker.check()
+        await asyncio.sleep(self._reserve(estimate, deadline))
+        try:
+            await self._slots.aacquire(deadline - time.monotonic())
+        except (TimeoutError, asyncio.TimeoutError):
+            self._reject_queue_timeout()
+        LLM_QUEUE_SECONDS.observe(time.perf_counter() - start)
+
+    # --- результат попытки ---
+
+    def _settle(self, estimate: int, message: Any) -> None:
+        self._breaker.success()
+        used = _used_tokens(message)
+        if self._tpm is not None and used:
+            self._tpm.refund(estimate - used)
+
+    def _backoff(self, exc: BaseException, attempt: int, deadline: float) -> float:
+        """Пауза перед повтором; если повторять нельзя — пробрасывает исключение дальше."""
+        reason = _retry_reason(exc)
+        if reason is None:
+            # Ошибка не транзиентная (например, 400): провайдер отвечает, для предохранителя это успех
+            self._breaker.success()
+            raise exc
+        self._breaker.failure()
+        if attempt >= self.max_retries:
+            raise exc
+        delay = random.uniform(0, min(self.retry_max_s, self.retry_base_s * 2 ** attempt))
+        delay = max(delay, _retry_after(exc))
+        if time.monotonic() + delay > deadline:
+            raise exc
+        LLM_RETRIES.labels(reason).inc()
+        return delay
+
+    def _release(self) -> None:
+        LLM_IN_FLIGHT.dec()
+        self._slots.release()
+
+    # --- интерфейс BaseChatModel ---
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        estimate = _estimate_tokens(messages)
+        deadline = time.monotonic() + self.queue_timeout_s
+        attempt = 0
+        while True:
+            self._admit(estimate, deadline)
+            LLM_IN_FLIGHT.inc()
+            try:
+                result = self.llm._generate(messages, stop=stop, **kwargs)
+            except Exception as exc:
+                delay = self._backoff(exc, attempt, deadline)
+            else:
+                self._settle(estimate, result.generations[0].message)
+                return result
+            finally:
+                self._release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        estimate = _estimate_tokens(messages)
+        deadline = time.monotonic() + self.queue_timeout_s
+        attempt = 0
+        while True:
+            await self._aadmit(estimate, deadline)
+            LLM_IN_FLIGHT.inc()
+            try:
+                result = await self.llm._agenerate(messages, stop=stop, **kwargs)
+            except Exception as exc:
+                delay = self._backoff(exc, attempt, deadline)
+            else:
+                self._settle(estimate, result.generations[0].message)
+                return result
+            finally:
+                self._release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _stream(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        estimate = _estimate_tokens(messages)
+        deadline = time.monotonic() + self.queue_timeout_s
+        attempt = 0
+        while True:
+            self._admit(estimate, deadline)
+            LLM_IN_FLIGHT.inc()
+            try:
+                chunks = self.llm._stream(messages, stop=stop, **kwargs)
+                first = next(chunks, None)      # повторяем, только пока ничего не отдали
+                break
+            except Exception as exc:
+                self._release()
+                delay = self._backoff(exc, attempt, deadline)
+            except BaseException:
+                self._release()
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+        last = first
+        try:
+            if first is not None:
+                yield first
+                for last in chunks:
+                    yield last
+        finally:
+            self._release()
+        self._settle(estimate, last.message if last is not None else None)
+
+    async def _astream(
+        self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs: Any
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        estimate = _estimate_tokens(messages)
+        deadline = time.monotonic() + self.queue_timeout_s
+        attempt = 0
+        while True:
+            await self._aadmit(estimate, deadline)
+            LLM_IN_FLIGHT.inc()
+            try:
+                chunks = self.llm._astream(messages, stop=stop, **kwargs)
+                first = await anext(chunks, None)
+                break
+            except Exception as exc:
+                self._release()
+                delay = self._backoff(exc, attempt, deadline)
+            except BaseException:
+                self._release()
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        last = first
+        try:
+            if first is not None:
+                yield first
+                async for last in chunks:
+                    yield last
+        finally:
+            self._release()
+        self._settle(estimate, last.message if last is not None else None)
@@ -0,0 +1,82 @@
+# app/backend/services/onnx_encoder.py
+
+"""
+Энкодер эмбеддингов на onnxruntime без torch.
+
+Модель заранее экспортируется в ONNX (scripts/export_onnx_embeddings.py)
+в локальную директорию EMBEDDING_MODEL_PATH:
+
+    model.onnx            — fp32 (EMBEDDING_BACKEND=onnx);
+    model_quantized.onnx  — динамическое int8-квантование (EMBEDDING_BACKEND=onnx-int8);
+    tokenizer.json        — быстрый токенизатор HuggingFace.
+
+Пулинг — усреднение по attention mask с L2-нормировкой, как у E5
+в sentence-transformers, поэтому векторы совместимы с индексом,
+построенным torch-моделью.
+"""
+
+import os
+from typing import List
+
+import numpy as np
+
+MODEL_FILES = {
+    "onnx": "model.onnx",
+    "onnx-int8": "model_quantized.onnx",
+}
+TOKENIZER_FILE = "tokenizer.json"
+
+
+class OnnxEncoder:
+    def __init__(self, model_dir: str, backend: str = "onnx", max_length: int = 512, num_threads: int = 0) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if backend not in MODEL_FILES:
+            raise ValueError(f"Unknown ONNX backend: {backend!r} (expected {', '.join(MODEL_FILES)})")
+        model_path = os.path.join(model_dir, MODEL_FILES[backend])
+        tokenizer_path = os.path.join(model_dir, TOKENIZER_FILE)
+        for path in (model_path, tokenizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"{path} not found. Export the model first: "
+                    f"python scripts/export_onnx_embeddings.py --out {model_dir}"
+                )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        hidden = self.session.run(None, feeds)[0]                 # (B, T, D)
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(
+        self,
+        texts: List[str],
+        batch_size: int = 32,
+        normalize_embeddings: bool = True,
+        convert_to_numpy: bool = True,
+        show_progress_bar: bool = False,
+    ) -> np.ndarray:
+        """Интерфейс как у SentenceTransformer.encode — embed() не знает, какой бэкенд под ним."""
+        parts = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        vecs = np.concatenate(parts).astype("float32")
+        if normalize_embeddings:
+            vecs /= np.clip(np.linalg.norm(vecs, axis=1, keepdims=True), 1e-12, None)
+        return vecs
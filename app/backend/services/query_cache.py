@@ -0,0 +1,225 @@
+# app/backend/services/query_cache.py
+
+"""
+Кэш эмбеддингов запросов.
+
+Два уровня:
+- в памяти: LRU ограниченного размера с TTL;
+- на диске (опционально): файл записей "вектор + ключ" (читается через numpy memmap),
+  при заполнении старейшие записи вытесняются. Переживает рестарт и общий для всех
+  воркеров uvicorn: запись идёт под fcntl-блокировкой, чтение — без блокировок.
+
+Ключ — sha1 от имени модели и нормализованного текста запроса, поэтому
+"Кто такой Гэндальф?" и "кто такой  гэндальф" попадают в одну запись.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from app.backend.core.metrics import QUERY_CACHE_LOOKUPS
+
+_SPACES_RE = re.compile(r"\s+")
+_KEY_BYTES = 20   # sha1
+
+
+def normalize_query(text: str) -> str:
+    """Приводит запрос к канонической форме: регистр, пробелы, финальная пунктуация."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _SPACES_RE.sub(" ", text).strip()
+    return text.rstrip(" ?!.…")
+
+
+class _DiskTier:
+    """
+    Дисковый уровень: entries.bin — записи фиксированной длины (вектор float32, затем
+    sha1-ключ), строка записи — её номер. Карта "ключ -> строка" и векторы читаются
+    из одного отображённого файла, поэтому после вытеснения чужой вектор не отдаётся:
+    процесс со старой картой читает старый файл, пока не перечитает ключи.
+
+    Когда записей max_rows, старейшая половина вытесняется (как в LRU в памяти,
+    только по порядку вставки): оставшиеся переписываются в новый файл, который
+    атомарно заменяет старый. Другие процессы замечают замену по inode и перечитывают ключи.
+    """
+
+    def __init__(self, directory: str, dim: int, max_rows: int) -> None:
+        os.makedirs(directory, exist_ok=True)
+        dim_path = os.path.join(directory, "dim")
+        if not os.path.exists(dim_path):
+            with open(dim_path, "w") as f:
+                f.write(str(dim))
+        # Файлы прежнего формата (векторы и ключи раздельно) больше не читаются
+        for name in ("vectors.f32", "keys.idx"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(os.path.join(directory, name))
+        self.dim = dim
+        self.max_rows = max_rows
+        self.dtype = np.dtype([("vec", "<f4", (dim,)), ("key", "u1", (_KEY_BYTES,))])
+        self.path = os.path.join(directory, "entries.bin")
+        self.lock_path = os.path.join(directory, ".lock")
+        self.rows: Dict[bytes, int] = {}
+        self._inode: Optional[int] = None
+        self._records: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return 0 if self._records is None else len(self._records)
+
+    def _refresh(self) -> None:
+        """Дочитывает записи, которые дописали другие процессы; после вытеснения — все заново."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            st = os.fstat(f.fileno())   # inode и размер того же файла, что отобразим
+            if st.st_ino != self._inode:
+                self._inode, self._records, self.rows = st.st_ino, None, {}
+            n_rows = st.st_size // self.dtype.itemsize   # недописанную запись оставляем на потом
+            done = len(self)
+            if n_rows <= done:
+                return
+            self._records = np.memmap(f, dtype=self.dtype, mode="r", shape=(n_rows,))
+        for row, key in enumerate(self._records["key"][done:], start=done):
+            self.rows[key.tobytes()] = row
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        digest = bytes.fromhex(key)
+        if digest not in self.rows:
+            self._refresh()
+        row = self.rows.get(digest)
+        return None if row is None else np.array(self._records[row]["vec"])
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        digest = bytes.fromhex(key)
+        if digest in self.rows or self.max_rows <= 0:
+            return
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._refresh()
+                if digest in self.rows:
+                    return
+                if len(self) >= self.max_rows:
+                    self._evict_oldest()
+                record = np.zeros(1, dtype=self.dtype)
+                record["vec"] = np.asarray(vec, dtype="float32")
+                record["key"] = np.frombuffer(digest, dtype=np.uint8)
+                # Одна запись целиком, ключ в её конце: читатель, увидевший ключ, увидит и вектор
+                with open(self.path, "ab") as f:
+                    f.write(record.tobytes())
+                self._refresh()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _evict_oldest(self) -> None:
+        """Оставляет новейшую половину записей; вызывается под блокировкой."""
+        keep = self._records[len(self) - self.max_rows // 2:] if self.max_rows > 1 else self._records[:0]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(keep.tobytes())
+        os.replace(tmp_path, self.path)
+        self._refresh()
+
+
+class QueryEmbeddingCache:
+    """LRU-кэш эмбеддингов запросов с TTL, счётчиками и опциональным дисковым уровнем."""
+
+    def __init__(
+        self,
+        model_name: str,
+        max_size: int = 2048,
+        ttl_seconds: float = 0.0,
+        disk_dir: str = "",
+        disk_max_rows: int = 100_000,
+    ) -> None:
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.disk_max_rows = disk_max_rows
+        # у каждой модели своя поддиректория: размерности и векторы несовместимы
+        self.disk_dir = (
+            os.path.join(disk_dir, hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:12])
+            if disk_dir else ""
+        )
+        self._disk: Optional[_DiskTier] = None
+        self._memory: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def key(self, query: str) -> str:
+        return hashlib.sha1(f"{self.model_name}\0{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """Ищет вектор в памяти, затем на диске. None — промах."""
+        now = time.monotonic()
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None and (not item[0] or item[0] > now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                QUERY_CACHE_LOOKUPS.labels("memory_hit").inc()
+                return item[1]
+            if item is not None:
+                del self._memory[key]   # протух по TTL
+
+            disk = self._disk_tier()
+            vec = disk.get(key) if disk is not None else None
+            if vec is None:
+                self.misses += 1
+                QUERY_CACHE_LOOKUPS.labels("miss").inc()
+                return None
+
+            self.disk_hits += 1
+            QUERY_CACHE_LOOKUPS.labels("disk_hit").inc()
+            self._remember(key, vec, now)
+            return vec
+
+    def put(self, key: str, vec: np.ndarray) -> None:
+        with self._lock:
+            self._remember(key, vec, time.monotonic())
+            disk = self._disk_tier(dim=vec.shape[-1])
+            if disk is not None:
+                disk.put(key, vec)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self._memory),
+        }
+
+    def _remember(self, key: str, vec: np.ndarray, now: float) -> None:
+        if self.max_size <= 0:
+            return
+        expires = now + self.ttl_seconds if self.ttl_seconds > 0 else 0.0
+        self._memory[key] = (expires, vec)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+
+    def _disk_tier(self, dim: Optional[int] = None) -> Optional[_DiskTier]:
+        """
+        Дисковый уровень открывается лениво: размерность берётся из файла dim,
+        записанного ранее (возможно, другим процессом), или из первого вектора.
+        """
+        if self._disk is not None or not self.disk_dir:
+            return self._disk
+        dim_path = os.path.join(self.disk_dir, "dim")
+        if os.path.exists(dim_path):
+            with open(dim_path) as f:
+                dim = int(f.read().strip() or 0) or dim
+        if dim:
+            self._disk = _DiskTier(self.disk_dir, dim, self.disk_max_rows)
+        return self._disk
@@ -0,0 +1,171 @@
+# app/backend/services/quote_index.py
+
+"""
+Индекс точных цитат: хэшированные символьные n-граммы нормализованных текстов чанков.
+
+Строится при индексации рядом с index.faiss и читается через mmap:
+
+    quote.meta.json    — {"ngram": n, "bucket_bits": b};
+    quote.indptr.npy   — int64[2**b + 1], границы списков чанков для каждой корзины (CSR);
+    quote.docs.npy     — int32[nnz], id чанков, отсортированы внутри корзины.
+
+Каждая n-грамма нормализованного текста (регистр, ё -> е, пунктуация -> пробел)
+хэшируется в одну из 2**b корзин. Поиск фразы пересекает списки самых редких
+корзин её n-грамм — кандидатов остаются единицы, и только их тексты проверяются
+подстрокой. Время поиска не зависит от размера корпуса, модель эмбеддингов не нужна.
+
+Фраза ищется внутри чанка: цитата, разрезанная границей чанков и длиннее
+их перекрытия, не находится. Из-за перекрытия одна цитата может найтись
+в двух соседних чанках.
+"""
+
+import json
+import os
+import sys
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.backend.services.lexical_index import normalize_text
+
+META_FILE = "quote.meta.json"
+INDPTR_FILE = "quote.indptr.npy"
+DOCS_FILE = "quote.docs.npy"
+
+NGRAM = 4
+BUCKET_BITS = 20
+_HASH_BASE = np.uint64(1_000_003)
+_MAX_LISTS = 8      # сколько самых редких n-грамм пересекать
+
+
+def ngram_buckets(text: str, n: int = NGRAM, bucket_bits: int = BUCKET_BITS) -> np.ndarray:
+    """Уникальные корзины n-грамм уже нормализованного текста (полиномиальный хэш по кодам символов)."""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    if len(codes) < n:
+        return np.empty(0, dtype=np.uint32)
+    count = len(codes) - n + 1
+    h = np.zeros(count, dtype=np.uint64)
+    for j in range(n):
+        h = h * _HASH_BASE + codes[j:j + count]      # переполнение uint64 — часть хэша
+    h ^= h >> np.uint64(29)
+    return np.unique((h & np.uint64((1 << bucket_bits) - 1)).astype(np.uint32))
+
+
+class QuoteIndexWriter:
+    def __init__(self, n: int = NGRAM, bucket_bits: int = BUCKET_BITS) -> None:
+        self.n = n
+        self.bucket_bits = bucket_bits
+        self._buckets: List[np.ndarray] = []
+        self._sizes: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._sizes)
+
+    def add(self, text: str) -> int:
+        doc_id = len(self._sizes)
+        buckets = ngram_buckets(normalize_text(text), self.n, self.bucket_bits)
+        self._buckets.append(buckets)
+        self._sizes.append(len(buckets))
+        return doc_id
+
+    def close(self, index_dir: str) -> None:
+        buckets = np.concatenate(self._buckets) if self._buckets else np.empty(0, dtype=np.uint32)
+        docs = np.repeat(np.arange(len(self._sizes), dtype=np.int32), self._sizes)
+        # stable: внутри корзины id чанков остаются отсортированными
+        order = np.argsort(buckets, kind="stable")
+        indptr = np.zeros((1 << self.bucket_bits) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(buckets, minlength=1 << self.bucket_bits), out=indptr[1:])
+
+        np.save(os.path.join(index_dir, INDPTR_FILE), indptr)
+        np.save(os.path.join(index_dir, DOCS_FILE), docs[order])
+        with open(os.path.join(index_dir, META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"ngram": self.n, "bucket_bits": self.bucket_bits}, f)
+
+
+class QuoteIndex:
+    def __init__(self, index_dir: str) -> None:
+        with open(os.path.join(index_dir, META_FILE), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.n: int = meta["ngram"]
+        self.bucket_bits: int = meta["bucket_bits"]
+        self.indptr = np.load(os.path.join(index_dir, INDPTR_FILE), mmap_mode="r")
+        self.docs = np.load(os.path.join(index_dir, DOCS_FILE), mmap_mode="r")
+
+    def candidates(self, needle: str, ranges: Optional[Sequence[Tuple[int, int]]] = None) -> np.ndarray:
+        """id чанков, в которых есть все n-граммы нормализованной фразы (возможны ложные совпадения)."""
+        buckets = ngram_buckets(needle, self.n, self.bucket_bits)
+        if not len(buckets):
+            return np.empty(0, dtype=np.int32)
+        starts = np.asarray(self.indptr[buckets])
+        sizes = np.asarray(self.indptr[buckets + 1]) - starts
+        if not sizes.min():
+            return np.empty(0, dtype=np.int32)
+
+        rarest = np.argsort(sizes)[:_MAX_LISTS]
+        found = None
+        for i in rarest:
+            docs = np.asarray(self.docs[starts[i]:starts[i] + sizes[i]])
+            found = docs if found is None else np.intersect1d(found, docs, assume_unique=True)
+            if not len(found):
+                break
+
+        if ranges is not None:
+            allowed = np.zeros(len(found), dtype=bool)
+            for start, end in ranges:
+                allowed |= (found >= start) & (found < end)
+            found = found[allowed]
+        return found
+
+    def find(
+        self,
+        phrase: str,
+        text: Callable[[int], str],
+        limit: int = 20,
+        ranges: Optional[Sequence[Tuple[int, int]]] = None,
+    ) -> List[Tuple[int, int]]:
+        """
+        Вхождения фразы: [(id чанка, число вхождений)] по возрастанию id, не больше limit.
+        text(i) — текст чанка i; проверяются только кандидаты из n-граммного индекса.
+        Фраза короче n символов после нормализации не ищется.
+        """
+        needle = normalize_text(phrase)
+        if len(needle) < self.n:
+            return []
+        matches = []
+        for doc_id in self.candidates(needle, ranges):
+            occurrences = normalize_text(text(int(doc_id))).count(needle)
+            if occurrences:
+                matches.append((int(doc_id), occurrences))
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+def has_quote_index(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, META_FILE))
+
+
+def open_quote_index(index_dir: str) -> Optional[QuoteIndex]:
+    """Индекс цитат директории или None, если он не построен."""
+    return QuoteIndex(index_dir) if has_quote_index(index_dir) else None
+
+
+def build_quote_index(index_dir: str, texts: Iterable[str]) -> int:
+    writer = QuoteIndexWriter()
+    for text in texts:
+        writer.add(text)
+    writer.close(index_dir)
+    return len(writer)
+
+
+if __name__ == "__main__":
+    # python -m app.backend.services.quote_index [INDEX_DIR] — построить индекс цитат для готового индекса
+    from app.backend.core.config import get_settings
+    from app.backend.services.chunk_store import open_chunk_store
+
+    from app.backend.services.index_layout import resolve_index_dir
+
+    target_dir = resolve_index_dir(sys.argv[1] if len(sys.argv) > 1 else get_settings().INDEX_DIR)
+    chunk_store = open_chunk_store(target_dir)
+    count = build_quote_index(target_dir, (chunk_store.text(i) for i in range(len(chunk_store))))
+    print(f"Built quote index for {count} chunks in {target_dir}")
@@ -1,69 +1,229 @@
 import os                                 # работа с путями
-import pickle                             # сохранение метаданных
 import faiss                              # FAISS индекс
 import numpy as np                        # массивы
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Optional
 from app.backend.core.config import get_settings  # настройки
+from app.backend.services.chunk_store import open_chunk_store  # тексты и метаданные чанков
+from app.backend.services.index_layout import resolve_index_dir  # действующая версия индекса
+from app.backend.services.lexical_index import open_lexical_index  # BM25 по тем же чанкам
+from app.backend.services.quote_index import open_quote_index      # точные цитаты по n-граммам
 
 _settings = get_settings()                # грузим настройки
 
+# IO_FLAG_MMAP_IFC (faiss >= 1.8) отображает в память векторы IndexFlat / HNSW / IVF;
+# старый IO_FLAG_MMAP — только списки IVF, а векторы IndexFlat и HNSW копирует в кучу
+_MMAP_FLAG = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+
 
 class FaissStore:                         # класс-обёртка над FAISS
     def __init__(self, index_path: str, meta_path: str):  # конструктор принимает пути
         self.index_path = index_path                      # путь к index.faiss
-        self.meta_path = meta_path                        # путь к store.pkl
+        self.meta_path = meta_path                        # путь к store.pkl (старый формат)
         self.index = None                                 # тут будет индекс
-        self.chunks: list[str] = []                       # тут будут тексты чанков
-        self.metadata: List[Dict[str, Any]] = []          # метаданные для каждого чанка
+        self.chunk_store = None                           # тексты и метаданные чанков (mmap)
+        self.lexical = None                               # BM25-индекс (None — не построен)
+        self.quotes = None                                # индекс цитат (None — не построен)
+        self._version = ""                                # метка сборки индекса
 
     def load(self) -> None:                               # метод загрузки индекса
+        # Все файлы берём из одной версии: CURRENT читается один раз
+        index_dir = resolve_index_dir(os.path.dirname(self.index_path))
+        index_path = os.path.join(index_dir, os.path.basename(self.index_path))
         # Явно проверяем, что файлы индекса существуют — иначе будет понятная ошибка
-        if not os.path.exists(self.index_path):
-            raise FileNotFoundError(
-                f"FAISS index file not found: {self.index_path}. "
-                f"You need to build the index first or set INDEX_DIR correctly."
-            )
-        if not os.path.exists(self.meta_path):
+        if not os.path.exists(index_path):
             raise FileNotFoundError(
-                f"FAISS metadata file not found: {self.meta_path}. "
+                f"FAISS index file not found: {index_path}. "
                 f"You need to build the index first or set INDEX_DIR correctly."
             )
+        # Хранилище чанков: бинарный формат через mmap, если его нет — старый store.pkl
+        self.chunk_store = open_chunk_store(index_dir, legacy_path=self.meta_path)
+        self.lexical = open_lexical_index(index_dir)
+        self.quotes = open_quote_index(index_dir)
 
-        self.index = faiss.read_index(self.index_path)    # читаем FAISS с диска
-        with open(self.meta_path, "rb") as f:             # открываем метаданные
-            meta = pickle.load(f)                         # читаем словарь
-            self.chunks = meta["chunks"]                  # берём список чанков
-            # Загружаем метаданные если они есть
-            self.metadata = meta.get("metadata", [])
+        # С IO_FLAG_MMAP_IFC векторы не копируются в память процесса, воркеры делят страницы
+        # через кэш ОС; на старых faiss с IO_FLAG_MMAP плоский и HNSW-индексы читаются в кучу
+        self.index = faiss.read_index(index_path, _MMAP_FLAG)
+        self._version = self._read_version(index_path)
+
+    def _read_version(self, index_path: str) -> str:
+        """Метка сборки из index_version; для старых индексов — по времени изменения файла."""
+        version_path = os.path.join(os.path.dirname(index_path), "index_version")
+        if os.path.exists(version_path):
+            with open(version_path) as f:
+                return f.read().strip()
+        return f"mtime-{os.stat(index_path).st_mtime_ns}"
+
+    @property
+    def version(self) -> str:
+        """Метка сборки загруженного индекса (меняется при каждой переиндексации)."""
+        self._ensure_loaded()
+        return self._version
 
     def _ensure_loaded(self) -> None:
         """Ленивая загрузка индекса перед поиском."""
         if self.index is None:
             self.load()
 
-    def search(self, q_vec: np.ndarray, k: int = 4) -> List[Tuple[str, float, Dict[str, Any]]]:
+    def book_selector(self, books: Optional[List[str]]) -> Tuple[Optional[faiss.IDSelector], list]:
+        """
+        IDSelector по файлам книг: диапазоны id из хранилища чанков -> IDSelectorRange,
+        несколько диапазонов объединяются через IDSelectorOr.
+
+        Сокращает перебор только один IDSelectorRange на flat-индексе: считается
+        лишь отрезок id. С IDSelectorOr flat перебирает все векторы и проверяет
+        принадлежность; IVF фильтрует векторы в просмотренных nprobe кластерах;
+        HNSW фильтрует кандидатов при обходе графа, но обходит граф целиком, так что
+        при маленькой доле выбранных книг recall падает (лечится efSearch).
+        Возвращает (селектор, список всех созданных селекторов) — второй нужно держать
+        живым на время поиска: SWIG не хранит ссылки на вложенные селекторы.
+        """
+        self._ensure_loaded()
+        # Соседние диапазоны склеиваем: две книги подряд — один IDSelectorRange
+        ranges: List[Tuple[int, int]] = []
+        for start, end in self.chunk_store.id_ranges(books or []):
+            if ranges and start <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(end, ranges[-1][1]))
+            else:
+                ranges.append((start, end))
+
+        keep: list = []
+        selector = None
+        for start, end in ranges:
+            # assume_sorted: id внутри диапазона идут подряд — flat-поиск с одним диапазоном считает только его
+            part = faiss.IDSelectorRange(start, end, True)
+            keep.append(part)
+            if selector is not None:
+                selector = faiss.IDSelectorOr(selector, part)
+                keep.append(selector)
+            else:
+                selector = part
+        return selector, keep
+
+    def search_params(
+        self,
+        k: int,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        sel: Optional[faiss.IDSelector] = None,
+    ) -> Optional[faiss.SearchParameters]:
+        """
+        Параметры поиска для приближённых индексов: efSearch для HNSW,
+        nprobe для IVF (по умолчанию — из Settings). Для flat — None.
+        sel — фильтр по id (например, по книгам), применяется внутри FAISS.
+        """
+        self._ensure_loaded()
+        if isinstance(self.index, faiss.IndexHNSW):
+            ef = ef_search or _settings.HNSW_EF_SEARCH
+            return faiss.SearchParametersHNSW(efSearch=max(ef, k), sel=sel)   # efSearch < k режет выдачу
+        if faiss.try_extract_index_ivf(self.index) is not None:
+            return faiss.SearchParametersIVF(nprobe=nprobe or _settings.IVF_NPROBE, sel=sel)
+        if sel is not None:
+            return faiss.SearchParameters(sel=sel)
+        return None
+
+    def search(
+        self,
+        q_vec: np.ndarray,
+        k: int = 4,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        books: Optional[List[str]] = None,
+    ) -> List[Tuple[str, float, Dict[str, Any]]]:
         """
         Поиск по эмбеддингу запроса
         Возвращает список кортежей (текст, скор, метаданные)
+        ef_search / nprobe — ручки точности для HNSW / IVF индексов.
+        books — имена файлов книг: результаты только из их фрагментов (у flat и IVF — полный
+        top-k внутри них, у HNSW — приближённый, см. book_selector).
+        """
+        ids, scores = self.search_ids(q_vec, k, ef_search=ef_search, nprobe=nprobe, books=books)
+        return self.hits(ids, scores)
+
+    def search_ids(
+        self,
+        q_vec: np.ndarray,
+        k: int = 4,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        books: Optional[List[str]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """То же, что search, но возвращает (ids, scores) без текстов — для слияния с BM25."""
+        idx, scores = self.search_batch_ids(q_vec, k, ef_search=ef_search, nprobe=nprobe, books=books)
+        found = idx[0] != -1
+        return idx[0][found], scores[0][found]
+
+    def search_batch_ids(
+        self,
+        q_vecs: np.ndarray,
+        k: int = 4,
+        ef_search: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        books: Optional[List[str]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Один многострочный поиск FAISS для матрицы запросов (N, D):
+        (ids, scores) формы (N, k), пустые позиции — id -1.
         """
         self._ensure_loaded()
-        scores, idx = self.index.search(q_vec, k)         # обращаемся к FAISS
-        hits = []                                         # сюда сложим результаты
-        for j, i in enumerate(idx[0]):
-            if i == -1:
-                continue
+        sel, _keep = self.book_selector(books) if books else (None, [])
+        if books and sel is None:
+            # ни одной из выбранных книг нет в индексе
+            return np.full((len(q_vecs), k), -1, dtype=np.int64), np.zeros((len(q_vecs), k), dtype=np.float32)
+        params = self.search_params(k, ef_search=ef_search, nprobe=nprobe, sel=sel)
+        scores, idx = self.index.search(q_vecs, k, params=params)  # обращаемся к FAISS
+        return idx, scores
 
-            # Получаем метаданные если они есть
-            chunk_metadata = {}
-            if self.metadata and i < len(self.metadata):
-                chunk_metadata = self.metadata[i]
+    def search_batch(
+        self,
+        q_vecs: np.ndarray,
+        k: int = 4,
+        books: Optional[List[str]] = None,
+    ) -> List[List[Tuple[str, float, Dict[str, Any]]]]:
+        """search для матрицы запросов: список результатов в порядке строк q_vecs."""
+        idx, scores = self.search_batch_ids(q_vecs, k, books=books)
+        found = idx != -1
+        return [self.hits(idx[i][found[i]], scores[i][found[i]]) for i in range(len(idx))]
 
-            hits.append((
-                self.chunks[i],
-                float(scores[0][j]),
-                chunk_metadata
-            ))
-        return hits
+    def hits(self, ids, scores) -> List[Tuple[str, float, Dict[str, Any]]]:
+        """Кортежи (текст, скор, метаданные) для найденных id."""
+        self._ensure_loaded()
+        return [
+            (self.chunk_store.text(int(i)), float(score), self.chunk_store.metadata(int(i)))
+            for i, score in zip(ids, scores)
+        ]
+
+    def lexical_search(
+        self,
+        query: str,
+        k: int = 4,
+        books: Optional[List[str]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """BM25-поиск (ids, scores); пустой результат, если лексический индекс не построен."""
+        self._ensure_loaded()
+        if self.lexical is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ranges = self.chunk_store.id_ranges(books) if books else None
+        return self.lexical.search(query, k, ranges=ranges)
+
+    def find_quote(
+        self,
+        phrase: str,
+        limit: int = 20,
+        books: Optional[List[str]] = None,
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Все чанки, где фраза встречается дословно (после нормализации), по порядку в книгах:
+        [{"chunk_id", "text", "occurrences", "metadata"}].
+        None — индекс цитат не построен.
+        """
+        self._ensure_loaded()
+        if self.quotes is None:
+            return None
+        ranges = self.chunk_store.id_ranges(books) if books else None
+        return [
+            {"chunk_id": i, "text": self.chunk_store.text(i), "occurrences": n, "metadata": self.chunk_store.metadata(i)}
+            for i, n in self.quotes.find(phrase, self.chunk_store.text, limit=limit, ranges=ranges)
+        ]
 
     def search_legacy(self, q_vec: np.ndarray, k: int = 4):
         """Старый метод для обратной совместимости, возвращает только (текст, скор)"""
@@ -73,7 +233,7 @@ class FaissStore:                         # класс-обёртка над FAI
         for j, i in enumerate(idx[0]):
             if i == -1:
                 continue
-            hits.append((self.chunks[i], float(scores[0][j])))
+            hits.append((self.chunk_store.text(i), float(scores[0][j])))
         return hits
 
 
@@ -0,0 +1,201 @@
+# app/data_processing/indexing/embedding_cache.py
+
+"""
+Контентно-адресуемый кэш эмбеддингов фрагментов для индексации.
+
+Ключ — sha256 от имени модели и ровно того текста, который уходит в модель
+("passage: " + текст чанка). Поэтому при повторной индексации (добавили одну
+книгу, поменяли chunk_size/chunk_overlap) модель считает только новые тексты,
+а векторы неизменившихся фрагментов берутся из SQLite.
+
+Каждая сборка индекса пишет рядом с index.faiss файл chunk_keys.npy —
+ключи своих фрагментов по порядку. По этим файлам сборщик мусора
+(scripts/gc_embedding_cache.py) понимает, какие векторы ещё нужны.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+
+from app.backend.core.config import get_settings
+from app.backend.services.embeddings import embedding_model_id
+
+KEYS_FILE = "chunk_keys.npy"
+_LOOKUP_BATCH = 500   # ограничение SQLite на число параметров в одном запросе
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    key BLOB PRIMARY KEY,
+    embedding BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+
+@dataclass
+class EmbedStats:
+    """Итог одного прохода: сколько векторов нашлось в кэше и сколько времени это сэкономило."""
+
+    total: int = 0
+    hits: int = 0
+    embed_seconds: float = 0.0
+    saved_seconds: float = 0.0
+
+    @property
+    def misses(self) -> int:
+        return self.total - self.hits
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.hits / self.total if self.total else 0.0
+
+    def add(self, other: "EmbedStats") -> None:
+        self.total += other.total
+        self.hits += other.hits
+        self.embed_seconds += other.embed_seconds
+        self.saved_seconds += other.saved_seconds
+
+    def summary(self) -> str:
+        return (
+            f"[EmbedCache] {self.hits}/{self.total} из кэша ({self.hit_ratio:.1%}), "
+            f"посчитано {self.misses} за {self.embed_seconds:.1f} с, "
+            f"сэкономлено ~{self.saved_seconds:.1f} с"
+        )
+
+
+def content_key(model_name: str, text: str) -> bytes:
+    """sha256(модель + текст для модели) — 32 байта."""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str, model_name: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.model_name = model_name
+        self._conn = sqlite3.connect(path, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+
+    def keys(self, texts: Sequence[str]) -> List[bytes]:
+        return [content_key(self.model_name, t) for t in texts]
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        """Пакетный поиск: {ключ: вектор} для найденных ключей."""
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), _LOOKUP_BATCH):
+            batch = unique[start:start + _LOOKUP_BATCH]
+            rows = self._conn.execute(
+                f"SELECT key, embedding FROM vectors WHERE key IN ({','.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+            for key, blob in rows:
+                found[bytes(key)] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def put_many(self, keys: Sequence[bytes], vecs: np.ndarray) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO vectors (key, embedding, created_at) VALUES (?, ?, ?)",
+            [(k, np.asarray(v, dtype="float32").tobytes(), now) for k, v in zip(keys, vecs)],
+        )
+        self._conn.commit()
+
+    def _seconds_per_vector(self) -> float:
+        row = self._conn.execute("SELECT value FROM meta WHERE name = 'seconds_per_vector'").fetchone()
+        return row[0] if row else 0.0
+
+    def _remember_speed(self, seconds_per_vector: float) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (name, value) VALUES ('seconds_per_vector', ?)",
+            (seconds_per_vector,),
+        )
+        self._conn.commit()
+
+    def embed(
+        self,
+        texts: Sequence[str],
+        embed_fn: Callable[[List[str]], np.ndarray],
+        keys: Optional[Sequence[bytes]] = None,
+    ) -> "tuple[np.ndarray, EmbedStats]":
+        """
+        Эмбеддинги для texts (в том же порядке): найденные берутся из кэша,
+        модель (embed_fn) считает только промахи, и они сразу сохраняются.
+        Экономия оценивается по скорости модели на промахах этого же вызова
+        (или по сохранённой скорости прошлых прогонов, если промахов нет).
+        """
+        keys = list(keys) if keys is not None else self.keys(texts)
+        found = self.get_many(keys)
+        stats = EmbedStats(total=len(texts), hits=sum(1 for k in keys if k in found))
+
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+
+        if missing:
+            start = time.perf_counter()
+            new_vecs = embed_fn(list(missing.values())).astype("float32")
+            stats.embed_seconds = time.perf_counter() - start
+            self.put_many(list(missing), new_vecs)
+            found.update(zip(missing, new_vecs))
+            self._remember_speed(stats.embed_seconds / len(missing))
+
+        stats.saved_seconds = stats.hits * self._seconds_per_vector()
+        if not keys:
+            return np.zeros((0, 0), dtype="float32"), stats
+        return np.stack([found[k] for k in keys]).astype("float32"), stats
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def gc(self, live_keys: Set[bytes], dry_run: bool = False) -> int:
+        """Удаляет векторы, на которые не ссылается ни один индекс. Возвращает число удалённых."""
+        dead = [
+            (bytes(key),) for (key,) in self._conn.execute("SELECT key FROM vectors")
+            if bytes(key) not in live_keys
+        ]
+        if not dry_run and dead:
+            self._conn.executemany("DELETE FROM vectors WHERE key = ?", dead)
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+        return len(dead)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_embedding_cache() -> Optional[EmbeddingCache]:
+    """Кэш по настройкам или None, если он выключен."""
+    settings = get_settings()
+    if not settings.EMBED_CACHE_ENABLED:
+        return None
+    return EmbeddingCache(settings.EMBED_CACHE_PATH, embedding_model_id())
+
+
+def write_chunk_keys(index_dir: str, keys: Sequence[bytes]) -> None:
+    # uint8[N, 32], а не dtype "S32": numpy отрезает у bytes-строк завершающие нули
+    data = np.frombuffer(b"".join(keys), dtype=np.uint8).reshape(-1, 32)
+    path = os.path.join(index_dir, KEYS_FILE)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, data)
+    os.replace(path + ".tmp", path)
+
+
+def read_chunk_keys(index_dirs: Iterable[str]) -> Set[bytes]:
+    """Все ключи, на которые ссылаются индексы в перечисленных директориях."""
+    live: Set[bytes] = set()
+    for index_dir in index_dirs:
+        path = os.path.join(index_dir, KEYS_FILE)
+        if os.path.exists(path):
+            live.update(row.tobytes() for row in np.load(path))
+    return live
@@ -1,9 +1,13 @@
 import os
-import pickle
+import math
+import uuid
 import numpy as np
 import faiss
-from typing import List, Dict, Any
-from app.backend.services.embeddings import embed
+from typing import Optional
+from app.backend.core.config import get_settings
+from app.backend.services.chunk_store import open_chunk_store
+from app.backend.services.lexical_index import build_lexical_index
+from app.backend.services.quote_index import build_quote_index
 
 
 def _normalize_inplace(x: np.ndarray) -> np.ndarray:
@@ -15,70 +19,62 @@ def _normalize_inplace(x: np.ndarray) -> np.ndarray:
     return x
 
 
-def build_faiss(chunks: list[str], index_dir: str) -> None:
-    """Старая функция для обратной совместимости"""
-    os.makedirs(index_dir, exist_ok=True)
-    vecs = embed(chunks).astype("float32")
-    if len(chunks) == 0:
-        raise ValueError("No chunks provided to build_faiss")
-    if vecs.size == 0:
-        raise ValueError("Embedding model returned empty vectors")
-    vecs = _normalize_inplace(vecs)
+def default_nlist(n_vectors: int) -> int:
+    """~4*sqrt(N) кластеров, но так, чтобы на каждый приходилось >= 39 точек обучения."""
+    return max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // 39))
 
-    dim = vecs.shape[1]
-    index = faiss.IndexFlatIP(dim)  # cosine via normalized inner product
-    index.add(vecs)
-
-    print(f"[FAISS] Built index: {index.ntotal} vectors, dim={dim}")
-
-    faiss.write_index(index, os.path.join(index_dir, "index.faiss"))
-    with open(os.path.join(index_dir, "store.pkl"), "wb") as f:
-        pickle.dump({"chunks": chunks}, f)
 
-
-def build_faiss_with_metadata(chunks_data: List[Dict[str, Any]], index_dir: str) -> None:
+def create_index(
+    vecs: np.ndarray,
+    index_type: Optional[str] = None,
+    hnsw_m: Optional[int] = None,
+    ef_construction: Optional[int] = None,
+    nlist: Optional[int] = None,
+) -> faiss.Index:
     """
-    Строит FAISS индекс с метаданными для каждого чанка
-    chunks_data: список словарей с полями text, page_number, book_name, filename
+    Создаёт и заполняет FAISS-индекс выбранного типа (cosine через inner product):
+      - flat — точный перебор IndexFlatIP;
+      - hnsw — граф IndexHNSWFlat, без обучения;
+      - ivf  — IndexIVFFlat, кластеры обучаются k-means на самих векторах.
+    Параметры по умолчанию берутся из Settings.
     """
-    os.makedirs(index_dir, exist_ok=True)
-
-    # Для E5 важно: документы эмбеддим с префиксом `passage:`,
-    # но в store.pkl сохраняем "чистый" текст без префикса.
-    texts_for_embed = [f"passage: {chunk['text']}" for chunk in chunks_data]
-    texts_raw = [chunk["text"] for chunk in chunks_data]
-
-    if len(chunks_data) == 0:
-        raise ValueError("chunks_data is empty — nothing to index")
-
-    vecs = embed(texts_for_embed).astype("float32")
-    if vecs.size == 0:
-        raise ValueError("Embedding model returned empty vectors")
-    vecs = _normalize_inplace(vecs)
-
+    settings = get_settings()
+    index_type = (index_type or settings.FAISS_INDEX_TYPE).lower()
     dim = vecs.shape[1]
 
-    # Создаем и заполняем индекс
-    index = faiss.IndexFlatIP(dim)  # cosine via normalized inner product
+    if index_type == "flat":
+        index = faiss.IndexFlatIP(dim)
+    elif index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m or settings.HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction or settings.HNSW_EF_CONSTRUCTION
+    elif index_type == "ivf":
+        nlist = nlist or settings.IVF_NLIST or default_nlist(len(vecs))
+        quantizer = faiss.IndexFlatIP(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vecs)
+    else:
+        raise ValueError(f"Unknown FAISS index type: {index_type!r} (expected flat, hnsw or ivf)")
+
     index.add(vecs)
+    return index
 
-    print(f"[FAISS] Built index with metadata: {index.ntotal} vectors, dim={dim}")
 
-    # Сохраняем индекс
-    faiss.write_index(index, os.path.join(index_dir, "index.faiss"))
+def _write_index_version(index_dir: str) -> str:
+    """
+    Уникальная метка сборки индекса. По ней кэши (например, кэш ответов)
+    понимают, что индекс пересобран и старые записи больше не валидны.
+    """
+    version = uuid.uuid4().hex
+    with open(os.path.join(index_dir, "index_version"), "w") as f:
+        f.write(version)
+    return version
 
-    # Сохраняем метаданные
-    metadata = {
-        "chunks": texts_raw,
-        "metadata": [
-            {
-                "page_number": chunk["page_number"],
-                "book_name": chunk["book_name"],
-                "filename": chunk["filename"]
-            }
-            for chunk in chunks_data
-        ]
-    }
 
-    with open(os.path.join(index_dir, "store.pkl"), "wb") as f:
-        pickle.dump(metadata, f)
\ No newline at end of file
+def build_text_indexes(index_dir: str) -> None:
+    """
+    BM25 и индекс цитат по готовому хранилищу чанков директории:
+    id в них совпадают с id векторов FAISS.
+    """
+    chunk_store = open_chunk_store(index_dir)
+    build_lexical_index(index_dir, (chunk_store.text(i) for i in range(len(chunk_store))))
+    build_quote_index(index_dir, (chunk_store.text(i) for i in range(len(chunk_store))))
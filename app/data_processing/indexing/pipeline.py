@@ -0,0 +1,338 @@
+# app/data_processing/indexing/pipeline.py
+
+"""
+Потоковая индексация с ограниченной памятью и контрольными точками.
+
+Страницы идут генератором (парсинг в пуле процессов), режутся на чанки и
+копятся в батч фиксированного размера. Каждый батч эмбеддится (через кэш
+эмбеддингов), добавляется в FAISS и дописывается в хранилище чанков. В памяти
+одновременно живёт только один батч, поэтому пик RSS не зависит от размера
+библиотеки.
+
+Сборка идёт во временной директории INDEX_DIR/_building. Каждые K батчей
+туда пишется контрольная точка: index.faiss, хранилище чанков, chunk_keys.npy
+и ingest_state.json со счётчиками. Каждый файл заменяется атомарно, состояние
+пишется последним; если процесс упал между ними, индекс, хранилище и ключи
+уже содержат чанки после chunks_done — при продолжении они обрезаются до
+chunks_done, чтобы id векторов и чанков совпадали. После падения запуск с
+resume=True продолжает с последней точки: уже проиндексированные чанки
+пропускаются без эмбеддинга. Готовая сборка публикуется только в конце — целиком, как новая
+версия INDEX_DIR/versions/<метка> с атомарным переключением INDEX_DIR/CURRENT
+(см. index_layout), так что backend до этого момента работает со старым индексом.
+
+BM25-индекс (lexical.*) и индекс цитат (quote.*) строятся один раз в finish()
+по готовому хранилищу чанков, поэтому контрольные точки их не касаются.
+"""
+
+import json
+import os
+import shutil
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+import faiss
+import numpy as np
+
+from app.backend.core.config import get_settings
+from app.backend.services.chunk_store import ChunkStoreWriter
+from app.backend.services.embeddings import embed, embedding_model_id
+from app.backend.services.index_layout import publish_index
+from app.data_processing.indexing.embedding_cache import (
+    KEYS_FILE,
+    EmbedStats,
+    open_embedding_cache,
+    write_chunk_keys,
+)
+from app.data_processing.indexing.index_builder import (
+    _normalize_inplace,
+    _write_index_version,
+    build_text_indexes,
+    create_index,
+    default_nlist,
+)
+
+STAGING_DIR = "_building"
+STATE_FILE = "ingest_state.json"
+INDEX_FILE = "index.faiss"
+
+
+class _Progress:
+    """Счётчики и скорость: страниц/с и чанков/с с момента запуска."""
+
+    def __init__(self, pages: int = 0, chunks: int = 0) -> None:
+        self.start = time.perf_counter()
+        self.start_pages = pages
+        self.start_chunks = chunks
+        self.pages = pages
+        self.chunks = chunks
+
+    def report(self, prefix: str = "[Ingest]") -> None:
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        print(
+            f"{prefix} страниц: {self.pages}, чанков: {self.chunks} | "
+            f"{(self.pages - self.start_pages) / elapsed:.1f} стр/с, "
+            f"{(self.chunks - self.start_chunks) / elapsed:.1f} чанков/с"
+        )
+
+
+def iter_chunks(
+    pages: Iterable[Dict[str, Any]],
+    split: Callable[[str], List[str]],
+    progress: _Progress,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Чанки страниц с метаданными страницы, по одной странице за раз.
+    char_start — смещение чанка в тексте страницы: по нему сборка контекста
+    склеивает перекрывающиеся соседние чанки. Сплиттер может срезать пробелы
+    по краям, поэтому позиция ищется, а не считается; не нашли — -1.
+    """
+    for page in pages:
+        page_text = page["text"]
+        start = -1
+        for chunk_text in split(page_text):
+            found = page_text.find(chunk_text, start + 1)
+            start = found if found >= 0 else page_text.find(chunk_text)
+            yield {
+                "text": chunk_text,
+                "page_number": page["page_number"],
+                "book_name": page["book_name"],
+                "filename": page["filename"],
+                "char_start": start,
+            }
+        progress.pages += 1
+
+
+def _batches(chunks: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _truncate_index(index: faiss.Index, n: int) -> faiss.Index:
+    """
+    Оставляет в индексе первые n векторов. Flat и IVF удаляют хвост через remove_ids;
+    HNSW удалять не умеет — граф пересобирается из его же векторов.
+    """
+    if index.ntotal < n:
+        raise ValueError(f"Checkpoint index has {index.ntotal} vectors, expected {n}. Run without --resume.")
+    if index.ntotal == n:
+        return index
+    if isinstance(index, faiss.IndexHNSW):
+        vecs = index.reconstruct_n(0, n)
+        return create_index(
+            vecs,
+            index_type="hnsw",
+            hnsw_m=index.hnsw.nb_neighbors(1),
+            ef_construction=index.hnsw.efConstruction,
+        )
+    index.remove_ids(faiss.IDSelectorRange(n, index.ntotal))
+    return index
+
+
+class StreamingIndexBuilder:
+    """
+    Инкрементальная сборка индекса: add_batch() для каждого батча чанков,
+    checkpoint() — сохранить прогресс, finish() — опубликовать готовый индекс новой версией.
+    """
+
+    def __init__(self, index_dir: str, fingerprint: Dict[str, Any], resume: bool = False) -> None:
+        self.index_dir = index_dir
+        self.staging_dir = os.path.join(index_dir, STAGING_DIR)
+        self.fingerprint = fingerprint
+        self.settings = get_settings()
+        self.index: Optional[faiss.Index] = None
+        self.keys: List[bytes] = []
+        self.stats = EmbedStats()
+        self.state: Dict[str, Any] = {"chunks_done": 0, "pages_done": 0, "batches_done": 0}
+        # IVF нужно обучить до первого add: копим первые векторы в буфер
+        self._train_buffer: List[np.ndarray] = []
+        self._train_chunks: List[Dict[str, Any]] = []
+
+        if resume and os.path.exists(os.path.join(self.staging_dir, STATE_FILE)):
+            self._load_checkpoint()
+        else:
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            os.makedirs(self.staging_dir)
+            resume = False
+
+        self.writer = ChunkStoreWriter(self.staging_dir, resume=resume, limit=self.state["chunks_done"])
+        self.cache = open_embedding_cache()
+
+    def _load_checkpoint(self) -> None:
+        with open(os.path.join(self.staging_dir, STATE_FILE), encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved["fingerprint"] != self.fingerprint:
+            raise ValueError(
+                f"Checkpoint in {self.staging_dir} was made with different settings: "
+                f"{saved['fingerprint']} != {self.fingerprint}. Run without --resume."
+            )
+        self.state = saved["state"]
+        done = self.state["chunks_done"]
+        index_path = os.path.join(self.staging_dir, INDEX_FILE)
+        if os.path.exists(index_path):
+            self.index = _truncate_index(faiss.read_index(index_path), done)
+        keys_path = os.path.join(self.staging_dir, KEYS_FILE)
+        if os.path.exists(keys_path):
+            self.keys = [row.tobytes() for row in np.load(keys_path)[:done]]
+        print(
+            f"[Ingest] Продолжаю с контрольной точки: {self.state['chunks_done']} чанков, "
+            f"{self.state['batches_done']} батчей"
+        )
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        if self.cache is None:
+            return embed(texts)
+        keys = self.cache.keys(texts)
+        vecs, stats = self.cache.embed(texts, embed, keys=keys)
+        self.keys.extend(keys)
+        self.stats.add(stats)
+        return vecs
+
+    def _add_vectors(self, vecs: np.ndarray, chunks: List[Dict[str, Any]]) -> None:
+        if self.index is None:
+            index_type = self.settings.FAISS_INDEX_TYPE.lower()
+            if index_type == "ivf":
+                self._train_buffer.append(vecs)
+                self._train_chunks.extend(chunks)
+                if sum(len(v) for v in self._train_buffer) < self.fingerprint["ivf_train_size"]:
+                    return
+                vecs = np.concatenate(self._train_buffer)
+                chunks = self._train_chunks
+                self._train_buffer, self._train_chunks = [], []
+                nlist = self.settings.IVF_NLIST or default_nlist(len(vecs))
+                self.index = create_index(vecs, nlist=nlist)
+            else:
+                self.index = create_index(vecs)
+        else:
+            self.index.add(vecs)
+
+        for chunk in chunks:
+            self.writer.append(
+                chunk["text"],
+                page_number=chunk["page_number"],
+                book_name=chunk["book_name"],
+                filename=chunk["filename"],
+                char_start=chunk.get("char_start", -1),
+            )
+
+    def add_batch(self, chunks: List[Dict[str, Any]]) -> None:
+        # Для E5 документы эмбеддим с префиксом `passage:`, а в хранилище кладём чистый текст
+        vecs = self._embed([f"passage: {chunk['text']}" for chunk in chunks]).astype("float32")
+        vecs = _normalize_inplace(vecs)
+        self._add_vectors(vecs, chunks)
+        self.state["batches_done"] += 1
+
+    @property
+    def pending(self) -> int:
+        """Чанки, которые ещё лежат в буфере обучения IVF и не попали в индекс."""
+        return len(self._train_chunks)
+
+    def _write_index(self) -> None:
+        index_path = os.path.join(self.staging_dir, INDEX_FILE)
+        faiss.write_index(self.index, index_path + ".tmp")
+        os.replace(index_path + ".tmp", index_path)
+
+    def checkpoint(self, pages_done: int) -> None:
+        """Сохраняет индекс, хранилище чанков, ключи и счётчики. Состояние пишется последним."""
+        if self.pending:
+            return   # буфер обучения IVF ещё не сброшен в индекс — сохранять нечего
+        if self.index is not None:
+            self._write_index()
+        self.writer.flush()
+        if self.keys:
+            write_chunk_keys(self.staging_dir, self.keys)
+        self.state["chunks_done"] = len(self.writer)
+        self.state["pages_done"] = pages_done
+        tmp_path = os.path.join(self.staging_dir, STATE_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "state": self.state}, f)
+        os.replace(tmp_path, os.path.join(self.staging_dir, STATE_FILE))
+
+    def finish(self) -> int:
+        """Дописывает остаток, публикует сборку новой версией INDEX_DIR и возвращает число векторов."""
+        if self._train_buffer:
+            # Чанков меньше, чем нужно для обучения, — обучаем IVF на том, что есть
+            vecs = np.concatenate(self._train_buffer)
+            chunks, self._train_buffer, self._train_chunks = self._train_chunks, [], []
+            self.index = create_index(vecs, nlist=self.settings.IVF_NLIST or default_nlist(len(vecs)))
+            for chunk in chunks:
+                self.writer.append(
+                    chunk["text"],
+                    page_number=chunk["page_number"],
+                    book_name=chunk["book_name"],
+                    filename=chunk["filename"],
+                    char_start=chunk.get("char_start", -1),
+                )
+        if self.index is None or self.index.ntotal == 0:
+            raise ValueError("No chunks were produced — nothing to index")
+
+        self._write_index()
+        self.writer.close()
+        if self.keys:
+            write_chunk_keys(self.staging_dir, self.keys)
+        if self.cache is not None:
+            self.cache.close()
+        build_text_indexes(self.staging_dir)
+
+        state_path = os.path.join(self.staging_dir, STATE_FILE)
+        if os.path.exists(state_path):      # контрольной точки не было, если батчей меньше checkpoint_every
+            os.remove(state_path)
+        version = _write_index_version(self.staging_dir)
+        publish_index(self.index_dir, self.staging_dir, version)
+        return self.index.ntotal
+
+
+def build_index_streaming(
+    pages: Iterable[Dict[str, Any]],
+    index_dir: str,
+    split: Callable[[str], List[str]],
+    fingerprint: Dict[str, Any],
+    batch_size: int = 256,
+    checkpoint_every: int = 20,
+    resume: bool = False,
+    ivf_train_size: int = 50_000,
+) -> int:
+    """
+    Парсинг -> чанки -> эмбеддинги батчами -> index.add + хранилище чанков.
+    fingerprint — параметры, от которых зависит состав чанков (модель, chunk_size...):
+    продолжить можно только сборку с теми же параметрами.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    settings = get_settings()
+    fingerprint = {
+        **fingerprint,
+        "embedding_model": embedding_model_id(),
+        "index_type": settings.FAISS_INDEX_TYPE.lower(),
+        "ivf_train_size": ivf_train_size,
+    }
+    builder = StreamingIndexBuilder(index_dir, fingerprint, resume=resume)
+    skip = builder.state["chunks_done"]
+    progress = _Progress(pages=0, chunks=skip)
+
+    chunks = iter_chunks(pages, split, progress)
+    if skip:
+        # Уже проиндексированные чанки пропускаем: страницы перечитываются, но не эмбеддятся
+        for _ in range(skip):
+            if next(chunks, None) is None:
+                break
+        progress.start_pages = progress.pages
+        progress.start = time.perf_counter()
+
+    for batch in _batches(chunks, batch_size):
+        builder.add_batch(batch)
+        progress.chunks += len(batch)
+        if builder.state["batches_done"] % checkpoint_every == 0:
+            builder.checkpoint(progress.pages)
+            progress.report()
+
+    total = builder.finish()
+    progress.report("[Ingest] Готово:")
+    if builder.cache is not None:
+        print(builder.stats.summary())
+    print(f"[FAISS] Built {type(builder.index).__name__}: {total} vectors -> {index_dir}")
+    return total
@@ -1,17 +1,91 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pypdf import PdfReader
+from bs4 import BeautifulSoup
+from ebooklib import ITEM_DOCUMENT, epub
 import os
+import signal
+import threading
+from app.backend.core.config import get_settings
 
+# Форматы, которые умеет читать парсер
+SUPPORTED_EXTENSIONS = (".pdf", ".epub")
 
-def read_pdf_with_metadata(path: str, book_name: str) -> List[Dict[str, Any]]:
+# Задача парсинга: (путь, имя файла, название книги, первая страница, последняя страница + 1)
+ParseTask = Tuple[str, str, str, int, int]
+
+
+class _PageTimeout(Exception):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _PageTimeout()
+
+
+def book_title(filename: str) -> str:
+    """Читаемое название книги из имени файла: '1_Хоббит.pdf' -> '1 Хоббит'"""
+    return os.path.splitext(filename)[0].replace('_', ' ')
+
+
+def list_book_files(raw_dir: str) -> List[str]:
+    """Имена файлов книг (PDF и EPUB) в raw_dir в стабильном порядке"""
+    if not os.path.exists(raw_dir):
+        return []
+    return [
+        name for name in sorted(os.listdir(raw_dir))
+        if name.lower().endswith(SUPPORTED_EXTENSIONS)
+    ]
+
+
+def _extract_page_text(page, timeout: float, where: str) -> str:
     """
-    Читает PDF и возвращает список страниц с метаданными
+    Текст одной страницы PDF с ограничением по времени.
+    Патологические страницы (огромные content stream, битые шрифты) не должны
+    вешать воркер: по SIGALRM страница считается пустой. SIGALRM работает только
+    в главном потоке процесса, поэтому iter_pages вне главного потока разбирает
+    книги в пуле процессов; здесь в чужом потоке лимит не ставится.
+    """
+    use_alarm = (
+        timeout > 0
+        and hasattr(signal, "SIGALRM")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if use_alarm:
+        previous = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return page.extract_text() or ""
+    except _PageTimeout:
+        print(f"[Parser] {where}: страница не разобрана за {timeout:g} с, пропускаю")
+        return ""
+    except Exception as e:
+        print(f"[Parser] {where}: ошибка разбора страницы ({e!r}), пропускаю")
+        return ""
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+
+def read_pdf_with_metadata(
+    path: str,
+    book_name: str,
+    start: int = 0,
+    stop: Optional[int] = None,
+    page_timeout: float = 0.0,
+) -> List[Dict[str, Any]]:
+    """
+    Читает PDF (или диапазон страниц [start, stop)) и возвращает список страниц с метаданными
     """
     r = PdfReader(path)
+    stop = len(r.pages) if stop is None else min(stop, len(r.pages))
     pages_data = []
 
-    for page_num, page in enumerate(r.pages, start=1):
-        text = page.extract_text() or ""
+    for page_index in range(start, stop):
+        page_num = page_index + 1
+        text = _extract_page_text(r.pages[page_index], page_timeout, f"{book_name}, стр. {page_num}")
         pages_data.append({
             "text": text,
             "page_number": page_num,
@@ -21,6 +95,33 @@ def read_pdf_with_metadata(path: str, book_name: str) -> List[Dict[str, Any]]:
     return pages_data
 
 
+def read_epub_with_metadata(path: str, book_name: str) -> List[Dict[str, Any]]:
+    """
+    Читает EPUB и возвращает список "страниц" с метаданными.
+    В EPUB нет страниц, поэтому страницей считается документ из spine
+    (обычно глава), номера идут по порядку чтения, пустые документы пропускаются.
+    """
+    book = epub.read_epub(path, options={"ignore_ncx": True})
+    pages_data = []
+
+    for item_id, _ in book.spine:
+        item = book.get_item_with_id(item_id)
+        # Оглавление (nav) тоже документ spine, но текста книги в нём нет
+        if item is None or item.get_type() != ITEM_DOCUMENT or isinstance(item, epub.EpubNav):
+            continue
+        soup = BeautifulSoup(item.get_content(), "html.parser")
+        text = soup.get_text("\n", strip=True)
+        if not text:
+            continue
+        pages_data.append({
+            "text": text,
+            "page_number": len(pages_data) + 1,
+            "book_name": book_name
+        })
+
+    return pages_data
+
+
 def read_pdf(path: str) -> str:
     """Старая функция для обратной совместимости"""
     r = PdfReader(path)
@@ -39,23 +140,88 @@ def load_raw_texts(raw_dir: str) -> List[str]:
     return texts
 
 
-def load_raw_texts_with_metadata(raw_dir: str) -> List[Dict[str, Any]]:
+def _parse_task(task: ParseTask, page_timeout: float) -> List[Dict[str, Any]]:
+    """Выполняется в воркере пула: разбирает диапазон страниц PDF или EPUB целиком"""
+    path, filename, book_name, start, stop = task
+    if filename.lower().endswith(".epub"):
+        pages_data = read_epub_with_metadata(path, book_name)
+    else:
+        pages_data = read_pdf_with_metadata(path, book_name, start, stop, page_timeout)
+
+    for page_data in pages_data:
+        page_data["filename"] = filename
+    return pages_data
+
+
+def plan_parse_tasks(raw_dir: str, pages_per_task: int) -> List[ParseTask]:
     """
-    Загружает все PDF файлы с метаданными
-    Возвращает список словарей с полями: text, page_number, book_name, filename
+    Режет библиотеку на задачи: PDF — на диапазоны по pages_per_task страниц
+    (одна большая книга тоже раскладывается по ядрам), EPUB — целиком.
+    PDF, который не открывается (битый файл, шифрование), пропускается с
+    предупреждением и не останавливает ingest остальных книг.
     """
-    all_pages = []
+    tasks: List[ParseTask] = []
+    for name in list_book_files(raw_dir):
+        path = os.path.join(raw_dir, name)
+        if name.lower().endswith(".epub"):
+            tasks.append((path, name, book_title(name), 0, 0))
+            continue
+        try:
+            n_pages = len(PdfReader(path).pages)
+        except Exception as e:
+            print(f"[Parser] {name}: не удалось открыть PDF ({e!r}), пропускаю")
+            continue
+        for start in range(0, n_pages, max(1, pages_per_task)):
+            tasks.append((path, name, book_title(name), start, min(start + pages_per_task, n_pages)))
+    return tasks
 
-    for name in sorted(os.listdir(raw_dir)):
-        p = os.path.join(raw_dir, name)
-        low = name.lower()
-        if low.endswith(".pdf"):
-            # Извлекаем читаемое имя книги из имени файла
-            book_name = name.replace('.pdf', '').replace('_', ' ')
-            pages_data = read_pdf_with_metadata(p, book_name)
 
-            for page_data in pages_data:
-                page_data["filename"] = name
-                all_pages.append(page_data)
+def iter_pages(
+    raw_dir: str,
+    workers: Optional[int] = None,
+    pages_per_task: Optional[int] = None,
+    page_timeout: Optional[float] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Генератор страниц всех книг из raw_dir в исходном порядке (файл, страница).
+    Разбор идёт в пуле процессов; одновременно в работе не больше 2*workers задач,
+    так что память не растёт с размером библиотеки. workers=1 — без пула, в текущем
+    процессе, но только из главного потока: лимит на страницу держится на SIGALRM,
+    поэтому из другого потока разбор всегда уходит в пул.
+    Параметры по умолчанию берутся из Settings (PARSE_*).
+    """
+    settings = get_settings()
+    workers = workers or settings.PARSE_WORKERS or os.cpu_count() or 1
+    pages_per_task = pages_per_task or settings.PARSE_PAGES_PER_TASK
+    page_timeout = settings.PARSE_PAGE_TIMEOUT if page_timeout is None else page_timeout
+
+    tasks = plan_parse_tasks(raw_dir, pages_per_task)
+
+    in_main_thread = threading.current_thread() is threading.main_thread()
+    if (workers == 1 or len(tasks) <= 1) and (in_main_thread or page_timeout <= 0):
+        for task in tasks:
+            yield from _parse_task(task, page_timeout)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        task_iter = iter(tasks)
+        for task in task_iter:
+            pending.append(pool.submit(_parse_task, task, page_timeout))
+            if len(pending) >= 2 * workers:
+                break
+        while pending:
+            # Ждём самую раннюю задачу — страницы выходят в порядке книг
+            pages_data = pending.popleft().result()
+            next_task = next(task_iter, None)
+            if next_task is not None:
+                pending.append(pool.submit(_parse_task, next_task, page_timeout))
+            yield from pages_data
 
-    return all_pages                       
\ No newline at end of file
+
+def load_raw_texts_with_metadata(raw_dir: str) -> List[Dict[str, Any]]:
+    """
+    Загружает все PDF и EPUB файлы с метаданными
+    Возвращает список словарей с полями: text, page_number, book_name, filename
+    """
+    return list(iter_pages(raw_dir))
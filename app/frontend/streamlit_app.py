@@ -1,4 +1,5 @@
 import os                                      # окружение
+import json                                    # разбор SSE-событий
 import requests                                # HTTP-запросы к бэкенду
 import streamlit as st                         # Streamlit UI
 from datetime import datetime
@@ -67,6 +68,46 @@ if books:
 
     st.markdown("---")
 
+def iter_sse(response):
+    """Разбирает поток Server-Sent Events от /ask/stream в пары (event, data)."""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if line == "":
+            if data_lines:
+                yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+
+
+def render_passages(passages):
+    """Рисует список цитат с метаданными."""
+    for i, passage in enumerate(passages, start=1):
+        # Формируем заголовок цитаты с метаданными
+        metadata = passage.get("metadata", {})
+        book_name = metadata.get("book_name", "")
+        page_number = metadata.get("page_number", 0)
+        score = passage.get("score", 0.0)
+
+        # Создаем информативный заголовок
+        header_parts = [f"[{i}] score={score:.3f}"]
+        if book_name and page_number:
+            header_parts.append(f"— {book_name}, стр. {page_number}")
+        elif book_name:
+            header_parts.append(f"— {book_name}")
+
+        with st.expander(" ".join(header_parts)):
+            st.write(passage.get("text", ""))
+
+            # Опционально: добавим ссылку для открытия PDF (пока заглушка)
+            if page_number and metadata.get("filename"):
+                st.caption(f"📄 Источник: {metadata.get('filename')}, страница {page_number}")
+
+
 # Основной интерфейс поиска
 col1, col2 = st.columns([4, 1])
 with col1:
@@ -81,53 +122,59 @@ if search_triggered:
     if not q.strip():
         st.warning("Введите вопрос")
     else:
-        with st.spinner("Ищу ответ..."):
-            r = requests.post(
-                f"{BACKEND_URL}/ask", json={"question": q, "top_k": top_k}, timeout=60
-            )
-            if r.status_code != 200:
-                st.error(f"Ошибка API: {r.text}")
-            else:
-                data = r.json()
-
-                # Сохраняем результат в историю
-                search_result = {
-                    "question": q,
-                    "answer": data["answer"],
-                    "passages": data["passages"],
-                    "top_k": top_k,
-                    "timestamp": datetime.now()
-                }
-
-                # Добавляем в начало списка и оставляем только последние 10
-                st.session_state.search_history.insert(0, search_result)
-                st.session_state.search_history = st.session_state.search_history[:10]
-
-                # Отображаем результат
-                st.markdown("### Ответ")
-                st.write(data["answer"])
-
-                st.markdown("### Цитаты")
-                for i, passage in enumerate(data["passages"], start=1):
-                    # Формируем заголовок цитаты с метаданными
-                    metadata = passage.get("metadata", {})
-                    book_name = metadata.get("book_name", "")
-                    page_number = metadata.get("page_number", 0)
-                    score = passage.get("score", 0.0)
-
-                    # Создаем информативный заголовок
-                    header_parts = [f"[{i}] score={score:.3f}"]
-                    if book_name and page_number:
-                        header_parts.append(f"— {book_name}, стр. {page_number}")
-                    elif book_name:
-                        header_parts.append(f"— {book_name}")
-
-                    with st.expander(" ".join(header_parts)):
-                        st.write(passage.get("text", ""))
-
-                        # Опционально: добавим ссылку для открытия PDF (пока заглушка)
-                        if page_number and metadata.get("filename"):
-                            st.caption(f"📄 Источник: {metadata.get('filename')}, страница {page_number}")
+        # Ответ рисуем по мере прихода токенов, цитаты — как только их нашёл retrieve
+        st.markdown("### Ответ")
+        answer_placeholder = st.empty()
+        answer_placeholder.caption("Ищу фрагменты...")
+        st.markdown("### Цитаты")
+        passages_placeholder = st.empty()
+
+        answer, passages, error = "", [], None
+        try:
+            with requests.post(
+                f"{BACKEND_URL}/ask/stream",
+                json={"question": q, "top_k": top_k, "books": st.session_state.selected_books or None},
+                stream=True,
+                timeout=(5, 60),  # 60 с — на паузу между событиями, а не на весь ответ
+            ) as r:
+                if r.status_code != 200:
+                    error = r.text
+                else:
+                    for event, data in iter_sse(r):
+                        if event == "passages":
+                            passages = data
+                            with passages_placeholder.container():
+                                render_passages(passages)
+                            if not answer:
+                                answer_placeholder.caption("Генерирую ответ...")
+                        elif event == "token":
+                            answer += data
+                            answer_placeholder.markdown(answer + "▌")
+                        elif event == "done":
+                            answer = data["answer"]
+                        elif event == "error":
+                            error = data.get("detail", "")
+        except requests.RequestException as exc:
+            error = str(exc)
+
+        if error is not None:
+            answer_placeholder.empty()
+            st.error(f"Ошибка API: {error}")
+        else:
+            answer_placeholder.write(answer)
+
+            # Сохраняем результат в историю
+            search_result = {
+                "question": q,
+                "answer": answer,
+                "passages": passages,
+                "top_k": top_k,
+                "timestamp": datetime.now()
+            }
+
+            # Добавляем в начало списка и оставляем только последние 10
+            st.session_state.search_history.insert(0, search_result)
+            st.session_state.search_history = st.session_state.search_history[:10]
 
 # Блок "Последние 10 запросов"
 if st.session_state.search_history:
@@ -1,11 +1,16 @@
-from typing import List
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Lowercase and collapse whitespace, so a quote still matches a chunk with line breaks inside."""
+    return " ".join(text.lower().split())
+
 
 def recall_at_k(contexts: List[str], ground_truth: str) -> float:
-    gt = ground_truth.lower()
-    for ctx in contexts:
-        if gt in ctx.lower():
-            return 1.0
-    return 0.0
+    """Single-sample recall; same matching as hit_matrix."""
+    return float(recall_at_k_batch(hit_matrix([contexts], [ground_truth]), len(contexts))[0])
 
 def answer_relevance(question: str, answer: str) -> float:
     if not answer:
@@ -22,3 +27,80 @@ def faithfulness(answer: str, contexts: List[str]) -> float:
         return 0.0
     supported = sum(1 for t in answer_tokens if t in context_text)
     return supported / len(answer_tokens)
+
+
+# ---- Vectorized metrics: whole dataset at once (numpy string ufuncs) ----
+
+def _normalize(texts: Sequence[str]) -> np.ndarray:
+    """
+    normalize_text over a list. Each distinct text is normalized once:
+    top-k lists of different questions share many chunks.
+    """
+    cache: Dict[str, str] = {}
+    out = []
+    for t in texts:
+        norm = cache.get(t)
+        if norm is None:
+            norm = cache[t] = normalize_text(t)
+        out.append(norm)
+    return np.array(out, dtype=str)
+
+
+def hit_matrix(contexts: Sequence[Sequence[str]], ground_truths: Sequence[str]) -> np.ndarray:
+    """
+    (N, K) bool: ground_truths[i] occurs in contexts[i][j] (ranked retrieval results).
+    Rows shorter than K are padded with misses.
+    """
+    n = len(ground_truths)
+    k = max((len(c) for c in contexts), default=0)
+    if not n or not k:
+        return np.zeros((n, k), dtype=bool)
+    flat = [""] * (n * k)
+    valid = np.zeros((n, k), dtype=bool)
+    for i, row in enumerate(contexts):
+        flat[i * k:i * k + len(row)] = row
+        valid[i, :len(row)] = True
+    found = np.char.find(_normalize(flat).reshape(n, k), _normalize(ground_truths)[:, None]) >= 0
+    return found & valid
+
+
+def recall_at_k_batch(hits: np.ndarray, k: int) -> np.ndarray:
+    """Per-sample 1.0 if any of the top-k results contains the ground truth."""
+    return hits[:, :k].any(axis=1).astype(float)
+
+
+def mrr_batch(hits: np.ndarray, k: int) -> np.ndarray:
+    """Per-sample reciprocal rank of the first relevant result within top-k (0 if none)."""
+    top = hits[:, :k]
+    first = top.argmax(axis=1)
+    return np.where(top.any(axis=1), 1.0 / (first + 1), 0.0)
+
+
+def ndcg_batch(hits: np.ndarray, k: int) -> np.ndarray:
+    """
+    Per-sample nDCG@k with binary relevance. The ideal ranking puts all relevant
+    results found in top-k first (chunks overlap, so one quote may hit several).
+    """
+    top = hits[:, :k].astype(float)
+    discounts = 1.0 / np.log2(np.arange(2, top.shape[1] + 2))
+    dcg = top @ discounts
+    ideal_counts = top.sum(axis=1).astype(int)
+    ideal = np.concatenate([[0.0], np.cumsum(discounts)])[ideal_counts]
+    return np.divide(dcg, ideal, out=np.zeros_like(dcg), where=ideal > 0)
+
+
+def answer_relevance_batch(answers: Sequence[str]) -> np.ndarray:
+    lengths = np.array([len(a.split()) for a in answers], dtype=float)
+    return np.minimum(1.0, lengths / 20)
+
+
+def faithfulness_batch(answers: Sequence[str], contexts: Sequence[Sequence[str]]) -> np.ndarray:
+    """Share of answer tokens found (as substrings) in the joined contexts, per sample."""
+    scores = np.zeros(len(answers))
+    for i, (answer, ctx) in enumerate(zip(answers, contexts)):
+        tokens = answer.lower().split()
+        if not tokens or not ctx:
+            continue
+        context_text = np.array(" ".join(ctx).lower(), dtype=str)
+        scores[i] = np.mean(np.char.find(context_text, np.array(tokens, dtype=str)) >= 0)
+    return scores
@@ -1,13 +1,17 @@
+import argparse
+import hashlib
 import json
 import os
 import random
 import re
-import pickle
 import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
-from pprint import pprint
 from statistics import mean
 
+import numpy as np
+
 from dotenv import load_dotenv
 
 # ---- Paths / environment ----
@@ -20,11 +24,22 @@ sys.path.insert(0, str(REPO_ROOT))
 # Load environment variables from repo root `.env`
 load_dotenv(dotenv_path=REPO_ROOT / ".env")
 
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+from app.backend.core import rag_graph
+from app.backend.core.metrics import track_request
 from app.backend.core.rag_graph import run_rag
-from evaluation.metrics import recall_at_k, answer_relevance, faithfulness
+from app.backend.services.chunk_store import open_chunk_store
+from app.backend.services.index_layout import resolve_index_dir
+from evaluation.metrics import (
+    answer_relevance_batch,
+    faithfulness_batch,
+    hit_matrix,
+    recall_at_k_batch,
+)
 
 DATASET_PATH = "evaluation/datasets/validation.json"
-RESULTS_PATH = "evaluation/results/results.json"
+RESULTS_PATH = "evaluation/results/results.jsonl"
 
 QUESTION_TEMPLATES = [
     "О чём говорится в этом отрывке?",
@@ -38,14 +53,14 @@ QUESTION_TEMPLATES = [
 ]
 
 
-def _load_index_chunks(store_pkl_path: Path):
-    """Load chunks (+ optional metadata) from the FAISS sidecar pickle."""
-    if not store_pkl_path.exists():
+def _load_index_chunks(index_dir: Path):
+    """Load chunks (+ optional metadata) from the index chunk store (or legacy store.pkl)."""
+    try:
+        chunk_store = open_chunk_store(resolve_index_dir(str(index_dir)))
+    except FileNotFoundError:
         return [], []
-    with open(store_pkl_path, "rb") as f:
-        meta = pickle.load(f)
-    chunks = meta.get("chunks", []) or []
-    metadata = meta.get("metadata", []) or []
+    chunks = [chunk_store.text(i) for i in range(len(chunk_store))]
+    metadata = [chunk_store.metadata(i) for i in range(len(chunk_store))]
     return chunks, metadata
 
 
@@ -71,8 +86,7 @@ def _pick_quote_from_chunk(text: str, min_len: int = 30, max_len: int = 120) ->
 
 def generate_validation_dataset(num_samples: int = 100):
     # Prefer sampling from the built index so questions match the corpus.
-    store_pkl = REPO_ROOT / "data" / "indexes" / "store.pkl"
-    chunks, metadata = _load_index_chunks(store_pkl)
+    chunks, metadata = _load_index_chunks(REPO_ROOT / "data" / "indexes")
 
     # Fallback (если индекс ещё не собран)
     fallback_texts = [
@@ -115,6 +129,7 @@ def generate_validation_dataset(num_samples: int = 100):
             )
 
         dataset.append({
+            "id": f"q{i + 1:04d}",
             "question": question,
             "ground_truth": ground_truth,
         })
@@ -126,47 +141,171 @@ def generate_validation_dataset(num_samples: int = 100):
     print(f"Validation dataset generated with {len(dataset)} examples.")
 
 
+def sample_id(sample: dict) -> str:
+    """Stable id for resume: explicit `id` or a hash of the question (old datasets have no ids)."""
+    return sample.get("id") or hashlib.sha1(sample["question"].encode("utf-8")).hexdigest()[:12]
+
+
+def load_done(path: str) -> dict:
+    """Already evaluated samples from the JSONL results (failed ones are retried)."""
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # недописанная строка после падения
+            if "error" not in record:
+                done[record["id"]] = record
+    return done
+
+
+def evaluate_sample(sample: dict, top_k: int) -> dict:
+    """Runs the RAG pipeline for one sample and scores it; called from worker threads."""
+    question = sample["question"]
+    ground_truth = sample["ground_truth"]
+    started = time.perf_counter()
+    try:
+        # кэш ответов выключаем: оцениваем сам пайплайн, а не попадания в кэш
+        with track_request() as timings:
+            state = run_rag(question, top_k=top_k, use_cache=False)
+    except Exception as exc:
+        return {"id": sample_id(sample), "question": question, "error": repr(exc),
+                "latency_s": time.perf_counter() - started}
+
+    answer = state.get("answer", "")
+    contexts = [p[0] if isinstance(p, tuple) else str(p) for p in state.get("passages", [])]
+    # те же функции и та же нормализация текста, что в run_retrieval_eval.py
+    hits = hit_matrix([contexts], [ground_truth])
+    return {
+        "id": sample_id(sample),
+        "question": question,
+        "answer": answer,
+        "recall@k": float(recall_at_k_batch(hits, len(contexts))[0]),
+        "answer_relevance": float(answer_relevance_batch([answer])[0]),
+        "faithfulness": float(faithfulness_batch([answer], [contexts])[0]),
+        "latency_s": time.perf_counter() - started,
+        "input_tokens": timings.tokens["input"],
+        "output_tokens": timings.tokens["output"],
+        "context_tokens_saved": timings.tokens["context_saved"],
+        "tool_calls": state.get("tool_calls", 0),
+    }
+
+
+def _fmt_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:d}:{seconds:02d}"
+
+
+def summarize(records: list, total: int) -> dict:
+    """Quality metrics plus latency percentiles and token usage over successful results."""
+    summary = {"evaluated": len(records), "errors": total - len(records)}
+    if not records:
+        return summary
+    latencies = np.array([r["latency_s"] for r in records])
+    summary.update({
+        "recall@k": mean(r["recall@k"] for r in records),
+        "answer_relevance": mean(r["answer_relevance"] for r in records),
+        "faithfulness": mean(r["faithfulness"] for r in records),
+        "latency_p50_s": float(np.percentile(latencies, 50)),
+        "latency_p95_s": float(np.percentile(latencies, 95)),
+        "input_tokens": sum(r["input_tokens"] for r in records),
+        "output_tokens": sum(r["output_tokens"] for r in records),
+        "tokens_per_question": mean(r["input_tokens"] + r["output_tokens"] for r in records),
+        # записи, возобновлённые из старого JSONL, этого поля не знают
+        "context_tokens_saved": sum(r.get("context_tokens_saved", 0) for r in records),
+    })
+    return summary
+
+
 def main():
-    if not os.path.exists(DATASET_PATH) or os.path.getsize(DATASET_PATH) == 0:
+    parser = argparse.ArgumentParser(description="Concurrent, resumable RAG evaluation")
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--out", default=RESULTS_PATH, help="JSONL with one result per question")
+    parser.add_argument("--workers", type=int, default=4, help="questions evaluated concurrently")
+    parser.add_argument("--rps", type=float, default=1.0, help="LLM requests per second (0 — no limit)")
+    parser.add_argument("--top-k", type=int, default=12)
+    parser.add_argument("--limit", type=int, default=0, help="evaluate only the first N questions")
+    parser.add_argument("--fresh", action="store_true", help="ignore existing results instead of resuming")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.dataset) or os.path.getsize(args.dataset) == 0:
         print("Validation dataset not found → generating automatically")
         generate_validation_dataset(num_samples=100)
 
-    with open(DATASET_PATH, "r", encoding="utf-8") as f:
+    with open(args.dataset, "r", encoding="utf-8") as f:
         dataset = json.load(f)
-
-    results = []
-    for sample in dataset:
-        question = sample["question"]
-        ground_truth = sample["ground_truth"]
-
-        print("\n==============================")
-        print("QUESTION:", question)
-
-        state = run_rag(question, top_k=12)
-        answer = state.get("answer", "")
-        passages = state.get("passages", [])
-
-        contexts = [p[0] if isinstance(p, tuple) else str(p) for p in passages]
-
-        metrics = {
-            "question": question,
-            "answer": answer,
-            "recall@k": recall_at_k(contexts, ground_truth),
-            "answer_relevance": answer_relevance(question, answer),
-            "faithfulness": faithfulness(answer, contexts),
-        }
-
-        pprint(metrics)
-        results.append(metrics)
-
-    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
-    with open(RESULTS_PATH, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.limit:
+        dataset = dataset[:args.limit]
+
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    if args.fresh and os.path.exists(args.out):
+        os.remove(args.out)
+    done = load_done(args.out)
+    todo = [s for s in dataset if sample_id(s) not in done]
+    print(f"Questions: {len(dataset)}, already evaluated: {len(dataset) - len(todo)}, to run: {len(todo)}")
+
+    if args.rps > 0:
+        # Общий лимит на все вызовы LLM (планировщик + генерация) из всех потоков
+        rag_graph.LLM.rate_limiter = InMemoryRateLimiter(
+            requests_per_second=args.rps,
+            check_every_n_seconds=0.05,
+            max_bucket_size=max(1.0, args.rps),
+        )
+
+    started = time.perf_counter()
+    finished = 0
+    with open(args.out, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        # В полёте не больше 2 * workers задач: очередь не разрастается на весь датасет
+        samples = iter(todo)
+        pending = set()
+        while True:
+            while len(pending) < 2 * args.workers:
+                sample = next(samples, None)
+                if sample is None:
+                    break
+                pending.add(pool.submit(evaluate_sample, sample, args.top_k))
+            if not pending:
+                break
+            completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in completed:
+                record = future.result()
+                # Строка дописывается сразу: падение не теряет уже посчитанное
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                finished += 1
+                elapsed = time.perf_counter() - started
+                eta = elapsed / finished * (len(todo) - finished)
+                status = f"error: {record['error']}" if "error" in record else f"recall={record['recall@k']:.0f}"
+                print(
+                    f"[{finished}/{len(todo)}] {record['id']} {record['latency_s']:.1f} s, {status} | "
+                    f"elapsed {_fmt_duration(elapsed)}, ETA {_fmt_duration(eta)}"
+                )
+
+    # Итог — по всем вопросам датасета, включая посчитанные в прошлых запусках
+    ids = {sample_id(s) for s in dataset}
+    records = [r for r in load_done(args.out).values() if r["id"] in ids]
+    summary = summarize(records, total=len(dataset))
+    with open(os.path.splitext(args.out)[0] + ".summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
 
     print("\n========== AVERAGE METRICS ==========")
-    print("Recall@K:", mean(r["recall@k"] for r in results))
-    print("Answer relevance:", mean(r["answer_relevance"] for r in results))
-    print("Faithfulness:", mean(r["faithfulness"] for r in results))
+    if not records:
+        print("No successful results")
+        return
+    print("Recall@K:", summary["recall@k"])
+    print("Answer relevance:", summary["answer_relevance"])
+    print("Faithfulness:", summary["faithfulness"])
+    print(f"Latency p50 / p95: {summary['latency_p50_s']:.2f} / {summary['latency_p95_s']:.2f} s")
+    print(
+        f"Tokens: input {summary['input_tokens']}, output {summary['output_tokens']}, "
+        f"{summary['tokens_per_question']:.0f} per question"
+    )
+    print(f"Context tokens saved by packing: {summary['context_tokens_saved']}")
+    if summary["errors"]:
+        print(f"Not evaluated (errors): {summary['errors']} — rerun to retry them")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+"""
+Retrieval-only evaluation and parameter sweep — no LLM calls.
+
+All validation questions are embedded once (through the query embedding cache),
+searched with multi-row FAISS searches and scored with recall@k, MRR and nDCG:
+a retrieved chunk is relevant if it contains the sample's ground-truth quote.
+
+Without sweep options the current index (INDEX_DIR) is evaluated as is.
+--chunking rebuilds an index per chunking config in INDEX_DIR/_sweep/ (passage
+embeddings come from the embedding cache, so only new chunks hit the model);
+--index-types / --ef-search / --nprobe rebuild FAISS over the same vectors.
+
+    python evaluation/run_retrieval_eval.py --k 1,4,12
+    python evaluation/run_retrieval_eval.py --chunking 400:80,800:160 \\
+        --index-types flat,hnsw,ivf --ef-search 32,128 --nprobe 4,16 --k 4,12
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_ROOT))
+load_dotenv(dotenv_path=REPO_ROOT / ".env")
+
+from app.backend.core.config import get_settings
+from app.backend.services.chunk_store import open_chunk_store
+from app.backend.services.index_layout import resolve_index_dir
+from app.backend.services.embeddings import embed_queries
+from app.data_processing.indexing.index_builder import create_index, default_nlist
+from evaluation.metrics import hit_matrix, mrr_batch, ndcg_batch, recall_at_k_batch
+from scripts.benchmark_index import load_vectors
+
+DATASET_PATH = "evaluation/datasets/validation.json"
+SWEEP_DIR = "_sweep"
+SWEEP_CONFIG_FILE = "sweep.json"
+LATENCY_SAMPLE = 200     # сколько запросов гонять по одному для p50/p95
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _chunkings(value: str) -> List[Tuple[int, int]]:
+    """"400:80,800:160" -> [(400, 80), (800, 160)]."""
+    pairs = []
+    for item in value.split(","):
+        if item.strip():
+            size, overlap = item.split(":")
+            pairs.append((int(size), int(overlap)))
+    return pairs
+
+
+_pages_cache: Optional[list] = None
+
+
+def _pages() -> list:
+    """Pages of RAW_DIR, parsed once for all chunking configs."""
+    global _pages_cache
+    if _pages_cache is None:
+        from app.data_processing.ingestion.book_parser import iter_pages
+
+        _pages_cache = list(iter_pages(get_settings().RAW_DIR))
+    return _pages_cache
+
+
+def sweep_index_dir(chunk_size: int, chunk_overlap: int) -> str:
+    """Index for a chunking config: built once in INDEX_DIR/_sweep/ and reused by later sweeps."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from app.data_processing.indexing.pipeline import build_index_streaming
+
+    index_dir = os.path.join(get_settings().INDEX_DIR, SWEEP_DIR, f"cs{chunk_size}_ov{chunk_overlap}")
+    config = {"chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    config_path = os.path.join(index_dir, SWEEP_CONFIG_FILE)
+    if os.path.exists(config_path) and os.path.exists(os.path.join(resolve_index_dir(index_dir), "index.faiss")):
+        with open(config_path, encoding="utf-8") as f:
+            if json.load(f) == config:
+                return index_dir
+
+    print(f"[Sweep] Строю индекс chunk_size={chunk_size}, overlap={chunk_overlap} -> {index_dir}")
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    build_index_streaming(_pages(), index_dir, split=splitter.split_text, fingerprint=config)
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f)
+    return index_dir
+
+
+def index_variants(base: np.ndarray, index_types: List[str], ef_search: List[int], nprobe: List[int], k: int):
+    """(name, search, index, params, build seconds) for every index type / search knob combination."""
+    for index_type in index_types:
+        nlist = default_nlist(len(base))
+        start = time.perf_counter()
+        index = create_index(base, index_type=index_type, nlist=nlist)
+        build_s = time.perf_counter() - start
+
+        if index_type == "hnsw":
+            for ef in ef_search:
+                yield index_type, f"efSearch={ef}", index, faiss.SearchParametersHNSW(efSearch=max(ef, k)), build_s
+        elif index_type == "ivf":
+            for probe in nprobe:
+                if probe <= nlist:
+                    yield f"ivf nlist={nlist}", f"nprobe={probe}", index, faiss.SearchParametersIVF(nprobe=probe), build_s
+        else:
+            yield index_type, "-", index, None, build_s
+
+
+def evaluate_variant(
+    index: faiss.Index,
+    params,
+    q_vecs: np.ndarray,
+    ground_truths: List[str],
+    text,
+    ks: List[int],
+) -> Dict[str, float]:
+    """Quality at every k and latency for one index; text(i) — chunk text by id."""
+    k_max = max(ks)
+    start = time.perf_counter()
+    _, idx = index.search(q_vecs, k_max, params=params)      # одним многострочным поиском
+    batch_ms = (time.perf_counter() - start) * 1000 / len(q_vecs)
+
+    single = []
+    for row in q_vecs[:LATENCY_SAMPLE]:
+        start = time.perf_counter()
+        index.search(row[None, :], k_max, params=params)
+        single.append((time.perf_counter() - start) * 1000)
+
+    texts = {int(i): text(int(i)) for i in np.unique(idx) if i >= 0}
+    contexts = [[texts[int(i)] for i in row if i >= 0] for row in idx]
+    hits = hit_matrix(contexts, ground_truths)
+
+    result = {
+        "batch_ms_per_query": batch_ms,
+        "p50_ms": float(np.percentile(single, 50)),
+        "p95_ms": float(np.percentile(single, 95)),
+    }
+    for k in ks:
+        result[f"recall@{k}"] = float(recall_at_k_batch(hits, k).mean())
+        result[f"mrr@{k}"] = float(mrr_batch(hits, k).mean())
+        result[f"ndcg@{k}"] = float(ndcg_batch(hits, k).mean())
+    return result
+
+
+def main() -> None:
+    s = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--k", type=_ints, default=[1, 4, 12])
+    parser.add_argument("--chunking", type=_chunkings, default=[], help="chunk_size:overlap,... (rebuilds indexes)")
+    parser.add_argument("--index-types", default="", help="flat,hnsw,ivf (default: the index as built)")
+    parser.add_argument("--ef-search", type=_ints, default=[s.HNSW_EF_SEARCH])
+    parser.add_argument("--nprobe", type=_ints, default=[s.IVF_NPROBE])
+    parser.add_argument("--out", default=None, help="save the table as JSON")
+    args = parser.parse_args()
+
+    with open(args.dataset, encoding="utf-8") as f:
+        dataset = json.load(f)
+    questions = [sample["question"] for sample in dataset]
+    ground_truths = [sample["ground_truth"] for sample in dataset]
+
+    start = time.perf_counter()
+    q_vecs = embed_queries(questions).astype("float32")
+    print(f"Вопросов: {len(questions)}, эмбеддинги за {time.perf_counter() - start:.1f} с (один проход)\n")
+
+    index_types = [t.strip() for t in args.index_types.split(",") if t.strip()]
+    k_max = max(args.k)
+    rows = []
+    for chunking in args.chunking or [None]:
+        index_dir = resolve_index_dir(sweep_index_dir(*chunking) if chunking else s.INDEX_DIR)
+        chunk_store = open_chunk_store(index_dir)
+        chunk_label = f"{chunking[0]}:{chunking[1]}" if chunking else "current"
+
+        if index_types:
+            base = load_vectors(os.path.join(index_dir, "index.faiss"))
+            variants = index_variants(base, index_types, args.ef_search, args.nprobe, k_max)
+        else:
+            index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+            variants = [(type(index).__name__, "-", index, None, 0.0)]
+
+        for name, search, index, params, build_s in variants:
+            result = evaluate_variant(index, params, q_vecs, ground_truths, chunk_store.text, args.k)
+            rows.append({
+                "chunking": chunk_label,
+                "chunks": len(chunk_store),
+                "index": name,
+                "search": search,
+                "build_s": build_s,
+                "memory_mb": len(faiss.serialize_index(index)) / 2**20,
+                **result,
+            })
+
+    quality = [f"{m}@{k}" for k in args.k for m in ("recall", "mrr", "ndcg")]
+    header = (
+        f"{'chunking':<10} {'чанков':>7} {'индекс':<18} {'поиск':<13} {'память, МБ':>10} "
+        f"{'мс/запр.':>9} {'p95, мс':>8} " + " ".join(f"{q:>9}" for q in quality)
+    )
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['chunking']:<10} {row['chunks']:>7} {row['index']:<18} {row['search']:<13} "
+            f"{row['memory_mb']:>10.2f} {row['batch_ms_per_query']:>9.3f} {row['p95_ms']:>8.3f} "
+            + " ".join(f"{row[q]:>9.3f}" for q in quality)
+        )
+
+    if args.out:
+        os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
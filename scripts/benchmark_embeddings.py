@@ -0,0 +1,142 @@
+"""
+Сравнение бэкендов эмбеддингов (torch / onnx / onnx-int8) на фрагментах текущего индекса.
+
+Каждый бэкенд запускается в отдельном процессе, чтобы время старта и пик RSS
+не смешивались (импорт torch сам по себе весит сотни МБ). Для каждого печатается:
+время загрузки, латентность одиночного запроса (p50/p95), пропускная способность
+батчами, пик RSS и согласие с эталоном torch: cosine между векторами одного текста
+и доля совпадающих соседей top-k при поиске по выборке.
+
+    python scripts/benchmark_embeddings.py --sample 500 --backends torch,onnx,onnx-int8
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from app.backend.core.config import get_settings
+from app.backend.services.chunk_store import open_chunk_store
+from app.backend.services.index_layout import resolve_index_dir
+
+
+def sample_texts(index_dir: str, n: int, seed: int) -> List[str]:
+    chunk_store = open_chunk_store(resolve_index_dir(index_dir))
+    rng = np.random.default_rng(seed)
+    ids = rng.choice(len(chunk_store), size=min(n, len(chunk_store)), replace=False)
+    return [f"passage: {chunk_store.text(int(i))}" for i in sorted(ids)]
+
+
+def run_worker(texts_path: str, out_path: str, batch_size: int, n_single: int) -> None:
+    """Выполняется в дочернем процессе с нужным EMBEDDING_BACKEND в окружении."""
+    with open(texts_path, encoding="utf-8") as f:
+        texts = json.load(f)
+
+    start = time.perf_counter()
+    from app.backend.services.embeddings import _get_model, embed
+
+    _get_model()
+    load_s = time.perf_counter() - start
+    embed(texts[:1])   # прогрев
+
+    latencies = []
+    for text in texts[:n_single]:
+        t = time.perf_counter()
+        embed([text.replace("passage: ", "query: ", 1)])
+        latencies.append(time.perf_counter() - t)
+
+    t = time.perf_counter()
+    vecs = np.concatenate([embed(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)])
+    throughput = len(texts) / (time.perf_counter() - t)
+
+    np.save(out_path + ".npy", vecs)
+    with open(out_path + ".json", "w") as f:
+        json.dump({
+            "load_s": load_s,
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p95_ms": float(np.percentile(latencies, 95) * 1000),
+            "texts_per_s": throughput,
+            "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }, f)
+
+
+def neighbor_overlap(ref: np.ndarray, other: np.ndarray, k: int) -> float:
+    """Доля общих соседей top-k (без самого текста) при поиске выборки по самой себе."""
+    k = min(k, len(ref) - 1)
+    if k <= 0:
+        return 1.0
+    ref_top = np.argsort(-(ref @ ref.T), axis=1)[:, 1:k + 1]
+    other_top = np.argsort(-(other @ other.T), axis=1)[:, 1:k + 1]
+    return float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(ref_top, other_top)]))
+
+
+def main() -> None:
+    s = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index-dir", default=s.INDEX_DIR)
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--sample", type=int, default=500, help="сколько фрагментов индекса взять")
+    parser.add_argument("--single", type=int, default=100, help="сколько одиночных запросов для латентности")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worker", nargs=2, metavar=("TEXTS", "OUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], args.worker[1], args.batch_size, args.single)
+        return
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    texts = sample_texts(args.index_dir, args.sample, args.seed)
+    print(f"Фрагментов: {len(texts)}, батч: {args.batch_size}, одиночных запросов: {min(args.single, len(texts))}\n")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        texts_path = os.path.join(tmp, "texts.json")
+        with open(texts_path, "w", encoding="utf-8") as f:
+            json.dump(texts, f, ensure_ascii=False)
+
+        for backend in backends:
+            out_path = os.path.join(tmp, backend)
+            env = {**os.environ, "EMBEDDING_BACKEND": backend}
+            proc = subprocess.run(
+                [sys.executable, __file__, "--worker", texts_path, out_path,
+                 "--batch-size", str(args.batch_size), "--single", str(args.single)],
+                env=env,
+            )
+            if proc.returncode != 0:
+                print(f"[{backend}] завершился с ошибкой, пропускаю\n")
+                continue
+            with open(out_path + ".json") as f:
+                results[backend] = json.load(f)
+            results[backend]["vecs"] = np.load(out_path + ".npy")
+
+    reference = results.get("torch", {}).get("vecs")
+    header = (
+        f"{'бэкенд':<10} {'загрузка, с':>11} {'p50, мс':>8} {'p95, мс':>8} {'текстов/с':>10} "
+        f"{'RSS, МБ':>8} {'cos ср.':>8} {'cos мин.':>8} {'top' + str(args.k):>6}"
+    )
+    print(header)
+    print("-" * len(header))
+    for backend, r in results.items():
+        if reference is not None:
+            cos = np.sum(reference * r["vecs"], axis=1)
+            agreement = f"{cos.mean():>8.4f} {cos.min():>8.4f} {neighbor_overlap(reference, r['vecs'], args.k):>6.3f}"
+        else:
+            agreement = f"{'-':>8} {'-':>8} {'-':>6}"
+        print(
+            f"{backend:<10} {r['load_s']:>11.2f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+            f"{r['texts_per_s']:>10.1f} {r['rss_mb']:>8.0f} {agreement}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Сравнение типов FAISS-индексов на одних и тех же эмбеддингах.
+
+Берёт векторы из собранного index.faiss, строит по ним flat / HNSW / IVF
+с разными параметрами и для каждого варианта печатает время сборки,
+размер индекса, QPS и recall@k относительно точного flat-поиска.
+
+    python scripts/benchmark_index.py --k 10 --ef-search 16,32,64,128 --nprobe 1,4,8,16
+    python scripts/benchmark_index.py --questions evaluation/datasets/validation.json
+"""
+
+import argparse
+import json
+import os
+import time
+from typing import List, Optional
+
+import faiss
+import numpy as np
+
+from app.backend.core.config import get_settings
+from app.backend.services.index_layout import resolve_index_dir
+from app.data_processing.indexing.index_builder import create_index, default_nlist
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def load_vectors(index_path: str) -> np.ndarray:
+    """Достаёт все векторы из сохранённого индекса (flat, HNSW или IVF)."""
+    index = faiss.read_index(index_path)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal).astype("float32")
+
+
+def make_queries(base: np.ndarray, nq: int, questions_path: Optional[str], seed: int) -> np.ndarray:
+    """
+    Запросы: настоящие вопросы из датасета (эмбеддинг с префиксом `query:`)
+    или случайные векторы базы с небольшим шумом.
+    """
+    if questions_path:
+        from app.backend.services.embeddings import embed
+
+        with open(questions_path, encoding="utf-8") as f:
+            questions = [sample["question"] for sample in json.load(f)][:nq]
+        return embed([f"query: {q}" for q in questions])
+
+    rng = np.random.default_rng(seed)
+    picked = base[rng.choice(len(base), size=min(nq, len(base)), replace=False)]
+    noisy = picked + rng.normal(scale=0.05, size=picked.shape).astype("float32")
+    faiss.normalize_L2(noisy)
+    return noisy
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(np.intersect1d(f[f >= 0], t[t >= 0])) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def timed_search(index: faiss.Index, queries: np.ndarray, k: int, params=None):
+    start = time.perf_counter()
+    _, idx = index.search(queries, k, params=params)
+    elapsed = time.perf_counter() - start
+    return idx, len(queries) / elapsed if elapsed > 0 else float("inf")
+
+
+def main() -> None:
+    s = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=os.path.join(resolve_index_dir(s.INDEX_DIR), "index.faiss"))
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nq", type=int, default=1000, help="число запросов")
+    parser.add_argument("--questions", default=None, help="JSON с вопросами (как validation.json)")
+    parser.add_argument("--hnsw-m", type=_ints, default=[16, 32])
+    parser.add_argument("--ef-search", type=_ints, default=[16, 32, 64, 128])
+    parser.add_argument("--nlist", type=_ints, default=[], help="по умолчанию ~4*sqrt(N)")
+    parser.add_argument("--nprobe", type=_ints, default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    base = load_vectors(args.index)
+    queries = make_queries(base, args.nq, args.questions, args.seed)
+    print(f"База: {base.shape[0]} векторов, dim={base.shape[1]}; запросов: {len(queries)}; k={args.k}\n")
+
+    rows = []
+
+    def build(index_type: str, **kwargs):
+        start = time.perf_counter()
+        index = create_index(base, index_type=index_type, **kwargs)
+        return index, time.perf_counter() - start, len(faiss.serialize_index(index))
+
+    flat, build_s, size = build("flat")
+    truth, qps = timed_search(flat, queries, args.k)
+    rows.append(("flat", "-", build_s, size, qps, 1.0))
+
+    for m in args.hnsw_m:
+        index, build_s, size = build("hnsw", hnsw_m=m)
+        for ef in args.ef_search:
+            params = faiss.SearchParametersHNSW(efSearch=max(ef, args.k))
+            found, qps = timed_search(index, queries, args.k, params)
+            rows.append((f"hnsw M={m}", f"efSearch={ef}", build_s, size, qps, recall_at_k(found, truth)))
+
+    for nlist in args.nlist or [default_nlist(len(base))]:
+        index, build_s, size = build("ivf", nlist=nlist)
+        for nprobe in args.nprobe:
+            if nprobe > nlist:
+                continue
+            params = faiss.SearchParametersIVF(nprobe=nprobe)
+            found, qps = timed_search(index, queries, args.k, params)
+            rows.append((f"ivf nlist={nlist}", f"nprobe={nprobe}", build_s, size, qps, recall_at_k(found, truth)))
+
+    header = f"{'индекс':<18} {'поиск':<14} {'сборка, с':>10} {'память, МБ':>11} {'QPS':>10} {'recall@' + str(args.k):>10}"
+    print(header)
+    print("-" * len(header))
+    for name, search, build_s, size, qps, recall in rows:
+        print(f"{name:<18} {search:<14} {build_s:>10.2f} {size / 2**20:>11.1f} {qps:>10.0f} {recall:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
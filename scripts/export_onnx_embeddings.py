@@ -0,0 +1,63 @@
+"""
+Экспорт модели эмбеддингов в ONNX для EMBEDDING_BACKEND=onnx / onnx-int8.
+
+Пишет в --out файлы model.onnx (fp32), model_quantized.onnx (динамическое
+int8-квантование весов) и tokenizer.json. Экспорту нужны torch, transformers
+и пакет onnx; на API-узлах потом достаточно onnxruntime и tokenizers.
+
+    python scripts/export_onnx_embeddings.py --out models/e5-base-onnx
+    EMBEDDING_BACKEND=onnx-int8 EMBEDDING_MODEL_PATH=models/e5-base-onnx make up
+"""
+
+import argparse
+import os
+
+from app.backend.core.config import get_settings
+from app.backend.services.onnx_encoder import MODEL_FILES
+
+
+def main() -> None:
+    s = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=s.EMBEDDING_MODEL)
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--no-quantize", action="store_true", help="не делать int8-версию")
+    args = parser.parse_args()
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(args.out, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    model = AutoModel.from_pretrained(args.model).eval()
+    tokenizer.save_pretrained(args.out)   # tokenizer.json для быстрого токенизатора
+
+    sample = tokenizer(["query: пример запроса"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = os.path.join(args.out, MODEL_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=args.opset,
+        )
+    print(f"[ONNX] fp32: {fp32_path} ({os.path.getsize(fp32_path) / 2**20:.0f} МБ)")
+
+    if not args.no_quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = os.path.join(args.out, MODEL_FILES["onnx-int8"])
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        print(f"[ONNX] int8: {int8_path} ({os.path.getsize(int8_path) / 2**20:.0f} МБ)")
+
+
+if __name__ == "__main__":
+    main()
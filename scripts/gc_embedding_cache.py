@@ -0,0 +1,46 @@
+"""
+Сборка мусора в кэше эмбеддингов фрагментов (EMBED_CACHE_PATH).
+
+Удаляет векторы, ключей которых нет в chunk_keys.npy ни одного из перечисленных
+индексов. По умолчанию живым считается только индекс из INDEX_DIR — все его
+хранящиеся версии (действующая и предыдущая).
+
+    python scripts/gc_embedding_cache.py --dry-run
+    python scripts/gc_embedding_cache.py --index-dir data/indexes --index-dir data/indexes_experiment
+"""
+
+import argparse
+import os
+
+from app.backend.core.config import get_settings
+from app.backend.services.embeddings import embedding_model_id
+from app.backend.services.index_layout import index_versions
+from app.data_processing.indexing.embedding_cache import KEYS_FILE, EmbeddingCache, read_chunk_keys
+
+
+def main() -> None:
+    s = get_settings()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cache", default=s.EMBED_CACHE_PATH)
+    parser.add_argument("--index-dir", action="append", default=None, help="можно указать несколько раз")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать, ничего не удалять")
+    args = parser.parse_args()
+
+    index_dirs = [version for d in args.index_dir or [s.INDEX_DIR] for version in index_versions(d)]
+    without_keys = [d for d in index_dirs if not os.path.exists(os.path.join(d, KEYS_FILE))]
+    if without_keys:
+        # Без списка ключей нельзя понять, какие векторы нужны индексу, — лучше ничего не удалять
+        raise SystemExit(f"Нет {KEYS_FILE} в: {', '.join(without_keys)}. Пересоберите индекс или уберите его из списка.")
+
+    live = read_chunk_keys(index_dirs)
+    cache = EmbeddingCache(args.cache, embedding_model_id())
+    total = cache.count()
+    removed = cache.gc(live, dry_run=args.dry_run)
+    cache.close()
+
+    action = "будет удалено" if args.dry_run else "удалено"
+    print(f"Векторов в кэше: {total}, используется индексами: {len(live)}, {action}: {removed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,37 @@
-import os
-from typing import List, Dict, Any
+import argparse
 from app.backend.core.config import get_settings
-from app.data_processing.ingestion.book_parser import load_raw_texts_with_metadata
-from app.data_processing.indexing.index_builder import build_faiss_with_metadata
+from app.data_processing.ingestion.book_parser import iter_pages
+from app.data_processing.indexing.pipeline import build_index_streaming
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+CHUNK_SIZE = 400
+CHUNK_OVERLAP = 80
+
 
 def main():
     s = get_settings()
-    splitter = RecursiveCharacterTextSplitter(chunk_size=400, chunk_overlap=80)
-
-    # Загружаем страницы с метаданными
-    pages = load_raw_texts_with_metadata(s.RAW_DIR)
-
-    # Создаем чанки с сохранением метаданных
-    chunks_with_metadata: List[Dict[str, Any]] = []
-
-    for page in pages:
-        # Разбиваем текст страницы на чанки
-        text_chunks = splitter.split_text(page["text"])
-
-        # Для каждого чанка сохраняем метаданные
-        for chunk_text in text_chunks:
-            chunks_with_metadata.append({
-                "text": chunk_text,
-                "page_number": page["page_number"],
-                "book_name": page["book_name"],
-                "filename": page["filename"]
-            })
-
-    print(f"Создано {len(chunks_with_metadata)} чанков из {len(pages)} страниц")
-    build_faiss_with_metadata(chunks_with_metadata, s.INDEX_DIR)
+    parser = argparse.ArgumentParser(description="Потоковая индексация книг из RAW_DIR в INDEX_DIR")
+    parser.add_argument("--resume", action="store_true", help="продолжить с последней контрольной точки")
+    parser.add_argument("--batch-size", type=int, default=256, help="чанков в одном батче эмбеддинга")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="контрольная точка каждые K батчей")
+    parser.add_argument("--ivf-train-size", type=int, default=50_000, help="сколько векторов копить для обучения IVF")
+    args = parser.parse_args()
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+
+    # Страницы идут генератором, чанки режутся на лету, эмбеддинги считаются батчами
+    build_index_streaming(
+        iter_pages(s.RAW_DIR),
+        s.INDEX_DIR,
+        split=splitter.split_text,
+        fingerprint={"chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP},
+        batch_size=args.batch_size,
+        checkpoint_every=args.checkpoint_every,
+        resume=args.resume,
+        ivf_train_size=args.ivf_train_size,
+    )
     print("Индексация завершена")
 
 
 if __name__ == "__main__":
-    main()                                                   
\ No newline at end of file
+    main()
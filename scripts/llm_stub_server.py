@@ -0,0 +1,157 @@
+"""
+Локальный OpenAI-совместимый stub LLM для проверки шлюза под нагрузкой — без сети.
+
+Отвечает на POST /v1/chat/completions (обычный и stream=true) содержимым
+FakeChatModel: валидный JSON для планировщика, шаблонный ответ для генератора.
+Задержка до первого токена и скорость выдачи — как у FakeChatModel (логнормальные).
+Сбои провайдера инжектируются: доля ответов 429 (с Retry-After) и 500, а также
+429 на всё, что сверх --max-concurrency одновременных запросов. GET /stats —
+счётчики запросов, ошибок и пиковая конкурентность.
+
+    python scripts/llm_stub_server.py --port 8090 --latency-ms 400 --rate-429 0.2 --max-concurrency 8
+    LLM_PROVIDER=openai LLM_BASE_URL=http://localhost:8090/v1 uvicorn app.backend.api.main:app
+"""
+
+import argparse
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from langchain_core.messages import convert_to_messages
+
+from app.backend.services.fake_llm import FakeChatModel
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="LLM stub")
+    model = FakeChatModel(
+        latency_ms=args.latency_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_s=args.tokens_per_s,
+        tokens_per_s_sigma=args.tokens_per_s_sigma,
+        answer_tokens=args.answer_tokens,
+        seed=args.seed,
+    )
+    rng = random.Random(args.seed)
+    stats: Dict[str, int] = {"requests": 0, "ok": 0, "429": 0, "500": 0, "in_flight": 0, "peak_in_flight": 0}
+
+    def error(status: int, message: str) -> JSONResponse:
+        stats[str(status)] += 1
+        headers = {"Retry-After": f"{args.retry_after:g}"} if status == 429 else {}
+        return JSONResponse({"error": {"message": message, "code": status}}, status_code=status, headers=headers)
+
+    def completion_chunk(completion_id: str, model_name: str, delta: Dict[str, Any], **extra: Any) -> str:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model_name,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": extra.pop("finish_reason", None)}],
+            **extra,
+        }
+        return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if stats["in_flight"] >= args.max_concurrency > 0:
+            return error(429, "Too many concurrent requests")
+        roll = rng.random()
+        if roll < args.rate_429:
+            return error(429, "Rate limit exceeded")
+        if roll < args.rate_429 + args.rate_500:
+            return error(500, "Internal server error")
+
+        messages = convert_to_messages(body.get("messages", []))
+        model_name = body.get("model", "stub")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        stats["in_flight"] += 1
+        stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+
+        if not body.get("stream"):
+            try:
+                response = await model.ainvoke(messages)
+            finally:
+                stats["in_flight"] -= 1
+            stats["ok"] += 1
+            usage = response.usage_metadata or {}
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model_name,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": response.content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": usage.get("input_tokens", 0),
+                    "completion_tokens": usage.get("output_tokens", 0),
+                    "total_tokens": usage.get("total_tokens", 0),
+                },
+            }
+
+        async def events():
+            try:
+                yield completion_chunk(completion_id, model_name, {"role": "assistant", "content": ""})
+                usage: Dict[str, int] = {}
+                async for chunk in model.astream(messages):
+                    if chunk.content:
+                        yield completion_chunk(completion_id, model_name, {"content": chunk.content})
+                    if chunk.usage_metadata:
+                        usage = chunk.usage_metadata
+                yield completion_chunk(
+                    completion_id, model_name, {},
+                    finish_reason="stop",
+                    usage={
+                        "prompt_tokens": usage.get("input_tokens", 0),
+                        "completion_tokens": usage.get("output_tokens", 0),
+                        "total_tokens": usage.get("total_tokens", 0),
+                    },
+                )
+                yield "data: [DONE]\n\n"
+                stats["ok"] += 1
+            finally:
+                stats["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    def models():
+        return {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="медиана времени до первого токена")
+    parser.add_argument("--latency-sigma", type=float, default=0.0)
+    parser.add_argument("--tokens-per-s", type=float, default=50.0)
+    parser.add_argument("--tokens-per-s-sigma", type=float, default=0.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--rate-500", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After у 429, секунд")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="429 сверх стольких одновременных (0 — без лимита)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import faiss
+import numpy as np
+import pytest
+
+from app.backend.services.chunk_store import ChunkStoreWriter
+from app.backend.services.lexical_index import build_lexical_index
+from app.backend.services.quote_index import build_quote_index
+from app.backend.services.vector_store import FaissStore
+
+# Маленький корпус: две книги, у первой соседние чанки одной страницы перекрываются
+PAGE = (
+    "Фродо взял кольцо и отправился в путь. Гэндальф шёл рядом и молчал. "
+    "Одно кольцо, чтоб править всеми, лежало у него в кармане. "
+    "Сэм нёс поклажу и пел песни про Шир."
+)
+CHUNKS = [
+    (PAGE[:125], 1, "Властелин колец", "lotr.pdf", 0),
+    (PAGE[55:], 1, "Властелин колец", "lotr.pdf", 55),
+    ("Кольцо всевластья искали орки Мордора, кольцо звало их.", 2, "Властелин колец", "lotr.pdf", 0),
+    ("Кольцо, кольцо и ещё раз кольцо: орки искали кольцо по всему Мордору.", 3, "Властелин колец", "lotr.pdf", 0),
+    ("Бильбо праздновал день рождения в Шире.", 5, "Хоббит", "hobbit.pdf", 0),
+]
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    """Индекс в формате ingest: хранилище чанков, FAISS со случайными векторами, BM25 и цитаты."""
+    writer = ChunkStoreWriter(str(tmp_path))
+    for text, page, book, filename, start in CHUNKS:
+        writer.append(text, page_number=page, book_name=book, filename=filename, char_start=start)
+    writer.close()
+
+    vecs = np.random.default_rng(0).standard_normal((len(CHUNKS), 8)).astype("float32")
+    faiss.normalize_L2(vecs)
+    index = faiss.IndexFlatIP(8)
+    index.add(vecs)
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+
+    texts = [chunk[0] for chunk in CHUNKS]
+    build_lexical_index(str(tmp_path), texts)
+    build_quote_index(str(tmp_path), texts)
+    return tmp_path
+
+
+@pytest.fixture
+def store(index_dir, monkeypatch):
+    """FaissStore над тестовым индексом вместо глобального из INDEX_DIR."""
+    from app.backend.core import retriever
+
+    test_store = FaissStore(str(index_dir / "index.faiss"), str(index_dir / "store.pkl"))
+    test_store.load()
+    monkeypatch.setattr(retriever, "store", test_store)
+    return test_store
@@ -0,0 +1,59 @@
+import time
+
+import numpy as np
+
+from app.backend.core import answer_cache
+from app.backend.core.answer_cache import SemanticAnswerCache
+from app.backend.core.config import get_settings
+
+
+def test_namespace_separates_llm_providers_and_servers(store, monkeypatch):
+    monkeypatch.setattr(answer_cache, "store", store)
+    settings = get_settings()
+    monkeypatch.setattr(settings, "LLM_MODEL", "same-model")
+
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "fake")
+    fake = answer_cache._namespace(4)
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "mistral")
+    mistral = answer_cache._namespace(4)
+    monkeypatch.setattr(settings, "LLM_PROVIDER", "openai")
+    monkeypatch.setattr(settings, "LLM_BASE_URL", "http://gpu-1:8000/v1")
+    server_1 = answer_cache._namespace(4)
+    monkeypatch.setattr(settings, "LLM_BASE_URL", "http://gpu-2:8000/v1")
+    server_2 = answer_cache._namespace(4)
+
+    assert len({fake, mistral, server_1, server_2}) == 4
+
+
+def _vec(*values):
+    vec = np.array(values, dtype="float32")
+    return vec / np.linalg.norm(vec)
+
+
+def test_expired_nearest_entry_does_not_hide_a_fresh_one(tmp_path, monkeypatch):
+    cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite"), threshold=0.9, ttl_seconds=100)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now - 500)
+    cache.store("ns", "старый", _vec(1, 0, 0), "старый ответ", [("t", 0.9, {})])
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.store("ns", "свежий", _vec(1, 0.1, 0), "свежий ответ", [("t", 0.9, {})])
+
+    hit = cache.lookup(_vec(1, 0, 0), "ns")
+    assert hit["answer"] == "свежий ответ"
+    assert cache.lookup(_vec(0, 0, 1), "ns") is None
+
+
+def test_expired_rows_are_purged_on_insert(tmp_path, monkeypatch):
+    cache = SemanticAnswerCache(str(tmp_path / "answers.sqlite"), threshold=0.9, ttl_seconds=100)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now - 500)
+    for i in range(3):
+        cache.store("ns", f"старый {i}", _vec(1, i, 0), "ответ", [("t", 0.9, {})])
+    assert cache.lookup(_vec(1, 0, 0), "ns") is not None   # тогда ещё живая запись
+
+    monkeypatch.setattr(time, "time", lambda: now)
+    cache.store("ns", "свежий", _vec(0, 1, 0), "ответ", [("t", 0.9, {})])
+
+    assert cache._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] == 1
+    assert cache.lookup(_vec(1, 0, 0), "ns") is None
+    assert cache._namespaces["ns"].row_ids == [4]
@@ -0,0 +1,45 @@
+import threading
+
+from pypdf import PdfWriter
+
+from app.data_processing.ingestion import book_parser
+
+
+def _write_pdf(path, n_pages):
+    writer = PdfWriter()
+    for _ in range(n_pages):
+        writer.add_blank_page(width=200, height=200)
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def test_corrupt_pdf_is_skipped(tmp_path, capsys):
+    _write_pdf(tmp_path / "1_Хоббит.pdf", 3)
+    (tmp_path / "2_Битая.pdf").write_bytes(b"not a pdf at all")
+
+    tasks = book_parser.plan_parse_tasks(str(tmp_path), pages_per_task=2)
+
+    assert [(t[1], t[3], t[4]) for t in tasks] == [("1_Хоббит.pdf", 0, 2), ("1_Хоббит.pdf", 2, 3)]
+    assert "2_Битая.pdf" in capsys.readouterr().out
+
+    pages = list(book_parser.iter_pages(str(tmp_path), workers=1, page_timeout=0))
+    assert [p["page_number"] for p in pages] == [1, 2, 3]
+
+
+def test_parsing_from_thread_with_timeout(tmp_path):
+    # SIGALRM в чужом потоке недоступен: разбор должен уйти в пул, а не упасть
+    _write_pdf(tmp_path / "book.pdf", 2)
+    result = {}
+
+    def run():
+        try:
+            result["pages"] = list(book_parser.iter_pages(str(tmp_path), workers=1, page_timeout=5))
+        except Exception as e:  # pragma: no cover - сообщение для assert
+            result["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join(timeout=60)
+
+    assert "error" not in result
+    assert [p["page_number"] for p in result["pages"]] == [1, 2]
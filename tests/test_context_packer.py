@@ -0,0 +1,91 @@
+import pytest
+
+from app.backend.core import context_packer, retriever
+from app.backend.core.config import get_settings
+from app.backend.core.context_packer import pack_context
+from app.backend.services.lexical_index import normalize_text
+from tests.conftest import PAGE
+
+
+@pytest.fixture
+def settings(monkeypatch):
+    settings = get_settings()
+    monkeypatch.setattr(settings, "CONTEXT_PACKING", True)
+    monkeypatch.setattr(settings, "CONTEXT_MIN_RELATIVE_SCORE", 0.85)
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 0)
+    return settings
+
+
+def meta(page, start=None, **extra):
+    m = {"page_number": page, "book_name": "B", "filename": "b.pdf", **extra}
+    if start is not None:
+        m["char_start"] = start
+    return m
+
+
+def test_overlapping_chunks_of_a_page_are_merged_in_place_of_the_best(settings):
+    passages = [
+        ("другая страница", 0.90, meta(2, 0)),
+        (PAGE[55:], 0.88, meta(1, 55)),
+        (PAGE[:125], 0.86, meta(1, 0)),
+    ]
+    packed, stats = pack_context(passages)
+
+    assert [p[0] for p in packed] == ["другая страница", PAGE]
+    assert packed[1][1] == 0.88
+    assert packed[1][2]["char_start"] == 0
+    assert stats["passages_before"] == 3 and stats["passages_after"] == 2
+    assert stats["tokens_saved"] > 0
+
+
+def test_exact_duplicates_are_dropped_without_offsets(settings):
+    packed, _ = pack_context([("текст", 0.9, meta(1)), ("текст", 0.88, meta(1)), ("иное", 0.87, meta(1))])
+    assert [p[0] for p in packed] == ["текст", "иное"]
+
+
+def test_relative_cutoff_applies_to_cosine_scores_only(settings):
+    passages = [
+        ("лучший", 0.90, meta(1)),
+        ("слабый", 0.50, meta(2)),
+        ("только BM25 в hybrid", 0.0, meta(3)),
+        ("кандидат BM25", 0.3, meta(4, match="lexical")),
+    ]
+    packed, _ = pack_context(passages)
+    assert [p[0] for p in packed] == ["лучший", "только BM25 в hybrid", "кандидат BM25"]
+
+
+def test_exact_quote_hits_survive_packing(settings, store):
+    quote = "Одно кольцо, чтоб править всеми"
+    hits = retriever._quote_search(quote, top_k=4)
+    assert normalize_text(quote) in normalize_text(hits[0][0])
+
+    packed, _ = pack_context(hits)
+    assert any(normalize_text(quote) in normalize_text(p[0]) for p in packed)
+    assert packed[0][2]["match"] == "exact"
+
+
+def test_budget_keeps_rank_order_and_exact_hits(settings, monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 10)
+    long = "x" * 200
+    passages = [
+        ("первый", 0.9, meta(1)),
+        (long, 0.89, meta(2)),
+        ("цитата " * 20, 1.0, meta(3, match="exact")),
+        ("короткий", 0.88, meta(4)),
+    ]
+    packed, stats = pack_context(passages)
+    assert [p[0] for p in packed] == ["первый", "цитата " * 20]
+    assert stats["tokens_after"] == sum(context_packer.estimate_tokens(p[0]) for p in packed)
+
+
+def test_first_passage_is_truncated_to_budget(settings, monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_TOKEN_BUDGET", 5)
+    packed, _ = pack_context([("y" * 100, 0.9, meta(1))])
+    assert packed == [("y" * 20, 0.9, meta(1))]
+
+
+def test_packing_can_be_disabled(settings, monkeypatch):
+    monkeypatch.setattr(settings, "CONTEXT_PACKING", False)
+    passages = [("a", 0.9, meta(1)), ("a", 0.1, meta(1))]
+    packed, stats = pack_context(passages)
+    assert packed == passages and stats["tokens_saved"] == 0
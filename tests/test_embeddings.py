@@ -0,0 +1,66 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.backend.services import embeddings
+from app.backend.services.embeddings import EmbeddingBatcher
+
+
+@pytest.fixture
+def slow_embed(monkeypatch):
+    """Модель эмбеддингов подменяется функцией с задержкой: батчеру важен только контракт embed()."""
+    started = threading.Event()
+
+    def fake_embed(texts):
+        started.set()
+        time.sleep(0.1)
+        return np.ones((len(texts), 4), dtype="float32")
+
+    monkeypatch.setattr(embeddings, "embed", fake_embed)
+    return started
+
+
+def test_cancelled_in_flight_embed_does_not_kill_batcher(slow_embed):
+    batcher = EmbeddingBatcher(max_batch_size=8, max_wait_ms=1)
+
+    async def cancel_in_flight():
+        task = asyncio.ensure_future(asyncio.wrap_future(batcher.submit("query: first")))
+        await asyncio.to_thread(slow_embed.wait, 2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_in_flight())
+
+    vec = batcher.submit("query: second").result(timeout=2)
+    assert vec.shape == (4,)
+    assert batcher._thread.is_alive()
+
+
+def test_cancelled_queued_embed_is_skipped(slow_embed):
+    batcher = EmbeddingBatcher(max_batch_size=8, max_wait_ms=50)
+    cancelled = batcher.submit("query: gone")
+    assert cancelled.cancel()
+
+    assert batcher.submit("query: kept").result(timeout=2).shape == (4,)
+    assert batcher._thread.is_alive()
+
+
+def test_model_error_goes_to_callers_and_batcher_survives(monkeypatch):
+    calls = []
+
+    def flaky_embed(texts):
+        calls.append(texts)
+        if len(calls) == 1:
+            raise RuntimeError("model failed")
+        return np.zeros((len(texts), 4), dtype="float32")
+
+    monkeypatch.setattr(embeddings, "embed", flaky_embed)
+    batcher = EmbeddingBatcher(max_batch_size=8, max_wait_ms=1)
+
+    with pytest.raises(RuntimeError):
+        batcher.submit("query: a").result(timeout=2)
+    assert batcher.submit("query: b").result(timeout=2).shape == (4,)
@@ -0,0 +1,110 @@
+import os
+import zlib
+
+import faiss
+import numpy as np
+import pytest
+
+from app.backend.core.config import get_settings
+from app.backend.services.chunk_store import open_chunk_store
+from app.backend.services.index_layout import (
+    CURRENT_FILE,
+    VERSIONS_DIR,
+    current_version,
+    publish_index,
+    resolve_index_dir,
+)
+from app.backend.services.vector_store import FaissStore
+from app.data_processing.indexing import pipeline
+
+
+def test_flat_layout_resolves_to_itself(tmp_path):
+    assert resolve_index_dir(str(tmp_path)) == str(tmp_path)
+
+
+def test_publish_switches_current_and_removes_stale_files(tmp_path):
+    (tmp_path / "index.faiss").write_bytes(b"old flat index")
+    (tmp_path / "chunks.bin").write_bytes(b"old chunks")
+    (tmp_path / "_sweep").mkdir()   # чужие директории не трогаем
+
+    for version in ("v1", "v2", "v3"):
+        build = tmp_path / "_building"
+        build.mkdir()
+        (build / "index.faiss").write_text(version)
+        publish_index(str(tmp_path), str(build), version)
+        assert current_version(str(tmp_path)) == version
+
+    assert resolve_index_dir(str(tmp_path)) == str(tmp_path / VERSIONS_DIR / "v3")
+    assert sorted(os.listdir(tmp_path / VERSIONS_DIR)) == ["v2", "v3"]
+    assert sorted(os.listdir(tmp_path)) == [CURRENT_FILE, "_sweep", VERSIONS_DIR]
+
+
+@pytest.fixture
+def fake_embed(monkeypatch):
+    monkeypatch.setattr(get_settings(), "EMBED_CACHE_ENABLED", False)
+    monkeypatch.setattr(get_settings(), "FAISS_INDEX_TYPE", "flat")
+    rng = np.random.default_rng(0)
+    monkeypatch.setattr(pipeline, "embed", lambda texts: rng.standard_normal((len(texts), 8)).astype("float32"))
+
+
+def _pages(texts):
+    return [{"text": t, "page_number": i + 1, "book_name": "B", "filename": "b.pdf"} for i, t in enumerate(texts)]
+
+
+def test_streaming_build_publishes_a_complete_version(tmp_path, fake_embed):
+    index_dir = str(tmp_path)
+    split = lambda text: [text]
+    pipeline.build_index_streaming(_pages(["первая сборка"]), index_dir, split=split, fingerprint={}, batch_size=1)
+    first = resolve_index_dir(index_dir)
+    pipeline.build_index_streaming(_pages(["вторая", "сборка"]), index_dir, split=split, fingerprint={}, batch_size=1)
+    second = resolve_index_dir(index_dir)
+
+    assert first != second and os.path.isdir(first)
+    assert not os.path.exists(os.path.join(index_dir, pipeline.STAGING_DIR))
+    store = FaissStore(os.path.join(index_dir, "index.faiss"), os.path.join(index_dir, "store.pkl"))
+    store.load()
+    assert store.index.ntotal == 2
+    assert store.version == os.path.basename(second)
+    assert store.chunk_store.text(1) == "сборка"
+
+
+def _text_vec(text):
+    seed = zlib.crc32(text.encode("utf-8"))
+    vec = np.random.default_rng(seed).standard_normal(8).astype("float32")
+    return vec / np.linalg.norm(vec)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw"])
+def test_resume_after_crash_between_index_and_state_write(tmp_path, monkeypatch, index_type):
+    monkeypatch.setattr(get_settings(), "EMBED_CACHE_ENABLED", False)
+    monkeypatch.setattr(get_settings(), "FAISS_INDEX_TYPE", index_type)
+    monkeypatch.setattr(pipeline, "embed", lambda texts: np.stack([_text_vec(t) for t in texts]))
+
+    checkpoint = pipeline.StreamingIndexBuilder.checkpoint
+    calls = []
+
+    def crashing_checkpoint(self, pages_done):
+        calls.append(pages_done)
+        if len(calls) == 2:
+            # Индекс и хранилище уже записаны, ingest_state.json — ещё нет
+            faiss.write_index(self.index, os.path.join(self.staging_dir, pipeline.INDEX_FILE))
+            self.writer.flush()
+            raise RuntimeError("процесс упал")
+        checkpoint(self, pages_done)
+
+    monkeypatch.setattr(pipeline.StreamingIndexBuilder, "checkpoint", crashing_checkpoint)
+    texts = [f"страница номер {i}" for i in range(7)]
+    build = dict(split=lambda text: [text], fingerprint={}, batch_size=1, checkpoint_every=2)
+    with pytest.raises(RuntimeError):
+        pipeline.build_index_streaming(_pages(texts), str(tmp_path), **build)
+
+    monkeypatch.setattr(pipeline.StreamingIndexBuilder, "checkpoint", checkpoint)
+    total = pipeline.build_index_streaming(_pages(texts), str(tmp_path), resume=True, **build)
+
+    version_dir = resolve_index_dir(str(tmp_path))
+    index = faiss.read_index(os.path.join(version_dir, "index.faiss"))
+    chunk_store = open_chunk_store(version_dir)
+    assert total == index.ntotal == len(chunk_store) == len(texts)
+    for i in range(len(texts)):
+        assert chunk_store.text(i) == texts[i]
+        np.testing.assert_allclose(index.reconstruct(i), _text_vec(f"passage: {texts[i]}"), atol=1e-6)
@@ -0,0 +1,281 @@
+import argparse
+import asyncio
+import threading
+import time
+from typing import Any, List
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_mistralai import ChatMistralAI
+from pydantic import PrivateAttr
+
+from app.backend.api import main
+from app.backend.services.llm_gateway import (
+    LLMGateway,
+    LLMUnavailableError,
+    _CircuitBreaker,
+    _Slots,
+    _TokenBucket,
+)
+from scripts.llm_stub_server import create_app
+
+
+def _http_error(status: int, retry_after: str = "") -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    headers = {"retry-after": retry_after} if retry_after else {}
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=response)
+
+
+class ScriptedModel(BaseChatModel):
+    """Отвечает по сценарию: исключение бросается, строка становится ответом."""
+
+    outcomes: List[Any]
+    _calls: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted"
+
+    @property
+    def calls(self) -> int:
+        return self._calls
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        outcome = self.outcomes[min(self._calls, len(self.outcomes) - 1)]
+        self._calls += 1
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=outcome))])
+
+
+def _gateway(model: BaseChatModel, **kwargs: Any) -> LLMGateway:
+    params = dict(retry_base_s=0.001, retry_max_s=0.01, queue_timeout_s=5.0)
+    params.update(kwargs)
+    return LLMGateway(llm=model, **params)
+
+
+# ---- очередь слотов ----
+
+def test_slots_are_granted_in_fifo_order():
+    slots = _Slots(1)
+    slots.acquire(timeout=1)
+    order = []
+
+    def waiter(i: int) -> None:
+        slots.acquire(timeout=5)
+        order.append(i)
+        slots.release()
+
+    threads = []
+    for i in range(3):
+        thread = threading.Thread(target=waiter, args=(i,))
+        thread.start()
+        threads.append(thread)
+        while len(slots._waiters) < i + 1:   # следующий встаёт в очередь только после этого
+            time.sleep(0.001)
+
+    slots.release()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == [0, 1, 2]
+
+
+def test_slot_wait_timeout_does_not_leak_slot():
+    slots = _Slots(1)
+    slots.acquire(timeout=1)
+    with pytest.raises(TimeoutError):
+        slots.acquire(timeout=0.01)
+    slots.release()
+    slots.acquire(timeout=0)   # слот свободен, ушедший по таймауту его не занял
+    assert not slots._waiters
+
+
+# ---- token bucket ----
+
+def test_token_bucket_reserve_and_refund():
+    bucket = _TokenBucket(rate_per_s=10, capacity=2)
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == 0.0
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)   # в долг: ждать 1 / rate
+
+    bucket.refund(1)
+    assert bucket.reserve(1) == pytest.approx(0.1, abs=0.01)
+
+
+# ---- повторы ----
+
+def test_retries_transient_errors_until_success():
+    model = ScriptedModel(outcomes=[_http_error(429), _http_error(503), httpx.ConnectError("reset"), "ok"])
+    gateway = _gateway(model, max_retries=4)
+
+    assert gateway.invoke("вопрос").content == "ok"
+    assert model.calls == 4
+
+
+def test_client_error_is_not_retried():
+    model = ScriptedModel(outcomes=[_http_error(400), "ok"])
+    gateway = _gateway(model, max_retries=4)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        gateway.invoke("вопрос")
+    assert model.calls == 1
+
+
+def test_retries_give_up_after_max_retries():
+    model = ScriptedModel(outcomes=[_http_error(500)])
+    gateway = _gateway(model, max_retries=2, breaker_threshold=0)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        gateway.invoke("вопрос")
+    assert model.calls == 3
+
+
+def test_backoff_uses_full_jitter_and_retry_after():
+    gateway = _gateway(
+        ScriptedModel(outcomes=["ok"]), retry_base_s=1.0, retry_max_s=4.0, max_retries=10, breaker_threshold=0
+    )
+    deadline = time.monotonic() + 60
+
+    delays = [gateway._backoff(_http_error(503), attempt=5, deadline=deadline) for _ in range(50)]
+    assert all(0.0 <= d <= 4.0 for d in delays)   # не больше retry_max_s
+    assert len(set(delays)) > 1                   # джиттер, а не фиксированная пауза
+
+    assert gateway._backoff(_http_error(429, retry_after="7"), attempt=0, deadline=deadline) >= 7.0
+
+
+def test_backoff_does_not_wait_past_deadline():
+    gateway = _gateway(ScriptedModel(outcomes=["ok"]), breaker_threshold=0)
+    error = _http_error(429, retry_after="30")
+    with pytest.raises(httpx.HTTPStatusError):
+        gateway._backoff(error, attempt=0, deadline=time.monotonic() + 1)
+
+
+# ---- предохранитель ----
+
+def test_breaker_opens_and_lets_one_trial_through():
+    breaker = _CircuitBreaker(threshold=2, cooldown_s=0.05)
+    breaker.failure()
+    breaker.check()
+    breaker.failure()
+
+    with pytest.raises(LLMUnavailableError) as info:
+        breaker.check()
+    assert info.value.retry_after >= 1.0
+
+    time.sleep(0.06)
+    breaker.check()                              # полуоткрыт: пробный вызов проходит
+    with pytest.raises(LLMUnavailableError):
+        breaker.check()                          # второй — нет, пока пробный не завершился
+
+    breaker.failure()                            # пробный упал — снова открыт
+    with pytest.raises(LLMUnavailableError):
+        breaker.check()
+
+    time.sleep(0.06)
+    breaker.check()
+    breaker.success()                            # пробный удался — закрыт
+    breaker.check()
+    breaker.check()
+
+
+def test_open_breaker_rejects_without_calling_model():
+    model = ScriptedModel(outcomes=[_http_error(503)])
+    gateway = _gateway(model, max_retries=0, breaker_threshold=2, breaker_cooldown_s=60)
+
+    for _ in range(2):
+        with pytest.raises(httpx.HTTPStatusError):
+            gateway.invoke("вопрос")
+    with pytest.raises(LLMUnavailableError):
+        gateway.invoke("вопрос")
+    assert model.calls == 2
+
+
+# ---- ответ API ----
+
+def test_unavailable_llm_maps_to_503_with_retry_after(monkeypatch):
+    async def unavailable(*args, **kwargs):
+        raise LLMUnavailableError("LLM circuit breaker is open", retry_after=2.4)
+
+    monkeypatch.setattr(main, "arun_rag", unavailable)
+    response = TestClient(main.app).post("/ask", json={"question": "Кто нёс кольцо?"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "2"
+    assert "circuit breaker" in response.json()["detail"]
+
+
+def test_queue_timeout_is_reported_as_unavailable():
+    gateway = _gateway(ScriptedModel(outcomes=["ok"]), max_concurrency=1, queue_timeout_s=0.05)
+    gateway._slots.acquire(timeout=1)   # единственный слот занят
+    try:
+        with pytest.raises(LLMUnavailableError) as info:
+            gateway.invoke("вопрос")
+    finally:
+        gateway._slots.release()
+    assert info.value.retry_after == 1.0
+
+
+# ---- шлюз против stub-провайдера (scripts/llm_stub_server.py) ----
+
+def _stub(**overrides: Any) -> FastAPI:
+    args = dict(
+        latency_ms=0.0, latency_sigma=0.0, tokens_per_s=0.0, tokens_per_s_sigma=0.0, answer_tokens=5,
+        rate_429=0.0, rate_500=0.0, retry_after=0.3, max_concurrency=0, seed=1,
+    )
+    args.update(overrides)
+    return create_app(argparse.Namespace(**args))
+
+
+def _stub_gateway(stub: FastAPI, **kwargs: Any) -> LLMGateway:
+    """Тот же клиент, что у LLM_PROVIDER=openai, но запросы идут в stub через ASGI."""
+    async_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://stub/v1")
+    return _gateway(ChatMistralAI(model="stub", api_key="local", async_client=async_client), **kwargs)
+
+
+def _stub_stats(stub: FastAPI) -> dict:
+    return TestClient(stub).get("/stats").json()
+
+
+def test_gateway_retries_stub_429_after_retry_after():
+    # seed=1: первый запрос попадает в долю 429, второй — нет
+    stub = _stub(rate_429=0.5, retry_after=0.3)
+    gateway = _stub_gateway(stub, max_retries=3)
+
+    started = time.monotonic()
+    response = asyncio.run(gateway.ainvoke("Кто нёс кольцо?"))
+
+    assert response.content
+    assert time.monotonic() - started >= 0.3   # пауза не короче Retry-After, а не джиттер в миллисекунды
+    stats = _stub_stats(stub)
+    assert (stats["requests"], stats["429"], stats["ok"]) == (2, 1, 1)
+
+
+def test_gateway_recovers_from_stub_concurrency_429():
+    stub = _stub(latency_ms=100.0, max_concurrency=1, retry_after=0.2)
+    gateway = _stub_gateway(stub, max_concurrency=2, max_retries=3)
+
+    async def ask_twice():
+        return await asyncio.gather(gateway.ainvoke("первый"), gateway.ainvoke("второй"))
+
+    assert all(r.content for r in asyncio.run(ask_twice()))
+    stats = _stub_stats(stub)
+    assert stats["429"] >= 1 and stats["ok"] == 2
+    assert stats["peak_in_flight"] == 1
+
+
+def test_gateway_concurrency_limit_avoids_stub_429():
+    stub = _stub(latency_ms=50.0, max_concurrency=1)
+    gateway = _stub_gateway(stub, max_concurrency=1, max_retries=0)
+
+    async def ask_three():
+        return await asyncio.gather(*(gateway.ainvoke(f"вопрос {i}") for i in range(3)))
+
+    assert len(asyncio.run(ask_three())) == 3
+    stats = _stub_stats(stub)
+    assert (stats["429"], stats["ok"]) == (0, 3)
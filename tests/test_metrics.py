@@ -0,0 +1,27 @@
+from evaluation.metrics import (
+    answer_relevance,
+    answer_relevance_batch,
+    faithfulness,
+    faithfulness_batch,
+    hit_matrix,
+    recall_at_k,
+    recall_at_k_batch,
+)
+
+
+def test_recall_matches_hit_matrix_across_line_breaks():
+    contexts = ["Три кольца — премудрым эльфам\nпод небом", "Семь — властителям гномов"]
+    quote = "премудрым  эльфам под небом"
+
+    assert recall_at_k(contexts, quote) == 1.0
+    assert recall_at_k_batch(hit_matrix([contexts], [quote]), 2)[0] == 1.0
+    assert recall_at_k(contexts, "Девять — смертным") == 0.0
+    assert recall_at_k([], quote) == 0.0
+
+
+def test_batch_metrics_match_single_sample():
+    answer = "Кольцо выковал Саурон"
+    contexts = ["кольцо выковал Саурон в Мордоре"]
+
+    assert answer_relevance_batch([answer])[0] == answer_relevance("вопрос", answer)
+    assert faithfulness_batch([answer], [contexts])[0] == faithfulness(answer, contexts)
@@ -0,0 +1,41 @@
+import numpy as np
+
+from app.backend.services.query_cache import QueryEmbeddingCache
+
+
+def _cache(tmp_path, max_rows):
+    # Кэш в памяти выключен: проверяем только дисковый уровень
+    return QueryEmbeddingCache("model", max_size=0, disk_dir=str(tmp_path), disk_max_rows=max_rows)
+
+
+def _vec(i):
+    return np.full(4, i, dtype="float32")
+
+
+def test_disk_tier_evicts_oldest_entries_at_cap(tmp_path):
+    cache = _cache(tmp_path, max_rows=4)
+    keys = [cache.key(f"вопрос {i}") for i in range(6)]
+    for i, key in enumerate(keys):
+        cache.put(key, _vec(i))
+
+    assert [cache.get(key) is None for key in keys] == [True, True, False, False, False, False]
+    np.testing.assert_array_equal(cache.get(keys[5]), _vec(5))
+    assert len(cache._disk) <= 4
+
+
+def test_other_process_never_reads_a_vector_of_another_key_after_eviction(tmp_path):
+    writer, reader = _cache(tmp_path, max_rows=4), _cache(tmp_path, max_rows=4)
+    keys = [reader.key(f"вопрос {i}") for i in range(8)]
+    for i in range(4):
+        writer.put(keys[i], _vec(i))
+    np.testing.assert_array_equal(reader.get(keys[3]), _vec(3))   # reader запомнил строки ключей
+
+    for i in range(4, 8):   # вытеснение переписывает файл, строки сдвигаются
+        writer.put(keys[i], _vec(i))
+
+    for i in range(8):
+        vec = reader.get(keys[i])
+        if i >= 4:
+            np.testing.assert_array_equal(vec, _vec(i))   # новые записи видны после перечитывания
+        else:
+            assert vec is None or np.array_equal(vec, _vec(i))
@@ -0,0 +1,59 @@
+import asyncio
+import json
+from concurrent.futures import Future
+
+import pytest
+from langchain_core.messages import AIMessage
+
+from app.backend.core import rag_graph
+
+
+class _PlannerLLM:
+    def __init__(self, content: str) -> None:
+        self.content = content
+
+    def invoke(self, messages):
+        return AIMessage(content=self.content)
+
+    async def ainvoke(self, messages):
+        return AIMessage(content=self.content)
+
+
+@pytest.fixture
+def speculative(monkeypatch):
+    """Спекулятивный retrieve, который не успевает завершиться до ответа планировщика."""
+    future = Future()
+    monkeypatch.setattr(rag_graph._settings, "SPECULATIVE_RETRIEVAL", True)
+    monkeypatch.setattr(rag_graph, "submit_retrieve", lambda *args: future)
+    return future
+
+
+def _state():
+    return {"question": "Кто нёс кольцо?", "top_k": 4, "messages": [], "tool_results": {}}
+
+
+def _plan(monkeypatch, content, use_async):
+    monkeypatch.setattr(rag_graph, "LLM", _PlannerLLM(content))
+    if use_async:
+        return asyncio.run(rag_graph.aplanner_node(_state()))
+    return rag_graph.planner_node(_state())
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_malformed_planner_json_cancels_speculative_retrieval(monkeypatch, speculative, use_async):
+    with pytest.raises(json.JSONDecodeError):
+        _plan(monkeypatch, "не json", use_async)
+    assert speculative.cancelled()
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_answer_decision_cancels_speculative_retrieval(monkeypatch, speculative, use_async):
+    update = _plan(monkeypatch, json.dumps({"decision": "answer"}), use_async)
+    assert "speculative" not in update
+    assert speculative.cancelled()
+
+
+def test_tool_decision_hands_speculative_retrieval_to_tools(monkeypatch, speculative):
+    update = _plan(monkeypatch, json.dumps({"decision": "tool", "tool_name": "retrieve"}), False)
+    assert update["speculative"]["future"] is speculative
+    assert not speculative.cancelled()
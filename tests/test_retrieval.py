@@ -0,0 +1,48 @@
+import asyncio
+
+from app.backend.core import retriever
+from app.backend.core.mcp_tools import acall_tool_from_llm, call_tool_from_llm
+from app.backend.core.retriever import extract_quote, is_confident_retrieval
+from app.backend.services.lexical_index import normalize_text
+
+QUOTE = "Одно кольцо, чтоб править всеми"
+
+
+def test_extract_quote():
+    assert extract_quote(f"Где сказано «{QUOTE}»?") == QUOTE
+    assert extract_quote("Кто такой «Фродо»?") is None   # одно слово — не цитата
+
+
+def test_quote_index_finds_verbatim_phrase(store):
+    matches = store.find_quote("одно КОЛЬЦО чтоб править всеми")
+    assert [m["metadata"]["page_number"] for m in matches] == [1, 1]
+    assert all(normalize_text(QUOTE) in normalize_text(m["text"]) for m in matches)
+    assert store.find_quote("кольцо в Мордоре лежало") == []
+
+
+def test_quote_index_respects_book_filter(store):
+    assert store.find_quote(QUOTE, books=["hobbit.pdf"]) == []
+    assert len(store.find_quote(QUOTE, books=["lotr.pdf"])) == 2
+
+
+def test_quote_search_scores_are_monotone_with_exact_hits_on_top(store):
+    hits = retriever._quote_search("искали орки Мордора", top_k=4)
+    scores = [score for _, score, _ in hits]
+    assert scores == sorted(scores, reverse=True)
+    assert scores[0] == 1.0
+    assert all(0 <= score <= retriever._FUZZY_QUOTE_MAX_SCORE for score in scores[1:])
+
+
+def test_fuzzy_quote_candidates_are_not_confident(store):
+    hits = retriever._quote_search("орки Мордора звали кольцо", top_k=4)
+    assert hits and max(score for _, score, _ in hits) <= retriever._FUZZY_QUOTE_MAX_SCORE
+    assert not is_confident_retrieval(hits)
+
+
+def test_find_quote_tool_needs_quoted_span(store):
+    result = call_tool_from_llm("find_quote", {"query": "Что лежало у Фродо в кармане?"})
+    assert result["passages"] == [] and "retrieve" in result["error"]
+
+    result = asyncio.run(acall_tool_from_llm("find_quote", {"query": f"Где сказано «{QUOTE}»?", "top_k": 4}))
+    assert len(result["passages"]) == 2
+    assert all(meta["match"] == "exact" for _, _, meta in result["passages"])
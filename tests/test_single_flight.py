@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.backend.core.single_flight import SingleFlight, coalesce_key
+
+
+class _CountingFlight(SingleFlight):
+    """SingleFlight, который считает присоединившихся ведомых."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.followers = 0
+
+    def _join(self, key):
+        future, leader = super()._join(key)
+        if not leader:
+            self.followers += 1
+        return future, leader
+
+    def wait_followers(self, n: int) -> None:
+        while self.followers < n:
+            time.sleep(0.001)
+
+
+def test_coalesce_key_normalizes_question():
+    assert coalesce_key("Где ЖИЛ Бильбо?", 5) == coalesce_key("где жил бильбо", 5)
+    assert coalesce_key("где жил бильбо", 5) != coalesce_key("где жил бильбо", 8)
+    assert coalesce_key("где жил бильбо", 5, ["hobbit.pdf"]) != coalesce_key("где жил бильбо", 5)
+
+
+def test_sync_calls_share_one_computation():
+    flight = _CountingFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return "ответ"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.run("k", compute)))
+    leader.start()
+    started.wait(timeout=5)
+    followers = [threading.Thread(target=lambda: results.append(flight.run("k", compute))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    flight.wait_followers(3)   # ведомые ждут Future ведущего
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(timeout=5)
+
+    assert results == ["ответ"] * 4
+    assert len(calls) == 1
+    assert not flight._calls   # ключ освобождён: следующий запрос считается заново
+
+
+def test_sync_leader_error_reaches_followers():
+    flight = _CountingFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(timeout=5)
+        raise ValueError("граф упал")
+
+    errors = []
+
+    def call():
+        try:
+            flight.run("k", compute)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(timeout=5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    flight.wait_followers(1)
+    release.set()
+    leader.join(timeout=5)
+    follower.join(timeout=5)
+
+    assert errors == ["граф упал", "граф упал"]
+    assert flight.run("k", lambda: "снова") == "снова"
+
+
+def test_async_calls_share_one_computation():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def main():
+        return await asyncio.gather(*(flight.arun("k", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["ответ"] * 5
+    assert len(calls) == 1
+
+
+def test_async_leader_cancellation_does_not_cancel_followers():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def main():
+        leader = asyncio.ensure_future(flight.arun("k", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.arun("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()   # клиент ведущего отключился
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "ответ"
+
+
+def test_async_error_reaches_followers():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise ValueError("граф упал")
+
+    async def main():
+        return await asyncio.gather(*(flight.arun("k", compute) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert [str(r) for r in results] == ["граф упал"] * 3
+    assert all(isinstance(r, ValueError) for r in results)
@@ -0,0 +1,52 @@
+import faiss
+import numpy as np
+
+from app.backend.services import vector_store
+from app.backend.services.chunk_store import ChunkStoreWriter
+from app.backend.services.vector_store import FaissStore
+from app.data_processing.indexing.index_builder import create_index
+
+
+def test_index_is_read_through_mmap_and_searchable(store):
+    if hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        assert vector_store._MMAP_FLAG == faiss.IO_FLAG_MMAP_IFC
+    ids, _ = store.search_ids(store.index.reconstruct(0)[None, :], k=1)
+    assert ids[0] == 0
+
+
+def test_book_filter_limits_search(store):
+    vec = np.ones((1, store.index.d), dtype="float32")
+    faiss.normalize_L2(vec)
+    ids, _ = store.search_ids(vec, k=5, books=["hobbit.pdf"])
+    assert [i for i in ids if i != -1] == [4]
+
+
+def test_hnsw_filter_by_two_books_keeps_recall(tmp_path):
+    # Три книги подряд; выбираем первую и третью — два несмежных диапазона, IDSelectorOr
+    books, per_book, dim, k = ["a.pdf", "b.pdf", "c.pdf"], 300, 16, 10
+    writer = ChunkStoreWriter(str(tmp_path))
+    for book in books:
+        for i in range(per_book):
+            writer.append(f"{book} {i}", page_number=i + 1, book_name=book, filename=book)
+    writer.close()
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((len(books) * per_book, dim)).astype("float32")
+    faiss.normalize_L2(vecs)
+    index = create_index(vecs, index_type="hnsw", hnsw_m=16, ef_construction=40)
+    faiss.write_index(index, str(tmp_path / "index.faiss"))
+
+    store = FaissStore(str(tmp_path / "index.faiss"), str(tmp_path / "store.pkl"))
+    store.load()
+    selected = ["a.pdf", "c.pdf"]
+    sel, _keep = store.book_selector(selected)
+    assert isinstance(sel, faiss.IDSelectorOr)
+
+    allowed = np.r_[0:per_book, 2 * per_book:3 * per_book]
+    queries = rng.standard_normal((20, dim)).astype("float32")
+    faiss.normalize_L2(queries)
+    ids, _ = store.search_batch_ids(queries, k, books=selected)
+
+    assert np.isin(ids, allowed).all()
+    exact = allowed[np.argsort(-(queries @ vecs[allowed].T), axis=1)[:, :k]]
+    recall = np.mean([len(set(found) & set(truth)) / k for found, truth in zip(ids, exact)])
+    assert recall >= 0.9